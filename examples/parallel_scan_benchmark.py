@@ -0,0 +1,57 @@
+"""
+Compare the sequential predict/update loop with the parallel-in-time (associative scan) engine as the length of the
+series grows:
+
+```
+python examples/parallel_scan_benchmark.py
+```
+"""
+import time
+
+import torch
+
+from torch_kalman.kalman_filter import KalmanFilter
+from torch_kalman.process import LocalLevel, LocalTrend
+
+torch.manual_seed(2020 - 2 - 7)
+
+
+def make_kf() -> KalmanFilter:
+    return KalmanFilter(
+        processes=[
+            LocalTrend(id='trend').add_measure('y1'),
+            LocalLevel(id='level').add_measure('y2')
+        ],
+        measures=['y1', 'y2']
+    )
+
+
+def timeit(fun, num_repeats: int = 3) -> float:
+    best = float('inf')
+    for _ in range(num_repeats):
+        start = time.time()
+        fun()
+        best = min(best, time.time() - start)
+    return best
+
+
+def main(num_groups: int = 4, num_timesteps_list=(100, 1000, 10000, 100000), device: str = 'cpu'):
+    kf = make_kf().to(device)
+    print(f"{'timesteps':>10} {'sequential (s)':>15} {'parallel (s)':>13} {'max abs diff':>13}")
+    for num_timesteps in num_timesteps_list:
+        y = torch.cumsum(torch.randn((num_groups, num_timesteps, 2), device=device), 1)
+        y[:, ::7, 0] = float('nan')
+
+        with torch.no_grad():
+            pred_seq = kf(y)
+            pred_par = kf(y, parallel=True)
+            max_diff = (pred_seq.means - pred_par.means).abs().max().item()
+
+            time_seq = timeit(lambda: kf(y).means)
+            time_par = timeit(lambda: kf(y, parallel=True).means)
+
+        print(f"{num_timesteps:>10,} {time_seq:>15.3f} {time_par:>13.3f} {max_diff:>13.2e}")
+
+
+if __name__ == '__main__':
+    main()
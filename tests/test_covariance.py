@@ -14,3 +14,30 @@ class TestCovariance(unittest.TestCase):
         for cov in covs:
             diff = (gt - cov).abs()
             self.assertTrue((diff < .0001).all())
+
+    def test_to_log_cholesky(self):
+        # double-precision, so the round-trip through the cholesky isn't dominated by round-off:
+        log_diag, off_diag = torch.randn(4, dtype=torch.float64), torch.randn(6, dtype=torch.float64)
+        cov = Covariance.from_log_cholesky(log_diag=log_diag, off_diag=off_diag, dtype=torch.float64)
+        log_diag2, off_diag2 = cov.to_log_cholesky()
+        self.assertTrue(torch.allclose(log_diag, log_diag2, atol=1e-6))
+        self.assertTrue(torch.allclose(off_diag, off_diag2, atol=1e-6))
+
+    def test_partial_covariance(self):
+        from torch_kalman.covariance import PartialCovarianceFromLogCholesky
+
+        partial = PartialCovarianceFromLogCholesky(full_dim_names=['a', 'b', 'c', 'd'], partial_dim_names=['d', 'b'])
+        partial_cov = partial.partial_parameterizer.create()
+        cov = partial.create(leading_dims=(2,))
+        self.assertEqual(tuple(cov.shape), (2, 4, 4))
+        idx = [3, 1]
+        for i, r in enumerate(idx):
+            for j, c in enumerate(idx):
+                self.assertTrue(torch.allclose(cov[:, r, c], partial_cov[i, j]))
+        self.assertEqual(cov[:, [0, 2]].abs().sum().item(), 0.)
+        self.assertEqual(cov[:, :, [0, 2]].abs().sum().item(), 0.)
+
+        # round-trip:
+        with torch.no_grad():
+            partial.set(cov[0] * 2.)
+            self.assertTrue(torch.allclose(partial.create(), cov[0] * 2., atol=1e-5))
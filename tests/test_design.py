@@ -34,6 +34,57 @@ class TestDesign(unittest.TestCase):
         # F doesn't require grad:
         self.assertFalse(batch_design.F(0).requires_grad)
 
+    def test_design_f_blocks(self):
+        from torch_kalman.process import LinearModel, LocalLevel
+        from torch_kalman.state_belief import Gaussian
+
+        design = Design(
+            processes=[
+                LocalTrend(id='trend').add_measure('y'),
+                LinearModel(id='lm', covariates=['x1', 'x2']).add_measure('y'),
+                LocalLevel(id='level', decay=(.90, 1.00)).add_measure('y')
+            ],
+            measures=['y']
+        )
+        batch_design = design.for_batch(num_groups=2, num_timesteps=1, predictors=torch.randn(2, 1, 2))
+        # trend is dense, lm is identity, level is diagonal:
+        self.assertListEqual(batch_design.F_blocks, [(0, 2, 'dense'), (2, 5, 'diagonal')])
+
+        # block-wise predict is the same as dense:
+        with torch.no_grad():
+            state = Gaussian(means=torch.randn(2, 5), covs=batch_design.initial_covariance)
+            F, Q = batch_design.F(0), batch_design.Q(0)
+            pred = state.predict(F=F, Q=Q)
+            pred_blocks = state.predict(F=F, Q=Q, F_blocks=batch_design.F_blocks)
+        self.assertTrue(torch.allclose(pred.means, pred_blocks.means))
+        self.assertTrue(torch.allclose(pred.covs, pred_blocks.covs, atol=1e-6))
+
+    def test_design_f_blocks_season(self):
+        from torch_kalman.process import Season
+        from torch_kalman.state_belief import Gaussian
+
+        design = Design(
+            processes=[
+                LocalTrend(id='trend').add_measure('y'),
+                Season(id='season', seasonal_period=7, dt_unit='D', decay=(.90, 1.00)).add_measure('y')
+            ],
+            measures=['y']
+        )
+        start_datetimes = np.array([np.datetime64('2018-01-01'), np.datetime64('2018-01-04')])
+        batch_design = design.for_batch(num_groups=2, num_timesteps=3, start_datetimes=start_datetimes)
+        self.assertListEqual(batch_design.F_blocks, [(0, 2, 'dense'), (2, 9, 'companion')])
+
+        # block-wise predict is the same as dense, both when the season shifts and when it doesn't:
+        with torch.no_grad():
+            state = Gaussian(means=torch.randn(2, 9), covs=batch_design.initial_covariance)
+            for t in range(batch_design.num_timesteps):
+                F, Q = batch_design.F(t), batch_design.Q(t)
+                pred = state.predict(F=F, Q=Q)
+                pred_blocks = state.predict(F=F, Q=Q, F_blocks=batch_design.F_blocks)
+                self.assertTrue(torch.allclose(pred.means, pred_blocks.means))
+                self.assertTrue(torch.allclose(pred.covs, pred_blocks.covs, atol=1e-6))
+                state = pred
+
     def test_design_q(self):
         # design
         design = simple_mv_velocity_design()
@@ -46,6 +97,40 @@ class TestDesign(unittest.TestCase):
         design_Q = batch_design.Q(0)[0].data.numpy()
         self.assertTrue(np.isclose(design_Q, design_Q.T).all(), msg="Covariance is not symmetric.")
 
+    def test_design_q_r_over_time(self):
+        design = simple_mv_velocity_design()
+        batch_design = design.for_batch(num_groups=2, num_timesteps=4)
+        batch_design._adjust_variance('0', adjustment=torch.randn(2, 4))
+        batch_design._adjust_variance('1', 'velocity', adjustment=[torch.randn(2) for _ in range(4)])
+        self.assertTupleEqual(tuple(batch_design.Q_over_time.shape), (2, 4, 4, 4))
+        self.assertTupleEqual(tuple(batch_design.R_over_time.shape), (2, 4, 2, 2))
+
+        # same as diag_multi @ cov @ diag_multi:
+        for t in range(4):
+            diag_multi = batch_design._process_variance_multi(t)
+            expected_Q = diag_multi.matmul(batch_design._base_Q).matmul(diag_multi)
+            self.assertTrue(torch.allclose(batch_design.Q(t), expected_Q))
+            diag_multi = batch_design._measure_variance_multi(t)
+            expected_R = diag_multi.matmul(batch_design._base_R).matmul(diag_multi)
+            self.assertTrue(torch.allclose(batch_design.R(t), expected_R))
+
+    def test_dynamic_matrix_over_time(self):
+        from torch_kalman.process.utils.design_matrix import DynamicMatrix
+
+        base = torch.randn(2, 3, 3)
+        values = torch.randn(2, 4, requires_grad=True)
+        mat = DynamicMatrix(base, {(0, 1): values, (2, 2): torch.arange(4.).unsqueeze(0)})
+        self.assertTupleEqual(tuple(mat.over_time.shape), (2, 4, 3, 3))
+        for t in range(4):
+            expected = base.clone()
+            expected[:, 0, 1] = values[:, t]
+            expected[:, 2, 2] = t
+            self.assertTrue(torch.allclose(mat(t), expected))
+            self.assertTrue(torch.allclose(mat.over_time[:, t], expected))
+
+        torch.stack([mat(t) for t in range(4)]).sum().backward()
+        self.assertTrue(torch.allclose(values.grad, torch.ones(2, 4)))
+
     def test_design_h(self):
         # design
         design = simple_mv_velocity_design()
@@ -100,3 +185,21 @@ class TestDesign(unittest.TestCase):
 
         for a, b in zip(cholesky_off_diag.tolist(), chol[np.tril_indices_from(chol, k=-1)].tolist()):
             self.assertAlmostEqual(a, b, places=4)
+
+    def test_design_var_nn_sequence_input(self):
+        class SequenceModule(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.linear = torch.nn.Linear(3, 1)
+                self.input_shapes = []
+
+            def forward(self, input: Tensor) -> Tensor:
+                self.input_shapes.append(tuple(input.shape))
+                return self.linear(input.mean(1))
+
+        # a module that takes each group's entire sequence still gets the input unsplit:
+        module = SequenceModule()
+        design = Design(processes=[LocalTrend(id='trend').add_measure('y')], measures=['y'], measure_var_predict=module)
+        batch_design = design.for_batch(4, 5, measure_var_nn0__input=torch.randn((4, 5, 3)))
+        self.assertEqual(module.input_shapes, [(4, 5, 3)])
+        self.assertTrue(torch.equal(batch_design.R(0), batch_design.R(4)))
@@ -1,6 +1,7 @@
 import copy
 from itertools import product
 from unittest import TestCase
+from typing import Optional
 
 import torch
 from parameterized import parameterized
@@ -12,7 +13,7 @@ from torch_kalman.kalman_filter import KalmanFilter
 import numpy as np
 from filterpy.kalman import KalmanFilter as filterpy_KalmanFilter
 
-from tests.utils import simple_mv_velocity_design
+from tests.utils import simple_mv_velocity_design, simple_mv_velocity_data
 
 
 class TestKalmanFilter(TestCase):
@@ -120,6 +121,336 @@ class TestKalmanFilter(TestCase):
         for r, c in product(*[range(x) for x in kf_states.shape]):
             self.assertAlmostEqual(filterpy_states[r, c], kf_states[r, c], places=3)
 
+    def test_steady_state(self):
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        data = torch.cumsum(torch.randn((3, 100, 2)), 1)
+        data[1, 60, 0] = float('nan')
+        with torch.no_grad():
+            pred = torch_kf(data)
+            pred_steady = torch_kf(data, steady_state_tol=1e-5)
+        self.assertTrue(torch.allclose(pred.means, pred_steady.means, atol=1e-3))
+        self.assertTrue(torch.allclose(pred.covs, pred_steady.covs, atol=1e-3))
+
+    @parameterized.expand([(1,), (2,)])
+    def test_parallel(self, n_step: int):
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        data = torch.cumsum(torch.randn((3, 20, 2)), 1)
+        data[0, 5, 0] = float('nan')
+        data[1, 8:11, :] = float('nan')
+        with torch.no_grad():
+            pred = torch_kf(data, n_step=n_step, forecast_horizon=3)
+            pred_parallel = torch_kf(data, n_step=n_step, forecast_horizon=3, parallel=True)
+        self.assertTrue(torch.allclose(pred.means, pred_parallel.means, atol=1e-4))
+        self.assertTrue(torch.allclose(pred.covs, pred_parallel.covs, atol=1e-4))
+        self.assertTrue((pred.last_update_idx == pred_parallel.last_update_idx).all())
+
+    def test_fused_step(self):
+        from torch_kalman.state_belief import Gaussian
+
+        class GaussianUnfused(Gaussian):
+            supports_fused_step = False
+
+        class KalmanFilterUnfused(KalmanFilter):
+            family = GaussianUnfused
+
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        torch_kf_unfused = KalmanFilterUnfused(processes=_design.processes.values(), measures=_design.measures)
+        torch_kf_unfused.load_state_dict(torch_kf.state_dict())
+
+        data = torch.cumsum(torch.randn((3, 20, 2)), 1)
+        data[0, 5, 0] = float('nan')
+        pred = torch_kf(data, n_step=2)
+        pred_unfused = torch_kf_unfused(data, n_step=2)
+        self.assertTrue(torch.allclose(pred.means, pred_unfused.means, atol=1e-4))
+        self.assertTrue(torch.allclose(pred.covs, pred_unfused.covs, atol=1e-4))
+
+    def test_fused_step_inf(self):
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        data = torch.cumsum(torch.randn((3, 10, 2)), 1)
+        data[1, 4, 0] = float('inf')
+        with self.assertRaises(RuntimeError) as cm:
+            torch_kf(data)
+        self.assertIn("Infs not allowed", cm.exception.args[0])
+
+    def test_square_root(self):
+        from torch_kalman.state_belief import SquareRootGaussian
+
+        class SquareRootKalmanFilter(KalmanFilter):
+            family = SquareRootGaussian
+
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        torch_kf_sqrt = SquareRootKalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        torch_kf_sqrt.load_state_dict(torch_kf.state_dict())
+
+        data = torch.cumsum(torch.randn((3, 20, 2)), 1)
+        data[0, 5, 0] = float('nan')
+        data[1, 8, :] = float('nan')
+        with torch.no_grad():
+            pred = torch_kf(data, n_step=2)
+            pred_sqrt = torch_kf_sqrt(data, n_step=2)
+            self.assertTrue(torch.allclose(pred.means, pred_sqrt.means, atol=1e-4))
+            self.assertTrue(torch.allclose(pred.covs, pred_sqrt.covs, atol=1e-4))
+            self.assertTrue(torch.allclose(pred.log_prob(data), pred_sqrt.log_prob(data), atol=1e-4))
+
+    def test_sequential(self):
+        from torch_kalman.state_belief import SequentialGaussian
+
+        updates = []
+
+        class SequentialGaussianCounted(SequentialGaussian):
+            def update(self, obs, **kwargs):
+                if 'time' not in kwargs:
+                    updates.append(1)
+                return super().update(obs, **kwargs)
+
+        class SequentialKalmanFilter(KalmanFilter):
+            family = SequentialGaussianCounted
+
+        _design = simple_mv_velocity_design(dims=3)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        torch_kf_seq = SequentialKalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        torch_kf_seq.load_state_dict(torch_kf.state_dict())
+
+        data = torch.cumsum(torch.randn((3, 20, 3)), 1)
+        data[0, 5, 0] = float('nan')
+        data[1, 8, 1:] = float('nan')
+        data[2, 10, :] = float('nan')
+        with torch.no_grad():
+            pred = torch_kf(data)
+            pred_seq = torch_kf_seq(data)
+        self.assertTrue(torch.allclose(pred.means, pred_seq.means, atol=1e-4))
+        self.assertTrue(torch.allclose(pred.covs, pred_seq.covs, atol=1e-4))
+        # the sequential update is used at every timestep (not the fused/shared/steady-state paths). the last timestep
+        # isn't updated, since there's no prediction after it:
+        self.assertEqual(len(updates), data.shape[1] - 1)
+
+        # the paths that would do a multivariate update aren't available:
+        with self.assertRaises(NotImplementedError):
+            torch_kf_seq(data, parallel=True)
+        with self.assertRaises(NotImplementedError):
+            torch_kf_seq(data, steady_state_tol=1e-5)
+
+    def test_predict_horizons(self):
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        data = torch.cumsum(torch.randn((3, 10, 2)), 1)
+        data[0, 5, 0] = float('nan')
+        num_times = data.shape[1]
+        with torch.no_grad():
+            preds, pred_covs = torch_kf.predict_horizons(data, max_horizon=3)
+            self.assertEqual(tuple(preds.shape), (3, num_times, 3, 2))
+            for h in range(1, 4):
+                pred = torch_kf(data, n_step=h, out_timesteps=num_times - h + 1)
+                self.assertTrue(torch.allclose(pred.predictions, preds[:, :, h - 1], atol=1e-4))
+                self.assertTrue(torch.allclose(pred.prediction_uncertainty, pred_covs[:, :, h - 1], atol=1e-4))
+
+    def test_step(self):
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        data = torch.cumsum(torch.randn((3, 10, 2)), 1)
+        data[0, 5, 0] = float('nan')
+        with torch.no_grad():
+            pred = torch_kf(data, forecast_horizon=1)
+            state = None
+            for t in range(data.shape[1]):
+                _, state = torch_kf.step(state, data[:, t])
+                self.assertTrue(torch.allclose(pred.means[:, t + 1], state.means, atol=1e-4))
+                self.assertTrue(torch.allclose(pred.covs[:, t + 1], state.covs, atol=1e-4))
+
+    def test_backward_tbptt(self):
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        data = torch.cumsum(torch.randn((3, 25, 2)), 1)
+        data[0, 5, 0] = float('nan')
+
+        with torch.no_grad():
+            loss = -torch_kf(data).log_prob(data).mean()
+        loss_tbptt = torch_kf.backward_tbptt(data, chunk_size=10)
+        self.assertAlmostEqual(loss.item(), loss_tbptt.item(), places=3)
+        self.assertTrue(any(param.grad is not None for param in torch_kf.parameters()))
+
+    @parameterized.expand([(2, 2), (2, 7), (3, 10)])
+    def test_backward_tbptt_nstep(self, n_step: int, chunk_size: int):
+        from torch_kalman.process import LocalLevel, Season, FourierSeason
+
+        torch_kf = KalmanFilter(
+            processes=[
+                LocalLevel(id='level').add_measure('y'),
+                Season(id='day_of_week', seasonal_period=7, dt_unit='D').add_measure('y'),
+                FourierSeason(id='day_of_month', seasonal_period=30, K=2, dt_unit='D').add_measure('y')
+            ],
+            measures=['y']
+        )
+        data = torch.cumsum(torch.randn((3, 40, 1)), 1)
+        data[1, 13, 0] = float('nan')
+        start_datetimes = np.array([np.datetime64('2018-01-01') + i for i in range(3)])
+
+        # the first predictions in each chunk are aligned with the seasons, and based on the same data as in forward():
+        with torch.no_grad():
+            loss = -torch_kf(data, n_step=n_step, start_datetimes=start_datetimes).log_prob(data).mean()
+        loss_tbptt = torch_kf.backward_tbptt(
+            data, chunk_size=chunk_size, n_step=n_step, start_datetimes=start_datetimes
+        )
+        self.assertAlmostEqual(loss.item(), loss_tbptt.item(), places=4)
+
+    def test_stacked_outputs(self):
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        data = torch.cumsum(torch.randn((3, 10, 2)), 1)
+        data[0, 5, 0] = float('nan')
+        data[1, 7:, :] = float('nan')
+        pred = torch_kf(data, forecast_horizon=2)
+        with torch.no_grad():
+            # preallocated:
+            pred_nograd = torch_kf(data, forecast_horizon=2)
+        self.assertTrue(torch.allclose(pred.means, pred_nograd.means))
+        self.assertTrue(torch.allclose(pred.covs, pred_nograd.covs))
+        # the last prediction following an update: groups 0 and 2 are updated through t=9 (so the prediction for t=10),
+        # group 1 through t=6:
+        self.assertEqual(pred.last_update_idx.tolist(), [10, 7, 10])
+
+        sb = pred.state_belief_for_time([0, 3, 11])
+        self.assertTrue(torch.allclose(sb.means[1], pred.means[1, 3]))
+        self.assertTrue(torch.allclose(sb.covs[2], pred.covs[2, 11]))
+        self.assertTrue(torch.allclose(pred.state_beliefs[4].means, pred.means[:, 4]))
+
+    def test_log_prob_missing(self):
+        from torch.distributions import MultivariateNormal
+
+        _design = simple_mv_velocity_design(dims=3)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        data = simple_mv_velocity_data(2, 6, dims=3, missing=[(0, 1, 0), (1, 1, slice(1, None)), (0, 3, slice(None))])
+        with torch.no_grad():
+            pred = torch_kf(data)
+            lp = pred.log_prob(data)
+        for g, t in product(range(2), range(6)):
+            valid = (~torch.isnan(data[g, t])).nonzero(as_tuple=False).squeeze(-1)
+            if not len(valid):
+                self.assertEqual(lp[g, t].item(), 0.)
+                continue
+            dist = MultivariateNormal(
+                pred.predictions[g, t, valid], pred.prediction_uncertainty[g, t][valid][:, valid]
+            )
+            self.assertAlmostEqual(dist.log_prob(data[g, t, valid]).item(), lp[g, t].item(), places=3)
+
+    @parameterized.expand([(False,), (True,)])
+    def test_cached_system_chol(self, no_grad: bool):
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        data = simple_mv_velocity_data(3, 10, missing=[(0, 5, 0), (1, 7, slice(None))])
+        with torch.set_grad_enabled(not no_grad):
+            pred = torch_kf(data)
+            # factors from the forward-pass can be used for every timestep except the last (which isn't updated):
+            self.assertTrue((pred.system_chol_cache[1][:, :-1] == ~torch.isnan(data[:, :-1])).all())
+            lp = pred.log_prob(data)
+            pred._system_chol_cache = None
+            lp_recomputed = pred.log_prob(data)
+        self.assertTrue(torch.allclose(lp, lp_recomputed, atol=1e-5))
+
+    @parameterized.expand([(False, 1), (True, 1), (False, 2)])
+    def test_loglik(self, censored: bool, n_step: int):
+        from torch_kalman.state_belief import CensoredGaussian
+
+        class TobitFilter(KalmanFilter):
+            family = CensoredGaussian
+
+        _design = simple_mv_velocity_design(dims=2)
+        kf_cls = TobitFilter if censored else KalmanFilter
+        torch_kf = kf_cls(processes=_design.processes.values(), measures=_design.measures)
+        data = simple_mv_velocity_data(3, 15, missing=[(0, 5, 0), (1, 7, slice(None))])
+        args = [data]
+        if censored:
+            upper = torch.full_like(data, 2.)
+            args = [torch.min(data, upper), None, upper]
+
+        with torch.no_grad():
+            lp = torch_kf(*args, n_step=n_step).log_prob(*args).sum(1)
+        loglik = torch_kf.loglik(*args, n_step=n_step)
+        self.assertEqual(tuple(loglik.shape), (3,))
+        self.assertTrue(torch.allclose(lp, loglik.detach(), atol=1e-3))
+        loglik.sum().backward()
+        self.assertTrue(any(param.grad is not None for param in torch_kf.parameters()))
+
+    def test_smooth(self):
+        data = Tensor([[-1., 2., float('nan'), 1., 0., 3.]])[:, :, None]
+
+        _design = simple_mv_velocity_design(dims=1)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        batch_design = torch_kf.design.for_batch(1, 1)
+        with torch.no_grad():
+            means, covs = torch_kf.smooth(data)
+            means_only, no_covs = torch_kf.smooth(data, means_only=True)
+        self.assertIsNone(no_covs)
+        self.assertTrue(torch.allclose(means, means_only))
+
+        # filterpy:
+        filter_kf = self._make_filter_kf(batch_design)
+        filtered_means, filtered_covs = [], []
+        for t in range(data.shape[1]):
+            obs = data[:, t, :]
+            filter_kf.update(None if torch.isnan(obs).all() else obs.numpy())
+            filtered_means.append(filter_kf.x.copy())
+            filtered_covs.append(filter_kf.P.copy())
+            filter_kf.predict()
+        filterpy_means, filterpy_covs, *_ = filter_kf.rts_smoother(np.stack(filtered_means), np.stack(filtered_covs))
+
+        self.assertTrue(np.allclose(filterpy_means.squeeze(-1), means.numpy().squeeze(0), atol=1e-3))
+        self.assertTrue(np.allclose(filterpy_covs, covs.numpy().squeeze(0), atol=1e-3))
+
+    def test_loglik_adjoint(self):
+        # compared in double-precision, since in single-precision the round-off in the two backward-passes differs by
+        # about the size of the tolerance:
+        self.addCleanup(torch.set_default_dtype, torch.get_default_dtype())
+        torch.set_default_dtype(torch.float64)
+
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        data = torch.cumsum(torch.randn((3, 15, 2)), 1)
+        data[0, 5, 0] = float('nan')
+        data[1, 7, :] = float('nan')
+
+        loglik = torch_kf.loglik(data)
+        loglik.sum().backward()
+        grads = [param.grad.clone() for param in torch_kf.parameters() if param.grad is not None]
+        torch_kf.zero_grad()
+
+        loglik_adjoint = torch_kf.loglik(data, adjoint=True)
+        loglik_adjoint.sum().backward()
+        grads_adjoint = [param.grad.clone() for param in torch_kf.parameters() if param.grad is not None]
+
+        self.assertTrue(torch.allclose(loglik, loglik_adjoint, atol=1e-5))
+        self.assertEqual(len(grads), len(grads_adjoint))
+        for grad, grad_adjoint in zip(grads, grads_adjoint):
+            self.assertTrue(torch.allclose(grad, grad_adjoint, atol=1e-5, rtol=1e-5))
+
+    @parameterized.expand([(1, None), (2, None), (1, 1e-5)])
+    def test_shared_covariance(self, n_step: int, steady_state_tol: Optional[float]):
+        class KalmanFilterShared(KalmanFilter):
+            share_covariance = True
+
+        _design = simple_mv_velocity_design(dims=2)
+        torch_kf = KalmanFilter(processes=_design.processes.values(), measures=_design.measures)
+        torch_kf_shared = KalmanFilterShared(processes=_design.processes.values(), measures=_design.measures)
+        torch_kf_shared.load_state_dict(torch_kf.state_dict())
+
+        # (the last one is after the steady-state is reached)
+        data = simple_mv_velocity_data(8, 100, missing=[(slice(4, 6), 3, 0), (6, 6, slice(None)), (1, 60, 0)])
+        with torch.no_grad():
+            pred = torch_kf(data, n_step=n_step)
+            pred_shared = torch_kf_shared(data, n_step=n_step, steady_state_tol=steady_state_tol)
+        self.assertTrue(torch.allclose(pred.means, pred_shared.means, atol=1e-3))
+        self.assertTrue(torch.allclose(pred.covs, pred_shared.covs, atol=1e-3))
+        self.assertEqual(pred.last_update_idx.tolist(), pred_shared.last_update_idx.tolist())
+        if n_step == 1:
+            # the shared updates still store the cholesky-factors:
+            self.assertTrue((pred_shared.system_chol_cache[1][:, :-1] == ~torch.isnan(data[:, :-1])).all())
+        self.assertTrue(torch.allclose(pred.log_prob(data), pred_shared.log_prob(data), atol=1e-3))
+
     def _make_filter_kf(self, batch_design):
         filter_kf = filterpy_KalmanFilter(dim_x=2, dim_z=1)
         filter_kf.x = batch_design.initial_mean.detach().numpy().T
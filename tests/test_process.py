@@ -102,3 +102,70 @@ class TestProcess(TestCase):
         self.assertTrue((state_mean[1:] == state_mean_last[:-1]).all())
 
         self.assertListEqual(batch_season.H(0)[0].tolist(), [[1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]])
+
+    def test_nn(self):
+        from torch_kalman.process import NN
+
+        module = torch.nn.Linear(3, 2)
+        calls = []
+        module.register_forward_hook(lambda *args: calls.append(1))
+        process = NN(id='nn', input_dim=3, state_dim=2, nn=module).add_measure('measure')
+        design = Design(processes=[process], measures=['measure'])
+        predictors = torch.randn(4, 5, 3)
+        batch_nn = design.for_batch(4, 5, predictors=predictors)
+
+        # called once for all timesteps:
+        self.assertEqual(len(calls), 1)
+        with torch.no_grad():
+            expected = module(predictors)
+        for t in range(5):
+            self.assertTrue(torch.allclose(batch_nn.H(t)[:, 0, :], expected[:, t]))
+
+    def test_batch_cache(self):
+        # with season_duration > 1, F depends on the start-datetimes (the timesteps where the season transitions):
+        season = Season(id='day_of_week', seasonal_period=7, season_duration=2, dt_unit='D', decay=(.9, 1.))
+        season.add_measure('measure')
+        design = Design(processes=[season], measures=['measure'])
+        start_datetimes = np.array([np.datetime64('2018-01-01'), np.datetime64('2018-01-03')])
+
+        batch1 = design.for_batch(2, 10, start_datetimes=start_datetimes)
+        self.assertEqual(len(season._batch_cache), 1)
+
+        # same inputs (even if a different array), and the masks are re-used; but the parameters still get grad:
+        batch2 = design.for_batch(2, 10, start_datetimes=start_datetimes.copy())
+        self.assertEqual(len(season._batch_cache), 1)
+        self.assertTrue(torch.equal(batch1.F.over_time, batch2.F.over_time))
+        self.assertTrue(batch2.F.over_time.requires_grad)
+
+        # different inputs:
+        batch3 = design.for_batch(2, 10, start_datetimes=start_datetimes + 1)
+        self.assertEqual(len(season._batch_cache), 2)
+        self.assertFalse(torch.equal(batch1.F.over_time, batch3.F.over_time))
+
+        # back to the first inputs, which are still cached:
+        design.for_batch(2, 10, start_datetimes=start_datetimes)
+        self.assertEqual(len(season._batch_cache), 2)
+
+        # size-bounded:
+        for i in range(season._batch_cache.maxsize + 1):
+            design.for_batch(2, 10 + i, start_datetimes=start_datetimes)
+        self.assertEqual(len(season._batch_cache), season._batch_cache.maxsize)
+
+    def test_fourier_tensor(self):
+        from torch_kalman.process import FourierSeason
+        from torch_kalman.process.utils.fourier import fourier_tensor
+
+        time = torch.arange(0., 30.).view(3, 10) % 7
+        tens = fourier_tensor(time, seasonal_period=7, K=2)
+        self.assertEqual(tuple(tens.shape), (3, 10, 2, 2))
+        for k in range(2):
+            self.assertTrue(torch.allclose(tens[..., k, 0], torch.sin(2. * np.pi * (k + 1) * time / 7)))
+            self.assertTrue(torch.allclose(tens[..., k, 1], torch.cos(2. * np.pi * (k + 1) * time / 7)))
+
+        # processes with the same period/K/datetimes share the basis:
+        seasons = [
+            FourierSeason(id=f'season{i}', seasonal_period=7, K=2, dt_unit='D').add_measure(str(i)) for i in (1, 2)
+        ]
+        start_datetimes = np.array([np.datetime64('2018-01-01'), np.datetime64('2018-01-03')])
+        tensors = [season._fourier_tensor_for_batch(start_datetimes, num_timesteps=10) for season in seasons]
+        self.assertIs(tensors[0], tensors[1])
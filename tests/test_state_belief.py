@@ -4,7 +4,7 @@ import torch
 from torch import Tensor
 
 from torch_kalman.state_belief import Gaussian
-from tests.utils import simple_mv_velocity_design
+from tests.utils import simple_mv_velocity_design, simple_mv_velocity_data
 
 
 class TestStateBelief(unittest.TestCase):
@@ -37,3 +37,44 @@ class TestStateBelief(unittest.TestCase):
         ], design=None)
         self.assertEqual(over_time.num_groups, 5)
         self.assertEqual(over_time.num_timesteps, 3)
+
+    def test_update_missing(self):
+        design = simple_mv_velocity_design(dims=2)
+        batch_design = design.for_batch(3, 1)
+        H, R = batch_design.H(0), batch_design.R(0)
+        means = torch.randn((3, 4))
+        covs = torch.eye(4).expand(3, -1, -1) + .1
+
+        obs = simple_mv_velocity_data(3, 1, missing=[(0, 0, 1), (2, 0, slice(None))])[:, 0]
+
+        sb = Gaussian(means=means, covs=covs, last_measured=torch.full((3,), 3, dtype=torch.int))
+        sb.compute_measurement(H=H, R=R)
+        update = sb.update(obs=obs)
+
+        # group with one missing measure matches an update using only the other measure:
+        sb0 = Gaussian(means=means[[0]], covs=covs[[0]])
+        sb0.compute_measurement(H=H[[0]][:, [0]], R=R[[0]][:, [0]][:, :, [0]])
+        update0 = sb0.update(obs=obs[[0]][:, [0]])
+        self.assertTrue(torch.allclose(update.means[0], update0.means[0], atol=1e-5))
+        self.assertTrue(torch.allclose(update.covs[0], update0.covs[0], atol=1e-5))
+
+        # group with all missing isn't updated:
+        self.assertTrue(torch.allclose(update.means[2], means[2]))
+        self.assertTrue(torch.allclose(update.covs[2], covs[2]))
+        self.assertEqual(update.last_measured.tolist(), [0, 0, 3])
+
+    def test_log_prob(self):
+        design = simple_mv_velocity_design(dims=2)
+        batch_design = design.for_batch(3, 1)
+        H, R = batch_design.H(0), batch_design.R(0)
+        sb = Gaussian(means=torch.randn((3, 4)), covs=torch.eye(4).expand(3, -1, -1) + .1)
+        sb.compute_measurement(H=H, R=R)
+
+        obs = simple_mv_velocity_data(3, 1, missing=[(0, 0, 1)])[:, 0]
+        sb.update(obs=obs)
+
+        # single-timestep log-prob matches the over-time one, with or without the cached cholesky-factor:
+        over_time = Gaussian.concatenate_over_time([sb], design=batch_design)
+        expected = over_time.log_prob(obs[:, None, :])[:, 0]
+        self.assertTrue(torch.allclose(sb.log_prob(obs), expected, atol=1e-5))
+        self.assertTrue(torch.allclose(sb.log_prob(obs, system_chol=sb.system_chol_cache), expected, atol=1e-5))
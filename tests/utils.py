@@ -1,3 +1,7 @@
+from typing import Sequence
+
+import torch
+
 from torch_kalman.design import Design
 from torch_kalman.process import LocalTrend
 
@@ -11,3 +15,18 @@ def simple_mv_velocity_design(dims: int = 2):
         processes.append(process)
         measures.append(measure)
     return Design(processes=processes, measures=measures)
+
+
+def simple_mv_velocity_data(num_groups: int,
+                            num_timesteps: int,
+                            dims: int = 2,
+                            missing: Sequence[tuple] = ()) -> torch.Tensor:
+    """
+    Random-walk data for `simple_mv_velocity_design`, with dims (group, time, measure).
+
+    :param missing: Indices into the data (e.g. `(0, 5, slice(None))`) to set to nan.
+    """
+    data = torch.cumsum(torch.randn((num_groups, num_timesteps, dims)), 1)
+    for idx in missing:
+        data[idx] = float('nan')
+    return data
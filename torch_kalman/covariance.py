@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import torch
 
 from typing import Tuple, Optional, Sequence, Type, Iterable
@@ -15,12 +17,8 @@ class Covariance(torch.Tensor):
 
         rank = log_diag.shape[-1]
         L = torch.diag_embed(torch.exp(log_diag))
-
-        idx = 0
-        for i in range(rank):
-            for j in range(i):
-                L[..., i, j] = off_diag[..., idx]
-                idx += 1
+        rows, cols = _tril_indices(rank)
+        L[..., rows, cols] = off_diag
         return L
 
     @classmethod
@@ -39,21 +37,25 @@ class Covariance(torch.Tensor):
         return out
 
     def to_log_cholesky(self) -> Tuple[torch.Tensor, torch.Tensor]:
-        batch_dim = self.shape[:-2]
         rank = self.shape[-1]
         L = torch.cholesky(self)
 
-        n_off = int(rank * (rank - 1) / 2)
-        off_diag = torch.empty(batch_dim + (n_off,))
-        idx = 0
-        for i in range(rank):
-            for j in range(i):
-                off_diag[..., idx] = L[..., i, j]
-                idx += 1
+        rows, cols = _tril_indices(rank)
+        off_diag = L[..., rows, cols]
         log_diag = torch.log(torch.diagonal(L, dim1=-2, dim2=-1))
         return log_diag, off_diag
 
 
+@lru_cache()
+def _tril_indices(rank: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    :return: The row and column indices of the elements below the diagonal of a (rank x rank) matrix, in the order
+    they are stored in the `off_diag` of the log-cholesky parameterization (row-major).
+    """
+    rows, cols = torch.tril_indices(rank, rank, offset=-1)
+    return rows, cols
+
+
 def cov_to_corr(cov: torch.Tensor) -> torch.Tensor:
     std = cov.diag().sqrt()
     return cov / std.unsqueeze(-1).matmul(std.unsqueeze(-2))
@@ -128,6 +130,10 @@ class PartialCovariance(CovarianceParameterization):
 
         super().__init__(rank=len(self.full_dim_names))
 
+        # the position of each of the partial-dims in the full-dims, so that `create()`/`set()` are single index ops:
+        full_dim_idx = {dim_name: i for i, dim_name in enumerate(self.full_dim_names)}
+        self._partial_idx = torch.tensor([full_dim_idx[nm] for nm in self.partial_dim_names], dtype=torch.long)
+
         self.partial_parameterizer = self.partial_parameterizer_cls(rank=self.partial_rank)
 
     @property
@@ -142,18 +148,11 @@ class PartialCovariance(CovarianceParameterization):
         return self.partial_parameterizer.param_dict()
 
     def set(self, cov: torch.Tensor):
-        partial_cov = torch.zeros((self.partial_rank, self.partial_rank))
-        for r in range(self.rank):
-            for c in range(self.rank):
-                value = cov[r, c]
-                try:
-                    to_r = self.partial_dim_names.index(self.full_dim_names[r])
-                    to_c = self.partial_dim_names.index(self.full_dim_names[c])
-                except ValueError:
-                    assert value.abs() < 1e-7
-                    continue
-                partial_cov[..., to_r, to_c] = value
-        return self.partial_parameterizer.set(partial_cov)
+        rows, cols = self._partial_idx.unsqueeze(-1), self._partial_idx
+        outside_partial = torch.ones_like(cov, dtype=torch.bool)
+        outside_partial[rows, cols] = False
+        assert (cov[outside_partial].abs() < 1e-7).all()
+        return self.partial_parameterizer.set(cov[rows, cols])
 
     def create(self, leading_dims: Sequence[int] = ()):
         cov = torch.eye(self.full_rank) * self.diag
@@ -163,13 +162,7 @@ class PartialCovariance(CovarianceParameterization):
             return cov
 
         partial_cov = self.partial_parameterizer.create(leading_dims=())
-
-        for r in range(self.partial_rank):
-            for c in range(self.partial_rank):
-                to_r = self.full_dim_names.index(self.partial_dim_names[r])
-                to_c = self.full_dim_names.index(self.partial_dim_names[c])
-                cov[..., to_r, to_c] = partial_cov[r, c]
-
+        cov[..., self._partial_idx.unsqueeze(-1), self._partial_idx] = partial_cov
         return cov
 
 
@@ -1,13 +1,13 @@
 from collections import OrderedDict
 from copy import copy
-from typing import Tuple, Sequence, Dict, Iterable, Union
+from typing import Tuple, Sequence, Dict, Iterable, Union, List, Optional
 from warnings import warn
 
 import torch
 
 from torch.nn import Parameter, ModuleDict, ParameterDict
 
-from torch_kalman.internals.batch import Batchable
+from torch_kalman.internals.batch import Batchable, BatchCache
 from torch_kalman.covariance import CovarianceFromLogCholesky, PartialCovarianceFromLogCholesky
 from torch_kalman.internals.utils import infer_forward_kwargs
 
@@ -70,6 +70,9 @@ class Design(NiceRepr, Batchable):
 
         # initial:
         self._initial_mean = None
+        self._static_covariances = {}
+        self._covariances_by_timestep = {}
+        self._batch_cache = BatchCache()
         self.init_covariance = PartialCovarianceFromLogCholesky(
             full_dim_names=self.state_elements,
             partial_dim_names=self.unfixed_state_elements
@@ -142,6 +145,8 @@ class Design(NiceRepr, Batchable):
         for_batch.processes = OrderedDict()
         for_batch.batch_info = (num_groups, num_timesteps)
         for_batch._initial_mean = torch.zeros(num_groups, len(self.state_elements))
+        for_batch._static_covariances = {}
+        for_batch._covariances_by_timestep = {}
 
         batch_dim_kwargs = {'num_groups': num_groups, 'num_timesteps': num_timesteps}
 
@@ -195,7 +200,12 @@ class Design(NiceRepr, Batchable):
                 # a cheat that makes the `seasonal` alias more convenient:
                 if 'datetimes' in nn._forward_kwargs and 'datetimes' not in nn_kwargs and hasattr(nn, '_dt_helper'):
                     if 'start_datetimes' in kwargs:
-                        nn_kwargs['datetimes'] = nn._dt_helper.make_grid(kwargs['start_datetimes'], num_timesteps)
+                        nn_kwargs['datetimes'] = self._batch_cache.get(
+                            key=self._batch_cache.make_key(
+                                'datetimes', nn._dt_helper.dt_unit, kwargs['start_datetimes'], num_timesteps
+                            ),
+                            fun=lambda: nn._dt_helper.make_grid(kwargs['start_datetimes'], num_timesteps)
+                        )
                         unused_kwargs.discard('start_datetimes')
 
                 for k in used:
@@ -224,6 +234,15 @@ class Design(NiceRepr, Batchable):
 
         return for_batch
 
+    @property
+    def is_time_invariant(self) -> bool:
+        """
+        True if F, H, Q and R are the same at every timestep -- i.e., no process or variance-adjustment varies over
+        time. Only available for the output of `for_batch()`.
+        """
+        mats = (self.F, self.H, self._process_variance_multi, self._measure_variance_multi)
+        return not any(mat.dynamic_assignments for mat in mats)
+
     @property
     def initial_mean(self):
         if self.is_for_batch:
@@ -256,6 +275,14 @@ class Design(NiceRepr, Batchable):
         assert list(merged.from_elements) == list(self.state_elements) == list(merged.to_elements)
         return merged.compile()
 
+    @cached_property
+    def F_blocks(self) -> List[Tuple[int, int, str]]:
+        """
+        Each process only transitions its own state-elements, so F is block-diagonal. These blocks are used in the
+        predict-step to avoid the dense product with F (see `torch_kalman.internals.block_diag`).
+        """
+        return self.F.block_structure(list(self.process_slices.values()))
+
     # Measurement Matrix ------:
     @cached_property
     def H(self) -> DynamicMatrix:
@@ -268,9 +295,15 @@ class Design(NiceRepr, Batchable):
 
     # Process-Covariance Matrix ------:
     def Q(self, t: int) -> torch.Tensor:
-        # processes can apply multipliers to the variance of their state-elements:
-        diag_multi = self._process_variance_multi(t=t)
-        return diag_multi.matmul(self._base_Q).matmul(diag_multi)
+        return self._scaled_covariance('Q', t=t)
+
+    @cached_property
+    def Q_over_time(self) -> torch.Tensor:
+        """
+        The process-covariance for all timesteps, a (group, time, state, state) tensor. Computed once per batch, so
+        that `Q(t)` can be a view (see `_scaled_covariance()`).
+        """
+        return self._scaled_covariance('Q')
 
     @cached_property
     def _process_variance_multi(self) -> DynamicMatrix:
@@ -291,9 +324,15 @@ class Design(NiceRepr, Batchable):
         return Q_rescaled.expand(self.num_groups, -1, -1)
 
     # Measure-Covariance Matrix ------:
-    def R(self, t: int):
-        diag_multi = self._measure_variance_multi(t=t)
-        return diag_multi.matmul(self._base_R).matmul(diag_multi)
+    def R(self, t: int) -> torch.Tensor:
+        return self._scaled_covariance('R', t=t)
+
+    @cached_property
+    def R_over_time(self) -> torch.Tensor:
+        """
+        The measure-covariance for all timesteps, a (group, time, measure, measure) tensor. See `Q_over_time`.
+        """
+        return self._scaled_covariance('R')
 
     @cached_property
     def _measure_variance_multi(self) -> DynamicMatrix:
@@ -303,6 +342,39 @@ class Design(NiceRepr, Batchable):
     def _base_R(self):
         return self.measure_covariance.create(leading_dims=(self.num_groups,))
 
+    def _scaled_covariance(self, which: str, t: Optional[int] = None) -> torch.Tensor:
+        """
+        Processes/measures can apply multipliers to their variances: the covariance is `diag_multi @ cov @ diag_multi`,
+        computed here as a broadcasted outer-product.
+
+        :param which: 'Q' or 'R'.
+        :param t: The timestep. If None, then the output is for all timesteps, with shape (group, time, size, size). If
+        the multipliers don't vary over time, then the time-dimension is expanded (so no copy is made).
+        :return: The scaled covariance.
+        """
+        if which == 'Q':
+            cov, multi = self._base_Q, self._process_variance_multi
+        else:
+            cov, multi = self._base_R, self._measure_variance_multi
+
+        if not multi.dynamic_assignments:
+            if which not in self._static_covariances:
+                diag_multi = torch.diagonal(multi.base_mat, dim1=-2, dim2=-1)
+                self._static_covariances[which] = diag_multi.unsqueeze(-1) * cov * diag_multi.unsqueeze(-2)
+            out = self._static_covariances[which]
+            if t is None:
+                out = out.unsqueeze(1).expand(-1, self.num_timesteps, -1, -1)
+            return out
+
+        if t is None:
+            diag_multi = torch.diagonal(multi.over_time, dim1=-2, dim2=-1)
+            return diag_multi.unsqueeze(-1) * cov.unsqueeze(1) * diag_multi.unsqueeze(-2)
+
+        if which not in self._covariances_by_timestep:
+            # split into timesteps with a single op, instead of slicing at each timestep (see `DynamicMatrix`):
+            self._covariances_by_timestep[which] = getattr(self, f'{which}_over_time').unbind(1)
+        return self._covariances_by_timestep[which][t]
+
     # Initial Cov ------:
     @cached_property
     def initial_covariance(self) -> torch.Tensor:
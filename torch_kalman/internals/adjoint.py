@@ -0,0 +1,167 @@
+"""
+The log-likelihood of a linear-gaussian state-space model as a custom autograd function. In the forward-pass only the
+predicted means and covariances are kept; the backward-pass recomputes the other quantities for each timestep and
+applies the adjoint (reverse-mode) recursion of the kalman-filter by hand. So instead of keeping every intermediate of
+every predict/update step for autograd, memory is O(T * state_size ** 2), and the backward-pass is a single loop.
+"""
+from typing import Tuple, Optional
+
+import torch
+from torch import Tensor
+
+
+def _mv(mat: Tensor, vec: Tensor) -> Tensor:
+    return mat.matmul(vec.unsqueeze(-1)).squeeze(-1)
+
+
+def _outer(a: Tensor, b: Tensor) -> Tensor:
+    return a.unsqueeze(-1) * b.unsqueeze(-2)
+
+
+def _t(mat: Tensor) -> Tensor:
+    return mat.transpose(-1, -2)
+
+
+def _update_terms(x: Tensor,
+                  P: Tensor,
+                  H: Tensor,
+                  R: Tensor,
+                  obs: Tensor) -> Tuple[Tensor, Tensor, Tensor, Tensor, Tensor]:
+    """
+    :return: The residuals `v`, the inverse of the system-covariance `Sinv`, its cholesky-factor, `A = P @ H.T`, and
+    the standardized residuals `u = Sinv @ v`.
+    """
+    v = obs - _mv(H, x)
+    A = P.matmul(_t(H))
+    S_chol = torch.cholesky(H.matmul(A) + R)
+    eye = torch.eye(S_chol.shape[-1], dtype=S_chol.dtype, device=S_chol.device).expand_as(S_chol)
+    Sinv = torch.cholesky_solve(eye, S_chol)
+    return v, Sinv, S_chol, A, _mv(Sinv, v)
+
+
+class GaussianLogLikelihood(torch.autograd.Function):
+    """
+    See `gaussian_loglik()`.
+    """
+
+    @staticmethod
+    def forward(ctx,
+                initial_mean: Tensor,
+                initial_cov: Tensor,
+                F: Tensor,
+                Q: Tensor,
+                H: Tensor,
+                R: Tensor,
+                obs: Tensor) -> Tensor:
+        num_groups, num_times, _ = obs.shape
+        x, P = initial_mean, initial_cov
+        means, covs = [], []
+        loglik = torch.zeros(num_groups, dtype=x.dtype, device=x.device)
+        for t in range(num_times):
+            means.append(x)
+            covs.append(P)
+            v, Sinv, S_chol, A, u = _update_terms(x, P, H[:, t], R[:, t], obs[:, t])
+            half_log_det = torch.log(torch.diagonal(S_chol, dim1=-2, dim2=-1)).sum(-1)
+            loglik = loglik - .5 * (v * u).sum(-1) - half_log_det
+            if t < num_times - 1:
+                # update:
+                x = x + _mv(A, u)
+                P = P - A.matmul(Sinv).matmul(_t(A))
+                # predict -- F/Q at t is transition *from* t *to* t+1:
+                x = _mv(F[:, t], x)
+                P = F[:, t].matmul(P).matmul(_t(F[:, t])) + Q[:, t]
+
+        ctx.save_for_backward(F, H, R, obs, torch.stack(means, 1), torch.stack(covs, 1))
+        return loglik
+
+    @staticmethod
+    def backward(ctx, grad_output: Tensor) -> Tuple[Optional[Tensor], ...]:
+        F, H, R, obs, means, covs = ctx.saved_tensors
+        num_groups, num_times, _ = obs.shape
+        g = grad_output.unsqueeze(-1)
+
+        F_grad, Q_grad = torch.zeros_like(F), torch.zeros_like(F)
+        H_grad, R_grad, obs_grad = torch.zeros_like(H), torch.zeros_like(R), torch.zeros_like(obs)
+
+        # adjoints of the predicted mean/cov at t+1:
+        x_next_grad = torch.zeros_like(means[:, 0])
+        P_next_grad = torch.zeros_like(covs[:, 0])
+        for t in reversed(range(num_times)):
+            x, P, Ht = means[:, t], covs[:, t], H[:, t]
+            v, Sinv, _, A, u = _update_terms(x, P, Ht, R[:, t], obs[:, t])
+
+            # predict:
+            x_upd_grad = torch.zeros_like(x)
+            P_upd_grad = torch.zeros_like(P)
+            if t < num_times - 1:
+                x_upd = x + _mv(A, u)
+                P_upd = P - A.matmul(Sinv).matmul(_t(A))
+                Ft = F[:, t]
+                x_upd_grad = _mv(_t(Ft), x_next_grad)
+                P_upd_grad = _t(Ft).matmul(P_next_grad).matmul(Ft)
+                F_grad[:, t] = (
+                        _outer(x_next_grad, x_upd) +
+                        P_next_grad.matmul(Ft).matmul(_t(P_upd)) +
+                        _t(P_next_grad).matmul(Ft).matmul(P_upd)
+                )
+                Q_grad[:, t] = P_next_grad
+
+            # covariance-update, P_upd = P - A @ Sinv @ A.T:
+            P_grad = P_upd_grad
+            A_grad = -(P_upd_grad.matmul(A).matmul(_t(Sinv)) + _t(P_upd_grad).matmul(A).matmul(Sinv))
+            Sinv_grad = -_t(A).matmul(P_upd_grad).matmul(A)
+
+            # mean-update, x_upd = x + A @ Sinv @ v:
+            x_grad = x_upd_grad
+            A_grad = A_grad + _outer(x_upd_grad, u)
+            Sinv_grad = Sinv_grad + _outer(_mv(_t(A), x_upd_grad), v)
+            v_grad = _mv(_t(Sinv).matmul(_t(A)), x_upd_grad)
+
+            # log-prob, -.5 * v.T @ Sinv @ v - .5 * log|S|:
+            v_grad = v_grad - g * .5 * _mv(Sinv + _t(Sinv), v)
+            Sinv_grad = Sinv_grad - g.unsqueeze(-1) * .5 * _outer(v, v)
+            S_grad = -g.unsqueeze(-1) * .5 * _t(Sinv) - _t(Sinv).matmul(Sinv_grad).matmul(_t(Sinv))
+
+            # A = P @ H.T:
+            P_grad = P_grad + A_grad.matmul(Ht)
+            H_grad[:, t] = _t(A_grad).matmul(P)
+
+            # S = H @ P @ H.T + R:
+            H_grad[:, t] += S_grad.matmul(Ht).matmul(_t(P)) + _t(S_grad).matmul(Ht).matmul(P)
+            P_grad = P_grad + _t(Ht).matmul(S_grad).matmul(Ht)
+            R_grad[:, t] = S_grad
+
+            # v = obs - H @ x:
+            obs_grad[:, t] = v_grad
+            H_grad[:, t] -= _outer(v_grad, x)
+            x_grad = x_grad - _mv(_t(Ht), v_grad)
+
+            x_next_grad, P_next_grad = x_grad, P_grad
+
+        needs = ctx.needs_input_grad
+        grads = (x_next_grad, P_next_grad, F_grad, Q_grad, H_grad, R_grad, obs_grad)
+        return tuple(grad if need else None for grad, need in zip(grads, needs))
+
+
+def gaussian_loglik(initial_mean: Tensor,
+                    initial_cov: Tensor,
+                    F: Tensor,
+                    Q: Tensor,
+                    H: Tensor,
+                    R: Tensor,
+                    obs: Tensor) -> Tensor:
+    """
+    The log-likelihood (prediction-error decomposition) of the observations, with the adjoint backward-pass described
+    above. Missing values are not allowed; they should be masked out first (see `mask_missing()`).
+
+    :param initial_mean: A (group, state) tensor with the prediction for the first timestep.
+    :param initial_cov: A (group, state, state) tensor with the covariance of that prediction.
+    :param F: A (group, time, state, state) tensor. F[:, t] is the transition *from* t *to* t+1.
+    :param Q: A (group, time, state, state) tensor of process-covariances, aligned with `F`.
+    :param H: A (group, time, measure, state) tensor.
+    :param R: A (group, time, measure, measure) tensor.
+    :param obs: A (group, time, measure) tensor.
+    :return: A tensor with the log-likelihood for each group, summed over timesteps, excluding the normalizing constant
+    (`-.5 * log(2 * pi)` for each observed value).
+    """
+    return GaussianLogLikelihood.apply(initial_mean, initial_cov, F, Q, H, R, obs)
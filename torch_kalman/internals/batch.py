@@ -1,4 +1,9 @@
-from typing import Tuple
+from collections import OrderedDict
+from hashlib import sha1
+from typing import Tuple, Callable, Any, Hashable, Optional
+
+import numpy as np
+import torch
 
 
 class Batchable:
@@ -34,3 +39,86 @@ class Batchable:
     @property
     def is_for_batch(self) -> bool:
         return self.batch_info is not None
+
+
+class BatchCache:
+    """
+    A size-bounded (least-recently-used) cache for the parts of `for_batch()` that depend on the batch's inputs (e.g.
+    datetime-grids, seasonal masks, fourier-terms) but not on the parameters. When a model is fit (e.g. with LBFGS) the
+    same batch is passed many times, and only the parameter-dependent parts need to be recomputed.
+    """
+
+    def __init__(self, maxsize: int = 8):
+        """
+        :param maxsize: The maximum number of entries, after which the least-recently used entry is evicted. If 0, then
+        nothing is cached.
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get(self, key: Optional[Hashable], fun: Callable[[], Any]) -> Any:
+        """
+        :param key: A key, typically from `make_key()`. If None, `fun` is called without caching.
+        :param fun: A function with no arguments that computes the value for this key.
+        :return: The cached value if present, otherwise the output of `fun()` (which is then cached).
+        """
+        if key is None or self.maxsize < 1:
+            return fun()
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        value = fun()
+        self._entries[key] = value
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+    @classmethod
+    def make_key(cls, *args) -> Optional[Tuple]:
+        """
+        Create a key from the inputs to the computation. Numpy arrays are hashed by content; tensors by identity (and
+        version, so in-place modification invalidates them). Tensors that require grad aren't parameter-free, so give
+        a key of None (i.e., don't cache).
+        """
+        key = []
+        for arg in args:
+            if isinstance(arg, torch.Tensor):
+                if arg.requires_grad:
+                    return None
+                key.append(('tensor', _TensorRef(arg), arg._version))
+            elif isinstance(arg, np.ndarray):
+                if arg.dtype == object:
+                    return None
+                key.append(('array', arg.shape, arg.dtype.str, sha1(arg.tobytes()).hexdigest()))
+            elif isinstance(arg, (list, tuple)):
+                sub_key = cls.make_key(*arg)
+                if sub_key is None:
+                    return None
+                key.append(sub_key)
+            elif arg is None or isinstance(arg, (str, int, float, bool, np.generic)):
+                key.append(arg)
+            else:
+                return None
+        return tuple(key)
+
+
+class _TensorRef:
+    """
+    Compares by identity, and holds a reference to the tensor so that its id can't be re-used while it's in a key.
+    """
+    __slots__ = ('tensor',)
+
+    def __init__(self, tensor: torch.Tensor):
+        self.tensor = tensor
+
+    def __hash__(self) -> int:
+        return id(self.tensor)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, _TensorRef) and other.tensor is self.tensor
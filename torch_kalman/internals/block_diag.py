@@ -0,0 +1,71 @@
+"""
+The transition-matrix of a design is block-diagonal: each process only transitions its own state-elements. Many of these
+blocks are trivial -- e.g. the identity for a LinearModel, or a diagonal for a damped level -- so multiplying by the
+dense (state_size x state_size) matrix wastes most of its work. Instead, the blocks are described by a list of
+`(start, end, kind)` tuples (see `DynamicMatrix.block_structure()`), where kind is 'identity', 'diagonal', 'companion',
+or 'dense', and products with the transition-matrix are computed one block at a time.
+
+A 'companion' block has an arbitrary first row, and otherwise only has nonzero elements on its diagonal and
+sub-diagonal. This is the structure of a discrete season, which (when the season changes) shifts each state-element
+down by one and computes the new first element from a (sum-to-zero) combination of the others. Its product only needs
+a dot-product with the first row and an elementwise shift, so is O(size) per column instead of O(size ** 2).
+"""
+from typing import List, Tuple, Optional
+
+import torch
+from torch import Tensor
+
+Blocks = List[Tuple[int, int, str]]
+
+
+def _block_matmul(F: Tensor, x: Tensor, blocks: Blocks) -> Tensor:
+    """
+    :param F: A (group, state, state) block-diagonal matrix.
+    :param x: A (group, state, N) tensor.
+    :param blocks: The blocks of `F`, see above.
+    :return: `F @ x`
+    """
+    parts: List[Tensor] = []
+    for start, end, kind in blocks:
+        x_block = x[:, start:end]
+        if kind == 'identity':
+            parts.append(x_block)
+        elif kind == 'diagonal':
+            F_diag = torch.diagonal(F[:, start:end, start:end], dim1=-2, dim2=-1)
+            parts.append(F_diag.unsqueeze(-1) * x_block)
+        elif kind == 'companion':
+            F_block = F[:, start:end, start:end]
+            F_diag = torch.diagonal(F_block, dim1=-2, dim2=-1)[:, 1:]
+            F_sub_diag = torch.diagonal(F_block, offset=-1, dim1=-2, dim2=-1)
+            parts.append(F_block[:, :1].matmul(x_block))
+            parts.append(F_diag.unsqueeze(-1) * x_block[:, 1:] + F_sub_diag.unsqueeze(-1) * x_block[:, :-1])
+        else:
+            parts.append(F[:, start:end, start:end].matmul(x_block))
+    if len(parts) == 1:
+        return parts[0]
+    return torch.cat(parts, 1)
+
+
+try:
+    block_matmul = torch.jit.script(_block_matmul)
+except Exception:  # scripting is an optimization; if this torch version can't script it, run it as python.
+    block_matmul = _block_matmul
+
+
+def transition_means(F: Tensor, means: Tensor, blocks: Optional[Blocks] = None) -> Tensor:
+    """
+    :return: `F @ means` for a batch of (group, state) means.
+    """
+    if blocks is None:
+        return F.matmul(means.unsqueeze(-1)).squeeze(-1)
+    return block_matmul(F, means.unsqueeze(-1), blocks).squeeze(-1)
+
+
+def transition_covs(F: Tensor, covs: Tensor, blocks: Optional[Blocks] = None) -> Tensor:
+    """
+    :return: `F @ covs @ F.T` for a batch of (group, state, state) covariances.
+    """
+    if blocks is None:
+        return F.matmul(covs).matmul(F.transpose(-1, -2))
+    # since covs is symmetric, (F @ covs).T = covs @ F.T:
+    return block_matmul(F, block_matmul(F, covs, blocks).transpose(-1, -2), blocks)
@@ -0,0 +1,42 @@
+"""
+A single, scripted function for the gaussian update + predict. For small state-sizes, the cost of a timestep is
+dominated by python-overhead (many short-lived tensors, permute-copies, building new StateBeliefs), so fusing the step
+into one TorchScript function is substantially faster than calling `update()` then `predict()`.
+"""
+from typing import Tuple
+
+import torch
+from torch import Tensor
+
+from torch_kalman.internals.block_diag import Blocks, block_matmul
+
+
+def _gaussian_update_predict(means: Tensor,
+                             covs: Tensor,
+                             obs: Tensor,
+                             H: Tensor,
+                             R: Tensor,
+                             F: Tensor,
+                             Q: Tensor,
+                             F_blocks: Blocks) -> Tuple[Tensor, Tensor, Tensor]:
+    # update:
+    Ht = H.transpose(-1, -2)
+    covs_measured = covs.matmul(Ht)
+    system_chol = torch.cholesky(H.matmul(covs_measured) + R)
+    K = torch.cholesky_solve(covs_measured.transpose(-1, -2), system_chol).transpose(-1, -2)
+    resid = obs - H.matmul(means.unsqueeze(-1)).squeeze(-1)
+    means = means + K.matmul(resid.unsqueeze(-1)).squeeze(-1)
+    # "joseph stabilized" covariance correction:
+    I_KH = torch.eye(covs.shape[-1], dtype=covs.dtype, device=covs.device) - K.matmul(H)
+    covs = I_KH.matmul(covs).matmul(I_KH.transpose(-1, -2)) + K.matmul(R).matmul(K.transpose(-1, -2))
+
+    # predict (F is block-diagonal, see `block_diag`):
+    means = block_matmul(F, means.unsqueeze(-1), F_blocks).squeeze(-1)
+    covs = block_matmul(F, block_matmul(F, covs, F_blocks).transpose(-1, -2), F_blocks) + Q
+    return means, covs, system_chol
+
+
+try:
+    gaussian_update_predict = torch.jit.script(_gaussian_update_predict)
+except Exception:  # scripting is an optimization; if this torch version can't script it, run it as python.
+    gaussian_update_predict = _gaussian_update_predict
@@ -0,0 +1,123 @@
+"""
+Kalman-filtering formulated as an associative scan over time, following Särkkä & García-Fernández (2021), "Temporal
+Parallelization of Bayesian Smoothers". Each timestep is converted into an 'element' (A, b, C, eta, J), and the filtered
+moments at time t are given by combining elements 0...t. Since the combination operator is associative, all of these can
+be computed with O(log T) batched operations instead of a sequential loop over T.
+"""
+from typing import Tuple, Callable
+
+import torch
+from torch import Tensor
+
+from torch_kalman.state_belief.utils import mask_missing
+
+Elements = Tuple[Tensor, Tensor, Tensor, Tensor, Tensor]
+
+
+def associative_scan(elements: Elements, combine: Callable[[Elements, Elements], Elements], dim: int = 1) -> Elements:
+    """
+    Inclusive scan (Hillis-Steele) over `dim` of each tensor in `elements`: the output at position t is
+    `combine(...combine(combine(x[0], x[1]), x[2])..., x[t])`.
+
+    :param elements: A tuple of tensors, all with the same length along `dim`.
+    :param combine: An associative function that takes two tuples of tensors (the 'earlier' elements first) and returns
+    a tuple of tensors.
+    :param dim: The dimension to scan over.
+    :return: A tuple of tensors with the same shapes as `elements`.
+    """
+    num_steps = elements[0].shape[dim]
+    offset = 1
+    while offset < num_steps:
+        earlier = tuple(x.narrow(dim, 0, num_steps - offset) for x in elements)
+        later = tuple(x.narrow(dim, offset, num_steps - offset) for x in elements)
+        combined = combine(earlier, later)
+        elements = tuple(torch.cat([x.narrow(dim, 0, offset), y], dim) for x, y in zip(elements, combined))
+        offset *= 2
+    return elements
+
+
+def filtering_elements(initial_mean: Tensor,
+                       initial_cov: Tensor,
+                       F: Tensor,
+                       Q: Tensor,
+                       H: Tensor,
+                       R: Tensor,
+                       obs: Tensor) -> Elements:
+    """
+    :param initial_mean: A (group, state) tensor with the prediction for the first timestep.
+    :param initial_cov: A (group, state, state) tensor with the covariance of that prediction.
+    :param F: A (group, time, state, state) tensor. F[:, t] is the transition *from* t *to* t+1.
+    :param Q: A (group, time, state, state) tensor of process-covariances, aligned with `F`.
+    :param H: A (group, time, measure, state) tensor.
+    :param R: A (group, time, measure, measure) tensor.
+    :param obs: A (group, time, measure) tensor. May contain nans.
+    :return: The (A, b, C, eta, J) elements, one for each timestep.
+    """
+    num_groups, num_times, state_size = F.shape[0:3]
+    obs, H, R, _ = mask_missing(obs, H, R)
+
+    # element t uses the transition into t. for the first element, this is the 'transition' from nothing into the
+    # initial prediction -- i.e. F=0, Q=initial_cov, and an offset of initial_mean.
+    F_prev = torch.cat([torch.zeros_like(F[:, :1]), F[:, :-1]], 1)
+    Q_prev = torch.cat([initial_cov.unsqueeze(1), Q[:, :-1]], 1)
+    offset = torch.cat([initial_mean.unsqueeze(1), torch.zeros_like(obs[:, 1:, :1].expand(-1, -1, state_size))], 1)
+
+    Ht = H.transpose(-1, -2)
+    system_cov = H.matmul(Q_prev).matmul(Ht) + R
+    chol = torch.cholesky(system_cov)
+
+    # K = Q H' S^-1
+    K = torch.cholesky_solve(H.matmul(Q_prev), chol).transpose(-1, -2)
+    I_KH = torch.eye(state_size, dtype=F.dtype, device=F.device) - K.matmul(H)
+
+    resid = obs - H.matmul(offset.unsqueeze(-1)).squeeze(-1)
+    HF = H.matmul(F_prev)
+    HFt = HF.transpose(-1, -2)
+
+    A = I_KH.matmul(F_prev)
+    b = K.matmul(obs.unsqueeze(-1)).squeeze(-1) + I_KH.matmul(offset.unsqueeze(-1)).squeeze(-1)
+    C = _sym(I_KH.matmul(Q_prev))
+    eta = HFt.matmul(torch.cholesky_solve(resid.unsqueeze(-1), chol)).squeeze(-1)
+    J = _sym(HFt.matmul(torch.cholesky_solve(HF, chol)))
+    return A, b, C, eta, J
+
+
+def combine_filtering_elements(earlier: Elements, later: Elements) -> Elements:
+    A_i, b_i, C_i, eta_i, J_i = earlier
+    A_j, b_j, C_j, eta_j, J_j = later
+    I = torch.eye(A_i.shape[-1], dtype=A_i.dtype, device=A_i.device)
+
+    # X = A_j (I + C_i J_j)^-1 ; Y = A_i' (I + J_j C_i)^-1
+    Xt, _ = torch.solve(A_j.transpose(-1, -2), I + J_j.matmul(C_i))
+    Yt, _ = torch.solve(A_i, I + C_i.matmul(J_j))
+    X = Xt.transpose(-1, -2)
+    Y = Yt.transpose(-1, -2)
+
+    A = X.matmul(A_i)
+    b = X.matmul((b_i + C_i.matmul(eta_j.unsqueeze(-1)).squeeze(-1)).unsqueeze(-1)).squeeze(-1) + b_j
+    C = _sym(X.matmul(C_i).matmul(A_j.transpose(-1, -2))) + C_j
+    eta = Y.matmul((eta_j - J_j.matmul(b_i.unsqueeze(-1)).squeeze(-1)).unsqueeze(-1)).squeeze(-1) + eta_i
+    J = _sym(Y.matmul(J_j).matmul(A_i)) + J_i
+    return A, b, C, eta, J
+
+
+def parallel_filter(initial_mean: Tensor,
+                    initial_cov: Tensor,
+                    F: Tensor,
+                    Q: Tensor,
+                    H: Tensor,
+                    R: Tensor,
+                    obs: Tensor) -> Tuple[Tensor, Tensor]:
+    """
+    Compute the filtered (i.e. updated) means and covariances at every timestep. See `filtering_elements` for
+    arguments.
+
+    :return: A (group, time, state) tensor of means and a (group, time, state, state) tensor of covariances.
+    """
+    elements = filtering_elements(initial_mean, initial_cov, F=F, Q=Q, H=H, R=R, obs=obs)
+    _, means, covs, _, _ = associative_scan(elements, combine_filtering_elements, dim=1)
+    return means, covs
+
+
+def _sym(x: Tensor) -> Tensor:
+    return .5 * (x + x.transpose(-1, -2))
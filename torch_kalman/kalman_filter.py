@@ -2,9 +2,11 @@
 Base class for torch.nn.Modules that generate predictions with the Kalman-filtering algorithm.
 """
 
-from typing import Optional, Union, Sequence
+from math import log, pi
+from typing import Optional, Union, Sequence, Tuple
 from warnings import warn
 
+import numpy as np
 import torch
 from torch.nn import Module
 
@@ -15,18 +17,29 @@ from torch_kalman.design import Design
 from torch_kalman.process import Process
 from torch_kalman.state_belief import Gaussian, StateBelief
 from torch_kalman.state_belief.base import UnmeasuredError
-from torch_kalman.state_belief.over_time import StateBeliefOverTime
+from torch_kalman.state_belief.utils import mask_missing
+from torch_kalman.state_belief.over_time import StateBeliefOverTime, StateBeliefBuffer, LogProbAccumulator
 from torch_kalman.internals.utils import identity
+from torch_kalman.internals.parallel_scan import parallel_filter
+from torch_kalman.internals.adjoint import gaussian_loglik
+from torch_kalman.internals.block_diag import Blocks, transition_covs
+from torch_kalman.utils.datetime import DateTimeHelper
 
 
 class KalmanFilter(Module):
     """
     :cvar family: A subclass of `StateBelief`, representing the distribution being predicted. In this base class this is
-     `Gaussian`. `torch-kalman` also includes `CensoredGaussian`.
+     `Gaussian`. `torch-kalman` also includes `CensoredGaussian`, `SquareRootGaussian` (which propagates the
+     cholesky-factor of the covariance, for better numerical stability), and `SequentialGaussian` (which updates one
+     measure at a time, for models with many measures).
     :cvar design_cls: The class that receives the `measures` and `processes`. In this base class this is `Design`.
+    :cvar share_covariance: If True, groups with the same design and the same history of missing measures share a
+     single covariance recursion (see `_init_shared_covariance()`). This saves work when there are many groups and few
+     patterns of missingness, but adds some overhead to each timestep, so it's off by default.
     """
     family = Gaussian
     design_cls = Design
+    share_covariance = False
 
     def __init__(self,
                  measures: Sequence[str],
@@ -73,6 +86,8 @@ class KalmanFilter(Module):
                 n_step: int = 1,
                 progress: Union[tqdm, bool] = False,
                 initial_prediction: Optional[StateBelief] = None,
+                steady_state_tol: Optional[float] = None,
+                parallel: bool = False,
                 **kwargs) -> StateBeliefOverTime:
         """
         Generate n-step-ahead predictions.
@@ -90,6 +105,15 @@ class KalmanFilter(Module):
         :param progress: Should progress-bar be displayed?
         :param initial_prediction: Usually left `None` so that initial predictions are made automatically; in some
         cases case you might pass a StateBelief generated from a previous prediction.
+        :param steady_state_tol: Optional. If the design is time-invariant (no predictors, no time-varying variance
+        adjustments), then the covariance converges to a steady-state. When the max. absolute change in the predicted
+        covariance falls below this tolerance, the kalman-gain is frozen and only the means are updated for the
+        remaining timesteps (until a timestep with missing values is encountered, after which convergence is
+        re-checked). Default None, which always computes the full covariance update.
+        :param parallel: If True, instead of looping over timesteps, the filtered states for all timesteps are computed
+        with an associative ('parallel-in-time') scan, which takes O(log(T)) batched steps instead of O(T) sequential
+        ones. This is usually faster for long series on a GPU, at the cost of more memory and more total computation.
+        Only supported for families with `supports_parallel_scan`; cannot be combined with `steady_state_tol`.
         :param kwargs: Other kwargs that will be passed to the kf's `design.for_batch()` method, which in turn passes
         them to each process (or to the NNs specified in `*_var_predict`). Sometimes, processes might share keyword-
         argument names but you want to pass different arguments to them -- for example, if you have two processes that
@@ -97,6 +121,411 @@ class KalmanFilter(Module):
         using sklearn-style double-underscoring: `process1__predictors` and `process2__predictors`.
         :return: A StateBeliefOverTime consisting of n-step-ahead predictions.
         """
+        num_groups, out_timesteps = self._standardize_timesteps(
+            *args,
+            forecast_horizon=forecast_horizon,
+            out_timesteps=out_timesteps,
+            initial_prediction=initial_prediction
+        )
+        assert n_step > 0
+
+        design_for_batch = self._design_for_batch(
+            num_groups=num_groups,
+            num_timesteps=out_timesteps + n_step - 1,
+            extends_input=n_step > 1 or bool(forecast_horizon),
+            **kwargs
+        )
+
+        state_preds, _ = self._filter(
+            *args,
+            design_for_batch=design_for_batch,
+            out_timesteps=out_timesteps,
+            n_step=n_step,
+            progress=progress,
+            initial_prediction=initial_prediction,
+            steady_state_tol=steady_state_tol,
+            parallel=parallel
+        )
+        return self.family.concatenate_over_time(state_beliefs=state_preds, design=self.design)
+
+    def loglik(self,
+               *args,
+               n_step: int = 1,
+               progress: Union[tqdm, bool] = False,
+               initial_prediction: Optional[StateBelief] = None,
+               steady_state_tol: Optional[float] = None,
+               parallel: bool = False,
+               adjoint: bool = False,
+               **kwargs) -> torch.Tensor:
+        """
+        The log-likelihood of the input, i.e. `forward(*args, **kwargs).log_prob(*args).sum(1)`. Instead of keeping the
+        predictions for every timestep and evaluating them afterwards, the log-prob of each timestep is evaluated and
+        accumulated inside the predict/update loop, which uses much less memory for long series.
+
+        :param args: See `forward()`.
+        :param n_step: See `forward()`.
+        :param progress: See `forward()`.
+        :param initial_prediction: See `forward()`.
+        :param steady_state_tol: See `forward()`.
+        :param parallel: See `forward()`.
+        :param adjoint: If True, the filter is run as a single autograd-function whose backward-pass is the analytic
+        adjoint of the kalman-filter (see `torch_kalman.internals.adjoint`), instead of autograd keeping the graph of
+        every predict/update step. This reduces memory and speeds up the backward-pass. Only supported for families with
+        `supports_adjoint`, with `n_step=1`, and cannot be combined with `steady_state_tol` or `parallel`.
+        :param kwargs: See `forward()`.
+        :return: A tensor with the log-likelihood of each group (summed over timesteps). For training, the equivalent
+        of `-pred.log_prob(y).mean()` is `-kf.loglik(y).sum() / y.shape[0] / y.shape[1]`.
+        """
+        num_groups, out_timesteps = self._standardize_timesteps(
+            *args,
+            forecast_horizon=None,
+            out_timesteps=None,
+            initial_prediction=initial_prediction
+        )
+        assert n_step > 0
+
+        design_for_batch = self._design_for_batch(
+            num_groups=num_groups,
+            num_timesteps=out_timesteps + n_step - 1,
+            extends_input=n_step > 1,
+            **kwargs
+        )
+
+        if adjoint:
+            if not self.family.supports_adjoint:
+                raise NotImplementedError(f"`adjoint` is not supported for {self.family.__name__}.")
+            if n_step != 1 or steady_state_tol is not None or parallel:
+                raise ValueError(
+                    "`adjoint` requires `n_step=1`, and cannot be combined with `steady_state_tol` or `parallel`."
+                )
+            return self._loglik_adjoint(*args, design_for_batch=design_for_batch, initial_prediction=initial_prediction)
+
+        accumulator = LogProbAccumulator(*args, design=self.design)
+        self._filter(
+            *args,
+            design_for_batch=design_for_batch,
+            out_timesteps=out_timesteps,
+            n_step=n_step,
+            progress=progress,
+            initial_prediction=initial_prediction,
+            steady_state_tol=steady_state_tol,
+            parallel=parallel,
+            state_preds=accumulator
+        )
+        return accumulator.log_prob()
+
+    def _loglik_adjoint(self,
+                        obs: torch.Tensor,
+                        design_for_batch: Design,
+                        initial_prediction: Optional[StateBelief]) -> torch.Tensor:
+        if initial_prediction is None:
+            initial_prediction = self._predict_initial_state(design_for_batch)
+        num_timesteps = obs.shape[1]
+        obs, H, R, is_valid = mask_missing(
+            obs,
+            H=design_for_batch.H.over_time[:, :num_timesteps],
+            R=design_for_batch.R_over_time[:, :num_timesteps]
+        )
+        loglik = gaussian_loglik(
+            initial_mean=initial_prediction.means,
+            initial_cov=initial_prediction.covs,
+            # F/Q at t is transition *from* t *to* t+1
+            F=design_for_batch.F.over_time[:, :num_timesteps],
+            Q=design_for_batch.Q_over_time[:, :num_timesteps],
+            H=H,
+            R=R,
+            obs=obs
+        )
+        return loglik - .5 * log(2 * pi) * is_valid.sum((1, 2))
+
+    def smooth(self,
+               *args,
+               means_only: bool = False,
+               progress: Union[tqdm, bool] = False,
+               steady_state_tol: Optional[float] = None,
+               parallel: bool = False,
+               **kwargs) -> Tuple[torch.Tensor, Optional[torch.Tensor]]:
+        """
+        Fixed-interval smoothing: estimate the state at each timestep given all of the observations (not just the
+        previous ones, as in `forward()`). The design is only created once, and is used for both the forward-pass and
+        the (batched) backward-pass; see `StateBeliefOverTime.smooth()`.
+
+        :param args: See `forward()`.
+        :param means_only: If True, the (more expensive) smoothed covariances are not computed.
+        :param progress: See `forward()`.
+        :param steady_state_tol: See `forward()`.
+        :param parallel: See `forward()`.
+        :param kwargs: See `forward()`.
+        :return: A tuple with (1) the smoothed means, with dims (group, time, state), and (2) the smoothed covariances,
+        with dims (group, time, state, state) -- or None if `means_only`.
+        """
+        num_groups, out_timesteps = self._standardize_timesteps(
+            *args,
+            forecast_horizon=None,
+            out_timesteps=None,
+            initial_prediction=None
+        )
+        design_for_batch = self._design_for_batch(
+            num_groups=num_groups,
+            num_timesteps=out_timesteps,
+            extends_input=False,
+            **kwargs
+        )
+        state_preds, _ = self._filter(
+            *args,
+            design_for_batch=design_for_batch,
+            out_timesteps=out_timesteps,
+            n_step=1,
+            progress=False,
+            initial_prediction=None,
+            steady_state_tol=steady_state_tol,
+            parallel=parallel
+        )
+        pred = self.family.concatenate_over_time(state_beliefs=state_preds, design=self.design)
+        # F/Q at t is transition *from* t *to* t+1
+        F = design_for_batch.F.over_time[:, :max(out_timesteps - 1, 1)]
+        return pred.smooth(args[0], F=F, means_only=means_only, progress=progress)
+
+    def predict_horizons(self,
+                         *args,
+                         max_horizon: int,
+                         forecast_horizon: Optional[int] = None,
+                         out_timesteps: Optional[int] = None,
+                         progress: Union[tqdm, bool] = False,
+                         parallel: bool = False,
+                         **kwargs) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Generate the predictions for every horizon from 1 to `max_horizon` in a single pass. This is equivalent to
+        calling `forward()` with each `n_step` in `1...max_horizon`, but only runs the filter once: the predictions for
+        horizon h are obtained by applying one more predict-step to the predictions for horizon h-1, batched over all
+        timesteps.
+
+        :param args: See `forward()`.
+        :param max_horizon: The maximum horizon.
+        :param forecast_horizon: See `forward()`.
+        :param out_timesteps: See `forward()`.
+        :param progress: See `forward()`.
+        :param parallel: See `forward()`.
+        :param kwargs: See `forward()`.
+        :return: A tuple with (1) the predictions, with dims (group, time, horizon, measure), and (2) the prediction-
+        uncertainty, with dims (group, time, horizon, measure, measure). Element `[:, t, h - 1]` is the prediction for
+        timestep t made h timesteps earlier -- i.e., the same as `forward(n_step=h)` would give for timestep t.
+        """
+        assert max_horizon > 0
+        num_groups, out_timesteps = self._standardize_timesteps(
+            *args,
+            forecast_horizon=forecast_horizon,
+            out_timesteps=out_timesteps,
+            initial_prediction=None
+        )
+        design_for_batch = self._design_for_batch(
+            num_groups=num_groups,
+            num_timesteps=out_timesteps,
+            extends_input=bool(forecast_horizon),
+            **kwargs
+        )
+        state_preds, _ = self._filter(
+            *args,
+            design_for_batch=design_for_batch,
+            out_timesteps=out_timesteps,
+            n_step=1,
+            progress=progress,
+            initial_prediction=None,
+            steady_state_tol=None,
+            parallel=parallel
+        )
+        pred_1step = self.family.concatenate_over_time(state_beliefs=state_preds, design=self.design)
+
+        # the prediction for timestep t at horizon h is the prediction for t-1 at horizon h-1, moved forward one step.
+        # as in `forward()`, timesteps with no prior data (t < h) get the initial prediction.
+        means, covs = pred_1step.means, pred_1step.covs
+        all_means, all_covs = [means], [covs]
+        if max_horizon > 1 and out_timesteps > 2:
+            # F/Q at t is transition *from* t *to* t+1
+            F = design_for_batch.F.over_time[:, :out_timesteps - 1]
+            Q = design_for_batch.Q_over_time[:, :out_timesteps - 1]
+            Ft = F.transpose(-1, -2)
+        for h in range(2, min(max_horizon, out_timesteps - 1) + 1):
+            means_h = F[:, h - 1:].matmul(means[:, h - 1:-1].unsqueeze(-1)).squeeze(-1)
+            covs_h = F[:, h - 1:].matmul(covs[:, h - 1:-1]).matmul(Ft[:, h - 1:]) + Q[:, h - 1:]
+            means = torch.cat([all_means[0][:, :1].expand(-1, h, -1), means_h], 1)
+            covs = torch.cat([all_covs[0][:, :1].expand(-1, h, -1, -1), covs_h], 1)
+            all_means.append(means)
+            all_covs.append(covs)
+        for h in range(max(out_timesteps, 2), max_horizon + 1):
+            # no timesteps have data from h steps earlier:
+            all_means.append(all_means[0][:, :1].expand(-1, out_timesteps, -1))
+            all_covs.append(all_covs[0][:, :1].expand(-1, out_timesteps, -1, -1))
+
+        # measurement:
+        H = pred_1step.H.unsqueeze(2)
+        means = torch.stack(all_means, 2)
+        covs = torch.stack(all_covs, 2)
+        predictions = H.matmul(means.unsqueeze(-1)).squeeze(-1)
+        prediction_uncertainty = H.matmul(covs).matmul(H.transpose(-1, -2)) + pred_1step.R.unsqueeze(2)
+        return predictions, prediction_uncertainty
+
+    def step(self,
+             state: Optional[StateBelief],
+             *args,
+             num_groups: Optional[int] = None,
+             **kwargs) -> Tuple[StateBelief, StateBelief]:
+        """
+        Advance the filter by a single timestep, for streaming/online use: instead of re-running `forward()` over each
+        group's full history when a new observation arrives, pass the forecast from the previous call along with the new
+        observation.
+
+        :param state: The one-step-ahead prediction for the current timestep (i.e. the 2nd output of the previous call
+        to `step()`); or None at the start of the series, in which case the initial state is used.
+        :param args: The observations for the current timestep, with dims (group, measure) -- see `forward()` for
+        families that take additional args. If no args are passed, the state is not updated (e.g. nothing was measured).
+        :param num_groups: The number of groups; only needed if neither `state` nor `args` are passed.
+        :param kwargs: Keyword-arguments for `design.for_batch()`, as in `forward()`. The design is only created for the
+        current timestep and the next one, so any tensors with a time-dimension should have a length of 2 along it
+        (the current timestep and the timestep being forecasted), and `start_datetimes` should be the datetimes of the
+        current timestep.
+        :return: A tuple with (1) the StateBelief updated with the observations, and (2) the one-step-ahead prediction
+        for the next timestep, which should be passed as `state` to the next call.
+        """
+        if num_groups is None:
+            num_groups = state.num_groups if state is not None else args[0].shape[0]
+        design_for_batch = self._design_for_batch(
+            num_groups=num_groups,
+            num_timesteps=2,
+            extends_input=True,
+            **kwargs
+        )
+
+        if state is None:
+            state = self._predict_initial_state(design_for_batch)
+        else:
+            state = state.copy()
+        state.compute_measurement(H=design_for_batch.H(0), R=design_for_batch.R(0), overwrite=True)
+
+        if args:
+            updated = state.update(*(arg.unsqueeze(1) if arg is not None else None for arg in args), time=0)
+            updated.compute_measurement(H=design_for_batch.H(0), R=design_for_batch.R(0))
+        else:
+            updated = state
+        # F/Q at t is transition *from* t *to* t+1
+        forecast = updated.predict(F=design_for_batch.F(0), Q=design_for_batch.Q(0), F_blocks=design_for_batch.F_blocks)
+        forecast.compute_measurement(H=design_for_batch.H(1), R=design_for_batch.R(1))
+        return updated, forecast
+
+    def backward_tbptt(self,
+                       *args,
+                       chunk_size: int,
+                       n_step: int = 1,
+                       progress: Union[tqdm, bool] = False,
+                       **kwargs) -> torch.Tensor:
+        """
+        Truncated backpropagation through time: split the time-axis into chunks, run the filter on each chunk, and call
+        `backward()` on each chunk's loss before moving on to the next. The state at the end of each chunk is detached
+        and used as the `initial_prediction` for the next, so memory usage depends on `chunk_size` rather than the
+        length of the series. Gradients are accumulated in the parameters' `.grad`, so this replaces calling
+        `loss.backward()` in the training-loop (e.g. in an `optimizer.step()` closure).
+
+        :param args: See `forward()`.
+        :param chunk_size: The number of timesteps in each chunk.
+        :param n_step: See `forward()`. Each chunk's filtering starts `n_step - 1` timesteps before the chunk, so that
+        the n-step-ahead predictions (and the loss) are the same as with `forward()`. `chunk_size` must be at least
+        `n_step`.
+        :param progress: Should progress-bar over chunks be displayed?
+        :param kwargs: See `forward()`. Tensors (or arrays) whose first two dimensions are (group, time) -- with at
+        least as many timesteps as the input -- are sliced into chunks, and `start_datetimes` is advanced to the start
+        of each chunk.
+        :return: The loss, i.e. the negative log-prob averaged over groups and timesteps (detached).
+        """
+        assert chunk_size >= n_step > 0
+        num_groups, num_timesteps, *_ = args[0].shape
+
+        progress = progress or identity
+        if progress is True:
+            progress = tqdm
+
+        loss = torch.zeros(())
+        state = None
+        for start in progress(range(0, num_timesteps, chunk_size)):
+            end = min(start + chunk_size, num_timesteps)
+            # the prediction for `start` is based on the data up to `start - n_step`, so filtering starts from the state
+            # carried at that point (the first chunk starts from the initial state, like `forward()`):
+            filter_start = max(start - n_step + 1, 0)
+            # generate enough timesteps that the state for the start of the next chunk's filtering is available:
+            out_timesteps = max(end - filter_start - n_step + 1 + int(end < num_timesteps), 1)
+
+            chunk_args = [arg[:, filter_start:end] if arg is not None else None for arg in args]
+            design_for_batch = self._design_for_batch(
+                num_groups=num_groups,
+                num_timesteps=out_timesteps + n_step - 1,
+                extends_input=True,
+                **self._chunk_kwargs(
+                    kwargs,
+                    start=filter_start,
+                    end=filter_start + out_timesteps + n_step - 1,
+                    num_groups=num_groups,
+                    num_timesteps=num_timesteps
+                )
+            )
+            state_preds, state = self._filter(
+                *chunk_args,
+                design_for_batch=design_for_batch,
+                out_timesteps=out_timesteps,
+                n_step=n_step,
+                progress=False,
+                initial_prediction=state,
+                steady_state_tol=None,
+                parallel=False
+            )
+            pred = self.family.concatenate_over_time(state_beliefs=state_preds, design=self.design)
+            # the timesteps before `start` were in the previous chunk's loss:
+            chunk_loss = -pred.log_prob(*chunk_args)[:, start - filter_start:].sum() / (num_groups * num_timesteps)
+            chunk_loss.backward()
+            loss = loss + chunk_loss.detach()
+
+            state = self.family(
+                means=state.means.detach(),
+                covs=state.covs.detach(),
+                last_measured=state.last_measured,
+                validate=False
+            )
+
+        return loss
+
+    def _chunk_kwargs(self, kwargs: dict, start: int, end: int, num_groups: int, num_timesteps: int) -> dict:
+        out = {}
+        for key, value in kwargs.items():
+            if key.split('__')[-1] == 'start_datetimes':
+                value = self._dt_helper.make_grid(np.asarray(value), start + 1)[:, -1]
+            elif isinstance(value, (torch.Tensor, np.ndarray)) and len(value.shape) >= 2:
+                if value.shape[0] == num_groups and value.shape[1] >= num_timesteps:
+                    value = value[:, start:end]
+            out[key] = value
+        return out
+
+    @property
+    def _dt_helper(self) -> DateTimeHelper:
+        """
+        A DateTimeHelper with the `dt_unit` used by the processes (and variance-predictors) of this KalmanFilter.
+        """
+        dt_units = set()
+        var_nns = list(self.design._measure_var_nn.modules()) + list(self.design._process_var_nn.modules())
+        for module in list(self.design.processes.values()) + var_nns:
+            dt_helper = getattr(module, '_dt_helper', None)
+            if dt_helper is not None:
+                dt_units.add(dt_helper.dt_unit)
+        if len(dt_units) > 1:
+            raise ValueError(f"Processes have more than one `dt_unit`: {dt_units}")
+        return DateTimeHelper(dt_unit=dt_units.pop() if dt_units else None)
+
+    def _standardize_timesteps(self,
+                               *args,
+                               forecast_horizon: Optional[int],
+                               out_timesteps: Optional[int],
+                               initial_prediction: Optional[StateBelief]) -> Tuple[int, int]:
+        """
+        Validate the input and resolve `forecast_horizon`/`out_timesteps`. Returns the number of groups and the number
+        of output timesteps.
+        """
         if not args:
             if initial_prediction is None:
                 raise ValueError("No input `args` were passed, so must pass `initial_prediction`.")
@@ -121,51 +550,140 @@ class KalmanFilter(Module):
             if forecast_horizon is not None:
                 warn("`out_timesteps` was specified so `forecast_horizon` will be ignored.")
         assert out_timesteps > 0
+        return num_groups, out_timesteps
 
-        assert n_step > 0
-
-        progress = progress or identity
-        if progress is True:
-            progress = tqdm
-        times = progress(range(1, out_timesteps))
-
+    def _design_for_batch(self, num_groups: int, num_timesteps: int, extends_input: bool, **kwargs) -> Design:
         try:
-            design_for_batch = self.design.for_batch(
-                num_groups=num_groups, num_timesteps=out_timesteps + n_step - 1, **kwargs
-            )
+            return self.design.for_batch(num_groups=num_groups, num_timesteps=num_timesteps, **kwargs)
         except IndexError as e:
-            if (n_step > 1 or forecast_horizon > 0) and ("out of bounds for dimension" in str(e)):
+            if extends_input and ("out of bounds for dimension" in str(e)):
                 raise ValueError(
                     f"Hit an index error when setting up design. If you passed external predictors, make sure they "
                     f"extend into the future to support `n_step`/`forecast_horizon`; or reduce `out_timesteps` "
-                    f"(currently {out_timesteps:,})."
+                    f"(currently need {num_timesteps:,} timesteps)."
                 ) from e
             else:
                 raise e
 
+    def _filter(self,
+                *args,
+                design_for_batch: Design,
+                out_timesteps: int,
+                n_step: int,
+                progress: Union[tqdm, bool],
+                initial_prediction: Optional[StateBelief],
+                steady_state_tol: Optional[float],
+                parallel: bool,
+                state_preds: Optional[StateBeliefBuffer] = None) -> Tuple[StateBeliefBuffer, StateBelief]:
+        """
+        Run the kalman-filter over the timesteps in `design_for_batch`. See `forward()` for arguments; `state_preds` is
+        the buffer the predictions are added to (defaults to a new StateBeliefBuffer).
+
+        :return: A buffer with the n-step-ahead predictions for each timestep; and the one-step-ahead
+        prediction for the timestep following the last update (the state to continue filtering from).
+        """
+        progress = progress or identity
+        if progress is True:
+            progress = tqdm
+        times = progress(range(1, out_timesteps))
+
         # initial state of the system:
+        predict_initial = initial_prediction is not None
         if initial_prediction is None:
-            # since we are using a "true" initial state that represents maximum uncertainty, it doesn't make sense
-            # to increase uncertainty with n_step
             initial_prediction = self._predict_initial_state(design_for_batch)
-            state_preds = [
-                initial_prediction.copy().compute_measurement(H=design_for_batch.H(t_m), R=design_for_batch.R(t_m))
-                for t_m in range(n_step)
-            ]
-        else:
-            if n_step > 1:
-                raise NotImplementedError("n_step>1 is not currently implemented when `initial_prediction` is not None")
-            state_pred = initial_prediction.copy()
-            state_pred.compute_measurement(H=design_for_batch.H(0), R=design_for_batch.R(0), overwrite=True)
-            state_preds = [state_pred]
+        # the first n_step predictions can't be based on any data. if this is the "true" initial state, it represents
+        # maximum uncertainty, so it doesn't make sense to increase uncertainty with n_step: they are all the initial
+        # prediction. if it was passed (e.g. carried over from a previous batch), it's predicted forward to each
+        # timestep, so that the state (e.g. the position in a season) is aligned with the timestep.
+        if state_preds is None:
+            state_preds = StateBeliefBuffer(num_timesteps=out_timesteps + n_step - 1)
+        # with n_step=1, each prediction is updated in the following iteration. it's only added to `state_preds` after
+        # that, so that the cholesky-factor from its update can be stored with it (see `StateBelief.cache_system_chol`):
+        unappended = None
+        initial_pred_1step = None
+        state_pred = initial_prediction
+        for t_m in range(n_step):
+            if predict_initial and t_m > 0:
+                state_pred = state_pred.predict(
+                    F=design_for_batch.F(t_m - 1),
+                    Q=design_for_batch.Q(t_m - 1),
+                    F_blocks=design_for_batch.F_blocks
+                )
+            else:
+                state_pred = initial_prediction.copy()
+            state_pred.compute_measurement(H=design_for_batch.H(t_m), R=design_for_batch.R(t_m), overwrite=True)
+            if n_step == 1 and not parallel:
+                unappended = state_pred
+            else:
+                state_preds.append(state_pred)
+            if t_m == 0:
+                initial_pred_1step = state_pred
+
+        if parallel:
+            if not self.family.supports_parallel_scan:
+                raise NotImplementedError(f"`parallel` is not supported for {self.family.__name__}.")
+            if steady_state_tol is not None:
+                raise ValueError("Cannot pass both `parallel` and `steady_state_tol`.")
+            state_pred_1step = self._forward_parallel(
+                *args,
+                state_preds=state_preds,
+                initial_prediction=initial_prediction,
+                design_for_batch=design_for_batch,
+                out_timesteps=out_timesteps,
+                n_step=n_step
+            )
+            if state_pred_1step is None:
+                state_pred_1step = initial_pred_1step
+            return state_preds, state_pred_1step
+
+        if steady_state_tol is not None:
+            if not self.family.supports_steady_state:
+                raise NotImplementedError(f"`steady_state_tol` is not supported for {self.family.__name__}.")
+            if not design_for_batch.is_time_invariant:
+                warn("`steady_state_tol` was passed but the design is not time-invariant, so it will be ignored.")
+                steady_state_tol = None
 
         # predict/update loop:
-        state_pred_1step = state_preds[-1]
+        state_pred_1step = initial_pred_1step
+        steady = None
+        shared = self._init_shared_covariance(state_pred_1step)
         for t1 in times:
             t = t1 - 1
+            fully_observed = self._is_fully_observed(args, t)
+            if steady is not None and not fully_observed:
+                # leaving the steady-state, where the covariance is still the same for all groups (if the design is), so
+                # sharing can start over from a single class:
+                steady = None
+                shared = self._init_shared_covariance(state_pred_1step)
+            # the classes are only valid as long as every update goes through them:
+            if shared is not None:
+                if args and t < args[0].shape[1]:
+                    shared = self._update_shared_covariance(shared, obs=args[0][:, t], belief=state_pred_1step)
+                else:
+                    shared = None
+            use_shared = shared is not None
+            fused = fully_observed and steady is None and not use_shared and self.family.supports_fused_step
 
             # reconcile last timestep's 1step prediction with what was actually measured:
-            if args:
+            if fused:
+                # update is fused with the first predict-step below:
+                state_pred = state_pred_1step
+            elif steady is not None and fully_observed:
+                state_pred = state_pred_1step.update_with_gain(
+                    args[0][:, t],
+                    K=steady['K'],
+                    covs=steady['covs_upd'],
+                    system_chol=steady['system_chol']
+                )
+            elif use_shared:
+                group_class = shared['group_class']
+                state_pred = state_pred_1step.update_with_gain(
+                    args[0][:, t],
+                    K=shared['K'][group_class],
+                    covs=shared['covs_upd'][group_class],
+                    system_chol=shared['system_chol'][group_class]
+                )
+            elif args:
                 state_pred = state_pred_1step.update(*args, time=t)
             else:
                 state_pred = state_pred_1step.copy()
@@ -173,8 +691,37 @@ class KalmanFilter(Module):
             # predict
             # F/Q at t is transition *from* t *to* t+1
             for i in range(n_step):
-                state_pred = state_pred.predict(F=design_for_batch.F(t + i), Q=design_for_batch.Q(t + i))
+                if fused and i == 0:
+                    state_pred = state_pred.update_predict(
+                        obs=args[0][:, t],
+                        F=design_for_batch.F(t),
+                        Q=design_for_batch.Q(t),
+                        F_blocks=design_for_batch.F_blocks
+                    )
+                else:
+                    F, Q = design_for_batch.F(t + i), design_for_batch.Q(t + i)
+                    covs = None
+                    if i == 0 and steady is not None:
+                        covs = steady['covs_pred']
+                    elif i == 0 and use_shared:
+                        covs = self._predict_shared_covariance(shared, F=F, Q=Q, F_blocks=design_for_batch.F_blocks)
+                        if covs is None:
+                            shared = None
+                    state_pred = state_pred.predict(F=F, Q=Q, covs=covs, F_blocks=design_for_batch.F_blocks)
                 if i == 0:
+                    # check whether the covariance has converged:
+                    if steady_state_tol is not None and steady is None and fully_observed:
+                        steady = self._check_steady_state(
+                            prev=state_pred_1step,
+                            new=state_pred,
+                            tol=steady_state_tol,
+                            H=design_for_batch.H(t1),
+                            R=design_for_batch.R(t1)
+                        )
+                        if steady is not None:
+                            # the steady-state gain is used for all groups, so the classes no longer apply:
+                            shared = None
+
                     # always need to save the 1step for the next iter, even if it's not the output:
                     state_pred_1step = state_pred
                     state_pred_1step.compute_measurement(H=design_for_batch.H(t1), R=design_for_batch.R(t1))
@@ -182,9 +729,185 @@ class KalmanFilter(Module):
             # if not 1step, need to additionally compute measurement for output:
             if i > 0:
                 state_pred.compute_measurement(H=design_for_batch.H(t1 + i), R=design_for_batch.R(t1 + i))
-            state_preds.append(state_pred)
+            if unappended is None:
+                state_preds.append(state_pred)
+            else:
+                state_preds.append(unappended, system_chol=unappended.system_chol_cache)
+                unappended = state_pred
 
-        return self.family.concatenate_over_time(state_beliefs=state_preds, design=self.design)
+        if unappended is not None:
+            state_preds.append(unappended)
+
+        return state_preds, state_pred_1step
+
+    def _forward_parallel(self,
+                          *args,
+                          state_preds: StateBeliefBuffer,
+                          initial_prediction: StateBelief,
+                          design_for_batch: Design,
+                          out_timesteps: int,
+                          n_step: int) -> Optional[StateBelief]:
+        """
+        Equivalent to the predict/update loop in `forward()`, but with the updates for all timesteps computed at once
+        using `parallel_filter()`. The predictions following the `n_step` initial ones are added to `state_preds`; the
+        last one-step-ahead prediction is returned (None if there were no updates).
+        """
+        num_filtered = out_timesteps - 1
+        if num_filtered == 0:
+            return None
+        num_groups = design_for_batch.num_groups
+
+        # observations past the end of the input are treated as missing:
+        if args:
+            obs = args[0][:, :num_filtered]
+        else:
+            obs = initial_prediction.means.new_empty((num_groups, 0, len(self.design.measures)))
+        if obs.shape[1] < num_filtered:
+            padding = torch.full(
+                (num_groups, num_filtered - obs.shape[1], obs.shape[2]),
+                float('nan'),
+                dtype=obs.dtype,
+                device=obs.device
+            )
+            obs = torch.cat([obs, padding], 1)
+
+        # F/Q at t is transition *from* t *to* t+1
+        means, covs = parallel_filter(
+            initial_mean=initial_prediction.means,
+            initial_cov=initial_prediction.covs,
+            F=design_for_batch.F.over_time[:, :num_filtered],
+            Q=design_for_batch.Q_over_time[:, :num_filtered],
+            H=design_for_batch.H.over_time[:, :num_filtered],
+            R=design_for_batch.R_over_time[:, :num_filtered],
+            obs=obs
+        )
+
+        # predict:
+        for i in range(n_step):
+            F = design_for_batch.F.over_time[:, i:i + num_filtered]
+            Q = design_for_batch.Q_over_time[:, i:i + num_filtered]
+            means = F.matmul(means.unsqueeze(-1)).squeeze(-1)
+            covs = F.matmul(covs).matmul(F.transpose(-1, -2)) + Q
+            if i == 0:
+                means_1step, covs_1step = means[:, -1], covs[:, -1]
+
+        # timesteps since last measured, as of each update:
+        times = torch.arange(num_filtered, device=obs.device).expand(num_groups, -1)
+        any_measured = (~torch.isnan(obs)).any(-1)
+        last_measured_times, _ = torch.cummax(torch.where(any_measured, times, torch.full_like(times, -1)), dim=1)
+        initial_last_measured = initial_prediction.last_measured.to(dtype=times.dtype).unsqueeze(-1).expand_as(times)
+        last_measured = torch.where(
+            last_measured_times >= 0,
+            times - last_measured_times,
+            # never measured, so continues counting from the initial prediction:
+            times + initial_last_measured
+        )
+        last_measured = last_measured.to(dtype=initial_prediction.last_measured.dtype)
+
+        state_pred_1step = self.family(means=means_1step, covs=covs_1step, last_measured=last_measured[:, -1] + 1)
+        state_pred_1step.compute_measurement(H=design_for_batch.H(num_filtered), R=design_for_batch.R(num_filtered))
+
+        last_measured = last_measured + n_step
+
+        state_preds.extend_stacked(
+            self.family,
+            means=means,
+            covs=covs,
+            last_measured=last_measured,
+            H=design_for_batch.H.over_time[:, n_step:n_step + num_filtered],
+            R=design_for_batch.R_over_time[:, n_step:n_step + num_filtered]
+        )
+        return state_pred_1step
+
+    @staticmethod
+    def _is_fully_observed(args: Sequence[torch.Tensor], t: int) -> bool:
+        if not args or t >= args[0].shape[1]:
+            return False
+        obs = args[0][:, t]
+        # the fused/steady-state updates skip the checks in `update()`, so validate here:
+        if torch.isinf(obs).any():
+            raise RuntimeError("Infs not allowed in `obs`")
+        return not torch.isnan(obs).any()
+
+    def _check_steady_state(self,
+                            prev: StateBelief,
+                            new: StateBelief,
+                            tol: float,
+                            H: torch.Tensor,
+                            R: torch.Tensor) -> Optional[dict]:
+        """
+        If the one-step-ahead covariance has stopped changing, compute the (fixed) gain and updated covariance that
+        will be used for subsequent timesteps.
+        """
+        if (new.covs - prev.covs).abs().max() >= tol:
+            return None
+        K, covs_upd, system_chol = self.family.steady_state_gain(covs=new.covs, H=H, R=R)
+        return {'K': K, 'covs_upd': covs_upd, 'covs_pred': new.covs, 'system_chol': system_chol}
+
+    def _init_shared_covariance(self, initial_pred: StateBelief) -> Optional[dict]:
+        """
+        In a design that is the same for every group, the covariance only depends on which measures were missing at
+        each timestep -- not on the observed values. So groups with the same history of missingness can share the
+        covariance recursion: it's computed once for each 'class' of groups, and then expanded back to all groups. This
+        requires an update that only depends on the observations through the mean (see `supports_steady_state`).
+
+        :return: A dict tracking the class of each group, or None if sharing isn't possible (or `share_covariance` is
+        False).
+        """
+        if not self.share_covariance:
+            return None
+        if not self.family.supports_steady_state or initial_pred.num_groups < 2:
+            return None
+        if not self._same_for_all_groups(initial_pred.covs):
+            return None
+        group_class = torch.zeros(initial_pred.num_groups, dtype=torch.long, device=initial_pred.covs.device)
+        return {'group_class': group_class}
+
+    def _update_shared_covariance(self, shared: dict, obs: torch.Tensor, belief: StateBelief) -> Optional[dict]:
+        """
+        Split the classes of groups by their pattern of missing measures in `obs`, and compute the kalman-gain and
+        updated covariance for each class.
+
+        :return: The updated dict, or None if sharing is no longer possible (the design differs across groups, or
+        there are too many classes for sharing to save any work).
+        """
+        if not (self._same_for_all_groups(belief.H) and self._same_for_all_groups(belief.R)):
+            return None
+
+        num_groups = len(shared['group_class'])
+        is_nan = torch.isnan(obs).to(dtype=torch.long)
+        _, group_class = torch.unique(torch.cat([shared['group_class'].unsqueeze(-1), is_nan], 1),
+                                      dim=0,
+                                      return_inverse=True)
+        num_classes = int(group_class.max()) + 1
+        if num_classes * 2 > num_groups:
+            return None
+
+        # one representative group for each class:
+        reps = torch.empty(num_classes, dtype=torch.long, device=group_class.device)
+        reps.scatter_(0, group_class, torch.arange(num_groups, device=group_class.device))
+
+        _, H, R, _ = mask_missing(obs[reps], belief.H[reps], belief.R[reps])
+        K, covs_upd, system_chol = self.family.steady_state_gain(covs=belief.covs[reps], H=H, R=R)
+        return {'group_class': group_class, 'reps': reps, 'K': K, 'covs_upd': covs_upd, 'system_chol': system_chol}
+
+    def _predict_shared_covariance(self,
+                                   shared: dict,
+                                   F: torch.Tensor,
+                                   Q: torch.Tensor,
+                                   F_blocks: Optional[Blocks] = None) -> Optional[torch.Tensor]:
+        """
+        :return: The predicted covariance for all groups, computed once per class; or None if F/Q differ across groups.
+        """
+        if not (self._same_for_all_groups(F) and self._same_for_all_groups(Q)):
+            return None
+        F, Q = F[shared['reps']], Q[shared['reps']]
+        covs = transition_covs(F, shared['covs_upd'], F_blocks) + Q
+        return covs[shared['group_class']]
+
+    @staticmethod
+    def _same_for_all_groups(tens: torch.Tensor) -> bool:
+        return bool((tens == tens[:1]).all())
 
     def _predict_initial_state(self, design_for_batch: Design) -> 'Gaussian':
         return self.family(
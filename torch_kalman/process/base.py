@@ -6,7 +6,7 @@ import torch
 from torch import Tensor
 from torch.nn import Parameter
 
-from torch_kalman.internals.batch import Batchable
+from torch_kalman.internals.batch import Batchable, BatchCache
 from torch_kalman.internals.utils import infer_forward_kwargs
 
 from torch_kalman.process.utils.design_matrix import (
@@ -36,6 +36,9 @@ class Process(NiceRepr, Batchable):
         # a callable that predicts the initial state
         self.initial_state = initial_state or InitialState(self.state_elements)
 
+        # parameter-free parts of `for_batch()`, shared by the output of `for_batch()` (which is a shallow copy):
+        self._batch_cache = BatchCache()
+
         self._validate()
 
     def for_batch(self, num_groups: int, num_timesteps: int, **kwargs) -> 'Process':
@@ -5,7 +5,6 @@ import torch
 from torch import Tensor
 
 from torch_kalman.process import Process
-from torch_kalman.internals.utils import split_flat
 from torch_kalman.process.utils.bounded import Bounded
 
 
@@ -114,12 +113,15 @@ class LinearModel(Process):
         if predictors.shape[1] > num_timesteps:
             predictors = predictors[:, 0:num_timesteps, :]
 
+        # (group, time) tensor for each predictor. `unbind` splits with a single op, so this is fine even if the
+        # predictors require grad:
+        predictors = predictors.unbind(-1)
         for measure in self.measures:
             for i, cov in enumerate(self.state_elements):
                 for_batch._adjust_measure(
                     measure=measure,
                     state_element=cov,
-                    adjustment=split_flat(predictors[:, :, i], dim=1)
+                    adjustment=predictors[i]
                 )
 
         return for_batch
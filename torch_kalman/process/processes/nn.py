@@ -44,10 +44,11 @@ class NN(Process):
         zero. Usually only used if `process_variance=True`. Default False. Instead of `True` you can specify custom-
         bounds for the decay-rate as a tuple.
         :param time_split_kwargs: When calling the KalmanFilter, you will pass a prediction Tensor for your nn.Module
-        that is (num_groups, num_timesteps, input_dim). However, internally, this will be split up into multiple
-        tensors, and your nn.Module will take a (num_groups, input_dim) tensor. If your nn.Module's `forward()` method
-        takes just a single argument, then we can infer how to split this tensor. But if it takes multiple keyword
-        arguments, you need to specify which will be split in this fashion.
+        that is (num_groups, num_timesteps, input_dim). However, internally, this will be flattened into a
+        (num_groups * num_timesteps, input_dim) tensor, so that your nn.Module is called once on a
+        (batch-size, input_dim) tensor. If your nn.Module's `forward()` method takes just a single argument, then we
+        can infer how to flatten this tensor. But if it takes multiple keyword arguments, you need to specify which will
+        be flattened in this fashion (the others are repeated for each timestep).
         :param initial_state: Optional, a callable (typically a torch.nn.Module). When the KalmanFilter is called,
         keyword-arguments can be passed to initial_state in the format `{this_process}_initial_state__{kwarg}`.
         """
@@ -112,7 +113,8 @@ class NN(Process):
             num_timesteps=num_timesteps,
             nn_kwargs=kwargs,
             output_names=self.state_elements,
-            time_split_kwargs=self.nn._time_split_kwargs
+            time_split_kwargs=self.nn._time_split_kwargs,
+            infer_time_split=True
         )
         for measure in self.measures:
             for state_element in self.state_elements:
@@ -1,4 +1,4 @@
-from typing import Optional, Union, Tuple, Sequence
+from typing import Optional, Union, Tuple, Sequence, Dict
 
 import numpy as np
 import torch
@@ -8,7 +8,7 @@ from torch.nn import ParameterDict
 from torch_kalman.process import Process
 from torch_kalman.process.base import InitialState
 from torch_kalman.process.utils.bounded import Bounded
-from torch_kalman.internals.utils import split_flat, zpad
+from torch_kalman.internals.utils import zpad
 from torch_kalman.utils.datetime import DateTimeHelper
 
 
@@ -107,22 +107,16 @@ class Season(Process):
             if self._dt_helper.dt_unit:
                 raise TypeError("Missing argument `start_datetimes`.")
             start_datetimes = np.zeros(num_groups)
-        delta = self._dt_helper.make_delta_grid(start_datetimes, num_timesteps)
-
-        in_transition = (delta % self.season_duration) == (self.season_duration - 1)
 
-        transitions = {
-            'to_next_state': torch.from_numpy(in_transition.astype('float32')),
-            'from_measured_to_measured': torch.from_numpy(np.where(in_transition, -1., 1.).astype('float32'))
-        }
-        transitions['to_self'] = 1 - transitions['to_next_state']
-        transitions['to_measured'] = -transitions['to_next_state']
+        # these don't depend on the parameters, so are only computed once for repeated calls with the same batch:
+        transitions = self._batch_cache.get(
+            key=self._batch_cache.make_key(start_datetimes, num_timesteps),
+            fun=lambda: self._transitions_for_batch(start_datetimes, num_timesteps)
+        )
 
-        for k in transitions.keys():
-            transitions[k] = split_flat(transitions[k], dim=1, clone=True)
-            if self.decay is not None:
-                decay_value = self.decay.get_value()
-                transitions[k] = [x * decay_value for x in transitions[k]]
+        if self.decay is not None:
+            decay_value = self.decay.get_value()
+            transitions = {k: v * decay_value for k, v in transitions.items()}
 
         # this is convoluted, but the idea is to manipulate the transitions so that we use one less degree of freedom
         # than the number of seasons, by having the 'measured' state be equal to -sum(all others)
@@ -143,6 +137,19 @@ class Season(Process):
 
         return for_batch
 
+    def _transitions_for_batch(self, start_datetimes: np.ndarray, num_timesteps: int) -> Dict[str, torch.Tensor]:
+        delta = self._dt_helper.make_delta_grid(start_datetimes, num_timesteps)
+
+        in_transition = (delta % self.season_duration) == (self.season_duration - 1)
+
+        transitions = {
+            'to_next_state': torch.from_numpy(in_transition.astype('float32')),
+            'from_measured_to_measured': torch.from_numpy(np.where(in_transition, -1., 1.).astype('float32'))
+        }
+        transitions['to_self'] = 1 - transitions['to_next_state']
+        transitions['to_measured'] = -transitions['to_next_state']
+        return transitions
+
 
 class SeasonInitialState(InitialState):
     _forward_kwargs = ['num_groups', 'start_datetimes']
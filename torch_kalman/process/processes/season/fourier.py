@@ -9,8 +9,7 @@ import numpy as np
 
 from torch_kalman.process.utils.bounded import Bounded
 
-from torch_kalman.process.utils.fourier import fourier_tensor
-from torch_kalman.internals.utils import split_flat
+from torch_kalman.process.utils.fourier import cached_fourier_tensor
 from torch_kalman.utils.datetime import DateTimeHelper
 
 
@@ -65,6 +64,23 @@ class _FourierSeason(Process):
             p['decay'] = self.decay.parameter
         return p
 
+    def _fourier_tensor_for_batch(self, start_datetimes: np.ndarray, num_timesteps: int) -> Tensor:
+        """
+        :return: A (group, time, K, 2) tensor with the fourier-terms for each group/timestep. This doesn't depend on the
+        parameters, so is only computed once for repeated calls with the same batch.
+        """
+        return self._batch_cache.get(
+            key=self._batch_cache.make_key(start_datetimes, num_timesteps),
+            fun=lambda: self._fourier_tensor(start_datetimes, num_timesteps)
+        )
+
+    def _fourier_tensor(self, start_datetimes: np.ndarray, num_timesteps: int) -> Tensor:
+        # determine the delta (integer time accounting for different groups having different start datetimes)
+        delta = self._dt_helper.make_delta_grid(start_datetimes, num_timesteps)
+
+        # generate the fourier tensor (shared with other processes with the same period/K/delta):
+        return cached_fourier_tensor(delta=delta, seasonal_period=self.seasonal_period, K=self.K)
+
     @property
     def dynamic_state_elements(self) -> Sequence[str]:
         raise NotImplementedError
@@ -112,18 +128,11 @@ class FourierSeason(_FourierSeason):
 
         for_batch = super().for_batch(num_groups=num_groups, num_timesteps=num_timesteps)
 
-        # determine the delta (integer time accounting for different groups having different start datetimes)
         if start_datetimes is None:
             if self._dt_helper.dt_unit:
                 raise TypeError("Missing argument `start_datetimes`.")
             start_datetimes = np.zeros(num_groups)
-        delta = self._dt_helper.make_delta_grid(start_datetimes, num_timesteps)
-
-        # determine season:
-        season = delta % self.seasonal_period
-
-        # generate the fourier tensor:
-        fourier_tens = fourier_tensor(time=Tensor(season), seasonal_period=self.seasonal_period, K=self.K)
+        fourier_tens = self._fourier_tensor_for_batch(start_datetimes, num_timesteps)
 
         for measure in self.measures:
             for state_element in self.state_elements:
@@ -131,7 +140,7 @@ class FourierSeason(_FourierSeason):
                 for_batch._adjust_measure(
                     measure=measure,
                     state_element=state_element,
-                    adjustment=split_flat(fourier_tens[:, :, r, c], dim=1)
+                    adjustment=fourier_tens[:, :, r, c]
                 )
 
         return for_batch
@@ -165,16 +174,9 @@ class FourierSeason2(_FourierSeason):
 
         for_batch = super().for_batch(num_groups=num_groups, num_timesteps=num_timesteps)
 
-        # determine the delta (integer time accounting for different groups having different start datetimes)
         if start_datetimes is None:
             start_datetimes = np.zeros(num_groups)
-        delta = self._dt_helper.make_delta_grid(start_datetimes, num_timesteps)
-
-        # determine season:
-        season = delta % self.seasonal_period
-
-        # generate the fourier tensor:
-        fourier_tens = fourier_tensor(time=Tensor(season), seasonal_period=self.seasonal_period, K=self.K)
+        fourier_tens = self._fourier_tensor_for_batch(start_datetimes, num_timesteps)
 
         for state_element in self.state_elements:
             if state_element == 'position':
@@ -183,7 +185,7 @@ class FourierSeason2(_FourierSeason):
             for_batch._adjust_transition(
                 from_element=state_element,
                 to_element='position',
-                adjustment=split_flat(fourier_tens[:, :, r, c], dim=1)
+                adjustment=fourier_tens[:, :, r, c]
             )
 
         return for_batch
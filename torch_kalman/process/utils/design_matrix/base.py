@@ -96,7 +96,9 @@ class DesignMatrix(NiceRepr, Batchable):
         initial value and all adjustments, (b) applying the ilink function from `set_ilink()`.
 
         :param value: Either (a) a torch.Tensor or (b) a sequence of torch.Tensors (one for each timepoint). The tensor
-          should be either scalar, or be 1D with length = self.num_groups.
+          should be either scalar, or be 1D with length = self.num_groups, or be 2D with shape (num_groups,
+          num_timesteps) -- the latter is preferred over (b) for adjustments that vary over time, since it avoids
+          creating a tensor per timestep.
         :param check_slow_grad: A natural way to create adjustments is to first create a tensor that `requires_grad`,
           then split it into a list of tensors, one for each time-point. This way of creating adjustments should be
           avoided because it leads to a very slow backwards pass. When check_slow_grad is True then a heuristic is used
@@ -147,7 +149,7 @@ class DesignMatrix(NiceRepr, Batchable):
     def compile(self) -> 'DynamicMatrix':
         """
         Consolidate assignments then apply the link function. Some assignments can be "frozen" into a pre-computed
-        matrix, while others must remain as lists to be evaluated in DesignForBatch as needed.
+        matrix, while others vary over time; the DynamicMatrix combines these into a (group, time, rows, cols) tensor.
         """
         from torch_kalman.process.utils.design_matrix.dynamic_matrix import DynamicMatrix
 
@@ -159,18 +161,15 @@ class DesignMatrix(NiceRepr, Batchable):
             ilink = self._ilinks[(dim1, dim2)] or identity
             dynamic, base = bifurcate(values, _is_dynamic_assignment)
             if dynamic:
-                # if any dynamic, then all dynamic:
-                dynamic = dynamic + [[x] * self.num_timesteps for x in base]
-                per_timestep = list(zip(*dynamic))  # invert
-                assert len(per_timestep) == self.num_timesteps
+                # if any dynamic, then all dynamic. the values are summed as (group, time) tensors (broadcasting when
+                # they're the same for each group/time), then the ilink is applied once:
                 assert (r, c) not in dynamic_assignments.keys()
-                dynamic_assignments[(r, c)] = [
-                    ilink(torch.sum(torch.stack(broadcast_all(*x), dim=0), dim=0)) for x in per_timestep
-                ]
+                total = sum(_group_by_time(x) for x in dynamic + base)
+                dynamic_assignments[(r, c)] = ilink(total)
             else:
                 base_mat[:, r, c] = ilink(torch.sum(torch.stack(broadcast_all(*base), dim=0), dim=0))
 
-        return DynamicMatrix(base_mat, dynamic_assignments)
+        return DynamicMatrix(base_mat, dynamic_assignments, num_timesteps=self.num_timesteps)
 
     # utils ------------------------------------------
     @classmethod
@@ -247,13 +246,16 @@ class DesignMatrix(NiceRepr, Batchable):
     def _check_adjust_tens(self, tens: Tensor, in_list: bool, check_slow_grad: bool = True):
         is_scalar = tens.numel() == 1
         is_num_groups_1d = list(tens.shape) == [self.num_groups]
-        if not (is_scalar or is_num_groups_1d):
-            if in_list:
+        if in_list:
+            if not (is_scalar or is_num_groups_1d):
                 raise InputValidationError(
                     "If list is passed, then each element should be scalar or be 1D w/len = num_groups."
                 )
-            else:
-                raise InputValidationError("If tensor is passed, then should be scalar or be 1D w/len = num_groups.")
+        elif not (is_scalar or is_num_groups_1d or list(tens.shape) == [self.num_groups, self.num_timesteps]):
+            raise InputValidationError(
+                "If tensor is passed, then should be scalar, be 1D w/len = num_groups, or be 2D w/shape (num_groups, "
+                "num_timesteps)."
+            )
         if in_list and check_slow_grad and is_slow_grad(tens):
             raise RuntimeError(
                 "This adjustment appears to have been generated by first creating a tensor that `requires_grad`, then "
@@ -265,4 +267,17 @@ class DesignMatrix(NiceRepr, Batchable):
 
 
 def _is_dynamic_assignment(x) -> bool:
-    return isinstance(x, (list, tuple))
+    return isinstance(x, (list, tuple)) or (isinstance(x, Tensor) and x.dim() == 2)
+
+
+def _group_by_time(x: Union[Tensor, Sequence[Tensor]]) -> Tensor:
+    """
+    Standardize an assignment/adjustment into a tensor that can be broadcast to (group, time).
+    """
+    if isinstance(x, (list, tuple)):
+        # one (scalar or group) tensor per timestep:
+        return torch.stack(broadcast_all(*x), dim=-1).reshape(-1, len(x))
+    if x.dim() == 2:
+        return x
+    # scalar or one per group, same for each timestep:
+    return x.reshape(-1, 1)
@@ -1,21 +1,119 @@
-from typing import Dict, Tuple
+from typing import Dict, Tuple, Sequence, List, Optional
 
+import torch
+from lazy_object_proxy.utils import cached_property
 from torch import Tensor
+
 from torch_kalman.internals.repr import NiceRepr
-from torch_kalman.process.utils.design_matrix.utils import SeqOfTensors
 
 
 class DynamicMatrix(NiceRepr):
+    """
+    The output of `DesignMatrix.compile()`: a base-matrix, plus the elements that vary over time. For all timesteps at
+    once, the matrix is available as a single (group, time, rows, cols) tensor, `over_time`, which is built with one
+    scatter of all the dynamic elements into the base-matrix. Calling the matrix with a timestep returns a view into
+    this.
+    """
     _repr_attrs = ()
 
-    def __init__(self, base_mat: Tensor, dynamic_assignments: Dict[Tuple[int, int], SeqOfTensors]):
+    def __init__(self,
+                 base_mat: Tensor,
+                 dynamic_assignments: Dict[Tuple[int, int], Tensor],
+                 num_timesteps: Optional[int] = None):
+        """
+        :param base_mat: A (group, rows, cols) tensor, with the value of every element that doesn't vary over time.
+        :param dynamic_assignments: A dictionary whose keys are (row, col) and whose values are (group, time) tensors
+        (or (1, time), if the same for every group).
+        :param num_timesteps: The number of timesteps. Optional if there are dynamic-assignments.
+        """
         self.base_mat = base_mat
         self.dynamic_assignments = dynamic_assignments
+        if num_timesteps is None:
+            if not dynamic_assignments:
+                raise ValueError("Must pass `num_timesteps` if there are no `dynamic_assignments`.")
+            num_timesteps = next(iter(dynamic_assignments.values())).shape[-1]
+        self.num_timesteps = num_timesteps
 
     def __call__(self, t: int) -> Tensor:
-        out = self.base_mat
-        if self.dynamic_assignments:
-            out = out.clone()
-        for (r, c), values in self.dynamic_assignments.items():
-            out[..., r, c] = values[t]
-        return out
+        if not self.dynamic_assignments:
+            return self.base_mat
+        return self._by_timestep[t]
+
+    @cached_property
+    def over_time(self) -> Tensor:
+        """
+        A (group, time, rows, cols) tensor. If there are no dynamic-assignments, the time-dimension is expanded (so no
+        copy is made).
+        """
+        num_groups, num_rows, num_cols = self.base_mat.shape
+        if not self.dynamic_assignments:
+            return self.base_mat.unsqueeze(1).expand(-1, self.num_timesteps, -1, -1)
+        values = torch.stack([v.expand(num_groups, -1) for v in self.dynamic_assignments.values()], -1)
+        values = values.to(dtype=self.base_mat.dtype)
+        idx = torch.tensor([r * num_cols + c for r, c in self.dynamic_assignments.keys()], device=values.device)
+        base = self.base_mat.reshape(num_groups, 1, -1).expand(-1, self.num_timesteps, -1)
+        out = base.scatter(-1, idx.expand_as(values), values)
+        return out.view(num_groups, self.num_timesteps, num_rows, num_cols)
+
+    @cached_property
+    def _by_timestep(self) -> Tuple[Tensor, ...]:
+        # if we sliced `over_time` separately at each timestep, then (since the gradient of each slice is the size of
+        # the whole tensor) the backward-pass would be quadratic in the number of timesteps. instead, split it into
+        # timesteps with a single op:
+        return self.over_time.unbind(1)
+
+    def block_structure(self, slices: Sequence[slice]) -> List[Tuple[int, int, str]]:
+        """
+        Describe a square matrix that is block-diagonal (see `torch_kalman.internals.block_diag`). Each block is
+        classified as 'identity', 'diagonal', or 'companion' (at every timestep), or else 'dense'; and adjacent
+        identity/diagonal blocks are merged. If the matrix is not actually block-diagonal with these blocks, a single
+        dense block is returned.
+
+        :param slices: The slices of the rows/columns for each block, e.g. `Design.process_slices`.
+        :return: A list of (start, end, kind) tuples.
+        """
+        with torch.no_grad():
+            nonzero = (self.base_mat != 0).any(0)
+            for r, c in self.dynamic_assignments.keys():
+                nonzero[r, c] = True
+            size = nonzero.shape[-1]
+
+            in_block = torch.zeros_like(nonzero)
+            blocks = []
+            for sl in slices:
+                start, stop, _ = sl.indices(size)
+                in_block[start:stop, start:stop] = True
+                off_diag = ~torch.eye(stop - start, dtype=torch.bool, device=nonzero.device)
+                if (nonzero[start:stop, start:stop] & off_diag).any():
+                    kind = 'companion' if self._is_companion(nonzero[start:stop, start:stop]) else 'dense'
+                elif any(start <= r < stop for r, _ in self.dynamic_assignments.keys()):
+                    kind = 'diagonal'
+                else:
+                    block = self.base_mat[:, start:stop, start:stop]
+                    is_identity = (block == torch.eye(stop - start, dtype=block.dtype, device=block.device)).all()
+                    kind = 'identity' if is_identity else 'diagonal'
+
+                if blocks and blocks[-1][1] == start and {kind, blocks[-1][2]} <= {'identity', 'diagonal'}:
+                    # merge adjacent identity/diagonal blocks:
+                    start, _, prev_kind = blocks.pop()
+                    kind = 'identity' if kind == prev_kind == 'identity' else 'diagonal'
+                blocks.append((start, stop, kind))
+
+            is_contiguous = all(prev[1] == block[0] for prev, block in zip(blocks, blocks[1:]))
+            if not blocks or not is_contiguous or blocks[0][0] != 0 or blocks[-1][1] != size:
+                return [(0, size, 'dense')]
+            if (nonzero & ~in_block).any():
+                return [(0, size, 'dense')]
+        return blocks
+
+    @staticmethod
+    def _is_companion(nonzero: Tensor) -> bool:
+        size = nonzero.shape[-1]
+        if size < 3:
+            # no faster than the dense product
+            return False
+        # after the first row, only the diagonal and sub-diagonal:
+        idx = torch.arange(size, device=nonzero.device)
+        offset = idx.unsqueeze(-1) - idx
+        band = (offset == 0) | (offset == 1)
+        return not (nonzero[1:] & ~band[1:]).any()
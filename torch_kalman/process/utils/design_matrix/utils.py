@@ -1,5 +1,6 @@
-from typing import Sequence, Union, Tuple, List, Callable, Dict
+from typing import Sequence, Union, Tuple, List, Callable, Dict, Optional, Iterator
 
+import numpy as np
 import torch
 from torch_kalman.internals.exceptions import InputValidationError
 
@@ -13,59 +14,46 @@ def adjustments_from_nn(nn: torch.nn.Module,
                         num_timesteps: int,
                         nn_kwargs: dict,
                         output_names: Sequence[str],
-                        time_split_kwargs: Sequence[str] = ()
+                        time_split_kwargs: Sequence[str] = (),
+                        infer_time_split: bool = False
                         ) -> Dict[str, 'DesignMatAdjustment']:
     """
-    An important challenge with using nn-modules to predict outputs is that we pass inputs for the entire group X time
-    batch, but we need to split these inputs by time before passing them to the nn's `forward()` method, otherwise the
-    backward pass will be very slow due to how PyTorch handles masking gradients. This helper uses heuristics to infer
-    which inputs to split.
+    We pass inputs for the entire group X time batch, but the nn's `forward()` method takes inputs for a batch of
+    groups, with time-varying inputs (the `time_split_kwargs`) having one row per group. So the time-varying inputs are
+    flattened to (group * time, ...) and the other inputs are repeated for each timestep; then the nn is called once,
+    and the output is reshaped to (group, time). If the inputs can't be flattened (e.g. the nn also takes arguments
+    that aren't per-group), the nn is called separately for each timestep. This helper uses heuristics to infer which
+    inputs vary over time.
+
+    :param infer_time_split: If True, and `time_split_kwargs` aren't given, a single input with (group, time, ...)
+    leading dims is assumed to vary over time, skipping the call with the full input. Only for nns that are known to
+    take one row per group and timestep (e.g. in the `NN` process); otherwise an nn that takes each group's entire
+    sequence would get split inputs.
+    :return: A dictionary with a tensor for each output-name: (group, time) if the inputs varied over time, otherwise
+    (group,).
     """
+    if isinstance(time_split_kwargs, str):
+        raise ValueError(f"time_split_kwargs `{time_split_kwargs}` needs to be wrapped in a list.")
+
+    if not time_split_kwargs and infer_time_split:
+        time_split_kwargs = _infer_time_split_kwargs(nn_kwargs, num_groups=num_groups, num_timesteps=num_timesteps)
+        if time_split_kwargs:
+            nn._time_split_kwargs = time_split_kwargs
 
     if time_split_kwargs:
-        if isinstance(time_split_kwargs, str):
-            raise ValueError(f"time_split_kwargs `{time_split_kwargs}` needs to be wrapped in a list.")
-        nn_outputs = {el: [] for el in output_names}
-        for t in range(num_timesteps):
-            t_kwargs = nn_kwargs.copy()
-            for k in time_split_kwargs:
-                t_kwargs[k] = nn_kwargs[k][:, t]
-            t_output = nn(**t_kwargs)
-            if len(t_output.shape) > 2:
-                raise InputValidationError(
-                    f"`{nn}` expected to output 2D tensor, instead got {t_output.shape} with given input `{t_kwargs}`"
-                )
-            if len(t_output.shape) == 1:
-                t_output = t_output.unsqueeze(-1)
-            for i, el in enumerate(output_names):
-                if t_output.shape[1] == 1:
-                    nn_outputs[el].append(t_output[:, 0])
-                else:
-                    nn_outputs[el].append(t_output[:, i])
+        flat_kwargs = _flatten_time(nn_kwargs, time_split_kwargs, num_groups=num_groups, num_timesteps=num_timesteps)
+        if flat_kwargs is None:
+            nn_output = torch.stack(
+                [_validate_nn_output(nn, t_kwargs, num_groups) for t_kwargs in
+                 _kwargs_by_timestep(nn_kwargs, time_split_kwargs, num_timesteps)],
+                1
+            )
+        else:
+            nn_output = _validate_nn_output(nn, flat_kwargs, num_groups * num_timesteps)
+            nn_output = nn_output.reshape(num_groups, num_timesteps, -1)
     else:
         try:
-            nn_output = nn(**nn_kwargs)
-            if nn_output.shape[0] != num_groups:
-                raise InputValidationError(
-                    f"Expected {nn} to output a tensor with leading dim length of num_groups ({num_groups}). "
-                    f"Input:\n{nn_kwargs}"
-                )
-            if len(nn_output.shape) == 1:
-                nn_output = nn_output.unsqueeze(-1)
-            if len(nn_output.shape) > 2:
-                raise InputValidationError(
-                    f"Expected {nn} to output a 2D tensor. XXX\n"
-                    f"Input:\n{nn_kwargs}"
-                )
-            if nn_output.shape[1] == 1:
-                nn_outputs = {el: nn_output[:, 0] for el in output_names}
-            elif nn_output.shape[1] == len(output_names):
-                nn_outputs = {el: nn_output[:, i] for i, el in enumerate(output_names)}
-            else:
-                raise InputValidationError(
-                    f"Expected {nn} to output a tensor with shape[1] of 1 or {len(output_names)}."
-                    f"Input:\n{nn_kwargs}"
-                )
+            nn_output = _validate_nn_output(nn, nn_kwargs, num_groups)
         except InputValidationError as e:
             if len(nn_kwargs) == 1:
                 input = next(iter(nn_kwargs.values()))
@@ -85,4 +73,77 @@ def adjustments_from_nn(nn: torch.nn.Module,
                 f"Unable to get an acceptable output from {nn}. (TODO: explain)"
             ) from e
 
-    return nn_outputs
+    if nn_output.shape[-1] == 1:
+        return {el: nn_output[..., 0] for el in output_names}
+    elif nn_output.shape[-1] == len(output_names):
+        # `unbind` splits with a single op, so the backward-pass isn't slowed by selecting each output separately:
+        return dict(zip(output_names, nn_output.unbind(-1)))
+    else:
+        raise InputValidationError(
+            f"Expected {nn} to output a tensor with shape[1] of 1 or {len(output_names)}."
+            f"Input:\n{nn_kwargs}"
+        )
+
+
+def _validate_nn_output(nn: torch.nn.Module, nn_kwargs: dict, num_rows: int) -> torch.Tensor:
+    """
+    Call the nn, and standardize its output to a (num_rows, num_outputs) tensor.
+    """
+    nn_output = nn(**nn_kwargs)
+    if nn_output.shape[0] != num_rows:
+        raise InputValidationError(
+            f"Expected {nn} to output a tensor with leading dim length of {num_rows}. "
+            f"Input:\n{nn_kwargs}"
+        )
+    if len(nn_output.shape) == 1:
+        nn_output = nn_output.unsqueeze(-1)
+    if len(nn_output.shape) > 2:
+        raise InputValidationError(
+            f"Expected {nn} to output a 2D tensor, instead got {nn_output.shape}.\n"
+            f"Input:\n{nn_kwargs}"
+        )
+    return nn_output
+
+
+def _infer_time_split_kwargs(nn_kwargs: dict, num_groups: int, num_timesteps: int) -> List[str]:
+    """
+    If the nn takes a single input which has (group, time) leading dims and at least one more dim, then it's assumed to
+    be time-varying (see `infer_time_split`). Otherwise, time-varying inputs are inferred when the nn's output is
+    invalid, see above.
+    """
+    if len(nn_kwargs) != 1:
+        return []
+    k, input = next(iter(nn_kwargs.items()))
+    if len(getattr(input, 'shape', ())) >= 3 and tuple(input.shape[:2]) == (num_groups, num_timesteps):
+        return [k]
+    return []
+
+
+def _flatten_time(nn_kwargs: dict,
+                  time_split_kwargs: Sequence[str],
+                  num_groups: int,
+                  num_timesteps: int) -> Optional[dict]:
+    """
+    Flatten the time-varying inputs from (group, time, ...) to (group * time, ...), and repeat the other inputs for each
+    timestep. Returns None if any input isn't a tensor/array with a leading group dimension.
+    """
+    flat_kwargs = {}
+    for k, v in nn_kwargs.items():
+        if not isinstance(v, (torch.Tensor, np.ndarray)) or v.shape[0] != num_groups:
+            return None
+        if k in time_split_kwargs:
+            v = v[:, :num_timesteps]
+            flat_kwargs[k] = v.reshape((num_groups * num_timesteps,) + tuple(v.shape[2:]))
+        elif isinstance(v, torch.Tensor):
+            flat_kwargs[k] = v.repeat_interleave(num_timesteps, dim=0)
+        else:
+            flat_kwargs[k] = np.repeat(v, num_timesteps, axis=0)
+    return flat_kwargs
+
+
+def _kwargs_by_timestep(nn_kwargs: dict, time_split_kwargs: Sequence[str], num_timesteps: int) -> Iterator[dict]:
+    for t in range(num_timesteps):
+        t_kwargs = nn_kwargs.copy()
+        for k in time_split_kwargs:
+            t_kwargs[k] = nn_kwargs[k][:, t]
+        yield t_kwargs
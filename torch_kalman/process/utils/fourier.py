@@ -1,20 +1,32 @@
 from math import pi
 
+import numpy as np
 import torch
 from torch import Tensor
 
+from torch_kalman.internals.batch import BatchCache
+
+# fourier-terms are shared across processes (e.g. one fourier-season per measure) with the same period, K, and times:
+_fourier_cache = BatchCache(maxsize=8)
+
 
 def fourier_tensor(time: Tensor, seasonal_period: float, K: int) -> Tensor:
     """
-    Given an N-dimensional tensor, create an N+2 dimensional tensor with the 2nd to last dimension corresponding to the Ks
-    and the last dimension corresponding to sin/cosine.
+    Given an N-dimensional tensor, create an N+2 dimensional tensor with the 2nd to last dimension corresponding to the
+    Ks and the last dimension corresponding to sin/cosine.
+    """
+    k = torch.arange(1, K + 1, dtype=time.dtype, device=time.device)
+    val = 2. * pi * k * time.unsqueeze(-1) / seasonal_period
+    return torch.stack([torch.sin(val), torch.cos(val)], dim=-1)
+
+
+def cached_fourier_tensor(delta: np.ndarray, seasonal_period: float, K: int) -> Tensor:
+    """
+    `fourier_tensor()` for an array of integer times (e.g. from `DateTimeHelper.make_delta_grid()`), memoized on
+    `(seasonal_period, K, delta)`, so that identical bases are only built once. The output shouldn't be modified
+    in-place.
     """
-    out = torch.empty((*time.shape, K, 2))
-    base_index = tuple(slice(0, x) for x in time.shape)
-    for idx in range(K):
-        k = idx + 1
-        for sincos in range(2):
-            val = 2. * pi * k * time / seasonal_period
-            index = base_index + (idx, sincos)
-            out[index] = torch.sin(val) if sincos == 0 else torch.cos(val)
-    return out
+    return _fourier_cache.get(
+        key=_fourier_cache.make_key(seasonal_period, K, delta),
+        fun=lambda: fourier_tensor(time=Tensor(delta % seasonal_period), seasonal_period=seasonal_period, K=K)
+    )
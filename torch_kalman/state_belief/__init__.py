@@ -1,3 +1,5 @@
 from .base import StateBelief
 from .families.gaussian import Gaussian, GaussianOverTime
 from .families.censored_gaussian import CensoredGaussian, CensoredGaussianOverTime
+from .families.square_root import SquareRootGaussian, SquareRootGaussianOverTime
+from .families.sequential import SequentialGaussian
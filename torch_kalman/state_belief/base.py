@@ -1,5 +1,5 @@
 from collections import defaultdict
-from typing import Tuple, Sequence, Optional
+from typing import Tuple, Sequence, Optional, Union, TYPE_CHECKING
 
 import torch
 
@@ -8,9 +8,13 @@ from torch import Tensor
 from tqdm import tqdm
 
 from torch_kalman.design import Design
+from torch_kalman.internals.block_diag import Blocks, transition_means, transition_covs
 from torch_kalman.internals.utils import identity
 from torch_kalman.internals.repr import NiceRepr
 
+if TYPE_CHECKING:
+    from torch_kalman.state_belief.over_time import StateBeliefBuffer
+
 
 class StateBelief(NiceRepr):
     """
@@ -18,15 +22,35 @@ class StateBelief(NiceRepr):
     """
     _repr_attrs = ('means', 'covs', 'last_measured')
 
+    # attributes that are stacked over time in `concatenate_over_time()`, and the corresponding attributes of the
+    # StateBeliefOverTime:
+    stacked_attrs = (('means', 'means'), ('covs', 'covs'))
+
+    # can the kalman-gain be held fixed once the covariance has converged? (requires an update that doesn't depend on
+    # the observations except through the mean)
+    supports_steady_state = False
+
+    # can filtering be expressed as an associative scan over time? (requires a linear-gaussian update)
+    supports_parallel_scan = False
+
+    # is there a fused update+predict (see `update_predict()`) for timesteps without missing values?
+    supports_fused_step = False
+
+    # can the log-likelihood be computed with the (linear-gaussian) adjoint backward-pass in `KalmanFilter.loglik()`?
+    supports_adjoint = False
+
     def __init__(self,
                  means: Tensor,
                  covs: Tensor,
-                 last_measured: Optional[Tensor] = None):
+                 last_measured: Optional[Tensor] = None,
+                 validate: bool = True):
         """
         :param means: The means (2D tensor)
         :param covs: The covariances (3D tensor).
         :param last_measured: 1D tensor indicating number of timesteps since mean/cov were updated with measurements;
         defaults to 0s.
+        :param validate: Check the inputs for shape-mismatches, nans, and infs? Can be set to False internally when the
+        inputs are known to be valid, to avoid the overhead.
         """
         num_groups, state_size = means.shape
         self.num_groups = num_groups
@@ -34,13 +58,15 @@ class StateBelief(NiceRepr):
         self.covs = covs
         self._H = None
         self._R = None
+        self._system_chol_cache = None
 
         if last_measured is None:
             self.last_measured = torch.zeros(self.num_groups, dtype=torch.int)
         else:
             self.last_measured = last_measured
 
-        self._validate()
+        if validate:
+            self._validate()
 
     def copy(self) -> 'StateBelief':
         sb = type(self)(means=self.means.clone(), covs=self.covs.clone(), last_measured=self.last_measured.clone())
@@ -58,8 +84,27 @@ class StateBelief(NiceRepr):
 
         self._H = H
         self._R = R
+        self._system_chol_cache = None
         return self
 
+    def cache_system_chol(self, system_chol: Tensor, is_valid: Tensor):
+        """
+        Families whose update decomposes the system-covariance can save the result here, so that it can be re-used
+        (e.g. by `StateBeliefOverTime.log_prob()`) instead of decomposing it again.
+
+        :param system_chol: The lower cholesky-factor of the system-covariance, after masking the missing measures (see
+        `mask_missing()`).
+        :param is_valid: A boolean tensor indicating which measures were not missing.
+        """
+        self._system_chol_cache = (system_chol, is_valid)
+
+    @property
+    def system_chol_cache(self) -> Optional[Tuple[Tensor, Tensor]]:
+        """
+        :return: The tensors passed to `cache_system_chol()`, or None if it wasn't called.
+        """
+        return self._system_chol_cache
+
     @property
     def H(self) -> Tensor:
         if self._H is None:
@@ -72,12 +117,47 @@ class StateBelief(NiceRepr):
             raise UnmeasuredError("Must call `compute_measurement` first.")
         return self._R
 
-    def predict(self, F: Tensor, Q: Tensor) -> 'StateBelief':
-        Ft = F.permute(0, 2, 1)
-        means = F.matmul(self.means.unsqueeze(2)).squeeze(2)
-        covs = F.matmul(self.covs).matmul(Ft) + Q
+    def predict(self,
+                F: Tensor,
+                Q: Tensor,
+                covs: Optional[Tensor] = None,
+                F_blocks: Optional[Blocks] = None) -> 'StateBelief':
+        """
+        :param F: The transition matrix.
+        :param Q: The process-covariance.
+        :param covs: Optional. If the predicted covariance is already known (e.g. it has converged to its
+        steady-state), it can be passed to skip computing it.
+        :param F_blocks: Optional. The block-diagonal structure of F (see `Design.F_blocks`), so that products with F
+        can be computed one block at a time.
+        :return: A StateBelief for the next timestep.
+        """
+        means = transition_means(F, self.means, F_blocks)
+        if covs is None:
+            covs = transition_covs(F, self.covs, F_blocks) + Q
         return type(self)(means=means, covs=covs, last_measured=self.last_measured + 1)
 
+    def update_predict(self, obs: Tensor, F: Tensor, Q: Tensor, F_blocks: Optional[Blocks] = None) -> 'StateBelief':
+        """
+        Equivalent to `self.update(obs).predict(F, Q)`, for families with `supports_fused_step`.
+
+        :param obs: The observations, with no missing values.
+        :param F: The transition matrix.
+        :param Q: The process-covariance.
+        :param F_blocks: Optional. The block-diagonal structure of F, see `predict()`.
+        :return: A StateBelief for the next timestep.
+        """
+        raise NotImplementedError
+
+    def log_prob(self, obs: Tensor, *args, system_chol: Optional[Tuple[Tensor, Tensor]] = None) -> Tensor:
+        """
+        The log-probability of the observations at this timestep, for each group; used by `KalmanFilter.loglik()`.
+
+        :param obs: The observations, with dims (group, measure).
+        :param args: Other arguments (e.g. censoring limits) for this timestep.
+        :param system_chol: Optional. The `system_chol_cache` from the update with these observations.
+        """
+        raise NotImplementedError
+
     def update(self, obs: Tensor, **kwargs) -> 'StateBelief':
         if 'time' in kwargs:
             time = kwargs.pop('time')
@@ -139,7 +219,9 @@ class StateBelief(NiceRepr):
         raise NotImplementedError
 
     @classmethod
-    def concatenate_over_time(cls, state_beliefs: Sequence['StateBelief'], design: Design) -> 'StateBeliefOverTime':
+    def concatenate_over_time(cls,
+                              state_beliefs: Union[Sequence['StateBelief'], 'StateBeliefBuffer'],
+                              design: Design) -> 'StateBeliefOverTime':
         raise NotImplementedError
 
     def simulate_trajectories(self,
@@ -159,7 +241,9 @@ class StateBelief(NiceRepr):
         for t in times:
             if t > 0:
                 # move sim forward one step:
-                state = state.predict(F=design_for_batch.F(t - 1), Q=design_for_batch.Q(t - 1))
+                state = state.predict(
+                    F=design_for_batch.F(t - 1), Q=design_for_batch.Q(t - 1), F_blocks=design_for_batch.F_blocks
+                )
 
             # realize the state:
             state._realize(ntry=ntry_diag_incr, eps=eps[:, t, :] if eps is not None else None)
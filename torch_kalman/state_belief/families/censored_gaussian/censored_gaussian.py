@@ -7,12 +7,19 @@ from torch_kalman.design import Design
 from torch_kalman.state_belief import StateBelief
 from torch_kalman.state_belief.families.censored_gaussian.utils import tobit_adjustment, tobit_probs, std_normal
 from torch_kalman.state_belief.families.gaussian import Gaussian, GaussianOverTime
+from torch_kalman.state_belief.over_time import StateBeliefBuffer
 from torch_kalman.state_belief.utils import bmat_idx
 
 Selector = Union[Sequence[int], slice]
 
 
 class CensoredGaussian(Gaussian):
+    # the censoring-adjustment depends on the measured mean, so the gain never stops changing:
+    supports_steady_state = False
+    # ...and the update is not linear in the observations:
+    supports_parallel_scan = False
+    supports_fused_step = False
+    supports_adjoint = False
 
     def update(self,
                obs: Tensor,
@@ -30,7 +37,9 @@ class CensoredGaussian(Gaussian):
                 **kwargs
             )
 
-        return super().update(obs, lower=lower, upper=upper)
+        # the censoring-adjustment isn't neutralized by masking missing measures, so use the base-class update, which
+        # updates each pattern of missing measures separately:
+        return StateBelief.update(self, obs, lower=lower, upper=upper)
 
     def _update_group(self,
                       obs: Tensor,
@@ -121,9 +130,23 @@ class CensoredGaussian(Gaussian):
 
     @classmethod
     def concatenate_over_time(cls,
-                              state_beliefs: Sequence['CensoredGaussian'],
+                              state_beliefs: Union[Sequence['CensoredGaussian'], StateBeliefBuffer],
                               design: Design) -> 'CensoredGaussianOverTime':
-        return CensoredGaussianOverTime(state_beliefs=state_beliefs, design=design)
+        buffer = StateBeliefBuffer.from_state_beliefs(state_beliefs)
+        return CensoredGaussianOverTime(**buffer.tensors(), design=design, family=cls)
+
+    def log_prob(self,
+                 obs: Tensor,
+                 lower: Optional[Tensor] = None,
+                 upper: Optional[Tensor] = None,
+                 system_chol: Optional[Tuple[Tensor, Tensor]] = None) -> Tensor:
+        """
+        The log-probability of the observations at this timestep (see `CensoredGaussianOverTime.log_prob()`).
+        `system_chol` is accepted for compatibility with `Gaussian.log_prob()`, but isn't needed.
+        """
+        pred_mean = self.H.matmul(self.means.unsqueeze(-1)).squeeze(-1)
+        std = torch.diagonal(self.system_uncertainty(covs=self.covs, H=self.H, R=self.R), dim1=-2, dim2=-1).sqrt()
+        return censored_log_prob(obs=obs, pred_mean=pred_mean, std=std, lower=lower, upper=upper)
 
     def sample_transition(self,
                           lower: Optional[Tensor] = None,
@@ -135,68 +158,29 @@ class CensoredGaussian(Gaussian):
 
 
 class CensoredGaussianOverTime(GaussianOverTime):
-    def __init__(self,
-                 state_beliefs: Sequence['CensoredGaussian'],
-                 design: Design):
-        super().__init__(state_beliefs=state_beliefs, design=design)
-
     def log_prob(self,
                  obs: Tensor,
                  lower: Optional[Tensor] = None,
-                 upper: Optional[Tensor] = None):
-        return super().log_prob(obs=obs, lower=lower, upper=upper)
-
-    def _log_prob_with_subsetting(self,
-                                  obs: Tensor,
-                                  group_idx: Selector,
-                                  time_idx: Selector,
-                                  measure_idx: Selector,
-                                  method: str = 'independent',
-                                  lower: Optional[Tensor] = None,
-                                  upper: Optional[Tensor] = None) -> Tensor:
-        self._check_lp_sub_input(group_idx, time_idx)
-
-        idx_3d = bmat_idx(group_idx, time_idx, measure_idx)
-        idx_4d = bmat_idx(group_idx, time_idx, measure_idx, measure_idx)
-
-        # subset obs, lower, upper:
-        if upper is None:
-            upper = torch.full_like(obs, float('inf'))
-        if lower is None:
-            lower = torch.full_like(obs, -float('inf'))
-        obs, lower, upper = obs[idx_3d], lower[idx_3d], upper[idx_3d]
-
-        #
-        pred_mean = self.predictions[idx_3d]
-        pred_cov = self.prediction_uncertainty[idx_4d]
-
-        #
-        cens_up = torch.isclose(obs, upper)
-        cens_lo = torch.isclose(obs, lower)
-
-        #
-        loglik_uncens = torch.zeros_like(obs)
-        loglik_cens_up = torch.zeros_like(obs)
-        loglik_cens_lo = torch.zeros_like(obs)
-        for m in range(pred_mean.shape[-1]):
-            std = pred_cov[..., m, m].sqrt()
-            z = (pred_mean[..., m] - obs[..., m]) / std
-
-            # pdf is well behaved at tails:
-            loglik_uncens[..., m] = std_normal.log_prob(z) - std.log()
-
-            # but cdf is not, clamp:
-            z = torch.clamp(z, -5., 5.)
-            loglik_cens_up[..., m] = std_normal.cdf(z).log()
-            loglik_cens_lo[..., m] = (1. - std_normal.cdf(z)).log()
-
-        loglik = torch.zeros_like(obs)
-        loglik[cens_up] = loglik_cens_up[cens_up]
-        loglik[cens_lo] = loglik_cens_lo[cens_lo]
-        loglik[~(cens_up | cens_lo)] = loglik_uncens[~(cens_up | cens_lo)]
-
-        # take the product of the dimension probs (i.e., assume independence)
-        return torch.sum(loglik, -1)
+                 upper: Optional[Tensor] = None) -> Tensor:
+        """
+        Compute the log-probability of data, assuming independence across measures. All groups and timesteps are
+        evaluated at once, with missing measures masked out.
+
+        :param obs: A Tensor that could be used in the KalmanFilter.forward pass.
+        :param lower: The lower censoring limits, same shape as `obs`.
+        :param upper: The upper censoring limits, same shape as `obs`.
+        :return: A tensor with one element for each group X timestep indicating the log-probability.
+        """
+        num_groups, num_times, num_dist_dims = obs.shape
+        assert self.predictions.shape[2] == num_dist_dims
+
+        pred_mean = self.predictions[:, :num_times]
+        std = torch.diagonal(self.prediction_uncertainty[:, :num_times], dim1=-2, dim2=-1).sqrt()
+        return censored_log_prob(obs=obs, pred_mean=pred_mean, std=std, lower=lower, upper=upper)
+
+    def smooth(self, *args, **kwargs):
+        # the censored update is not linear in the observations:
+        raise NotImplementedError(f"Smoothing is not supported for {type(self).__name__}.")
 
     def sample_measurements(self,
                             lower: Optional[Tensor] = None,
@@ -205,3 +189,43 @@ class CensoredGaussianOverTime(GaussianOverTime):
         if lower is None and upper is None:
             return super().sample_measurements(eps=eps)
         raise NotImplementedError
+
+
+def censored_log_prob(obs: Tensor,
+                      pred_mean: Tensor,
+                      std: Tensor,
+                      lower: Optional[Tensor] = None,
+                      upper: Optional[Tensor] = None) -> Tensor:
+    """
+    :param obs: The observations, with the measure-dimension last; missing values are masked out.
+    :param pred_mean: The predictions on the measurement-scale, same shape as `obs`.
+    :param std: The standard-deviations of the predictions, same shape as `obs`.
+    :param lower: The lower censoring limits, same shape as `obs`.
+    :param upper: The upper censoring limits, same shape as `obs`.
+    :return: The log-prob, assuming independence across measures, with the measure-dimension summed out.
+    """
+    if upper is None:
+        upper = torch.full_like(obs, float('inf'))
+    if lower is None:
+        lower = torch.full_like(obs, -float('inf'))
+
+    # zero-fill missing values (instead of letting nans into the graph), they are masked out below:
+    is_valid = ~torch.isnan(obs)
+    obs = torch.where(is_valid, obs, torch.zeros_like(obs))
+
+    z = (pred_mean - obs) / std
+
+    # pdf is well behaved at tails:
+    loglik_uncens = std_normal.log_prob(z) - std.log()
+
+    # but cdf is not, clamp:
+    z = torch.clamp(z, -5., 5.)
+    loglik_cens_up = std_normal.cdf(z).log()
+    loglik_cens_lo = (1. - std_normal.cdf(z)).log()
+
+    cens_up = torch.isclose(obs, upper) & is_valid
+    cens_lo = torch.isclose(obs, lower) & is_valid
+    loglik = torch.where(cens_up, loglik_cens_up, torch.where(cens_lo, loglik_cens_lo, loglik_uncens))
+
+    # take the product of the dimension probs (i.e., assume independence)
+    return torch.where(is_valid, loglik, torch.zeros_like(loglik)).sum(-1)
@@ -1,45 +1,118 @@
+from math import log, pi, nan
 from typing import Sequence, Optional, Union, Tuple
 
 import torch
 
 from torch import Tensor
 from torch.distributions import MultivariateNormal
+from tqdm import tqdm
 
 from torch_kalman.design import Design
+from torch_kalman.internals.block_diag import Blocks
+from torch_kalman.internals.fused_step import gaussian_update_predict
+from torch_kalman.internals.utils import identity
 from torch_kalman.state_belief import StateBelief
 
-from torch_kalman.state_belief.over_time import StateBeliefOverTime, Selector
+from torch_kalman.state_belief.over_time import StateBeliefOverTime, StateBeliefBuffer, Selector
 
-from torch_kalman.state_belief.utils import bmat_idx, deterministic_sample_mvnorm
+from torch_kalman.state_belief.utils import deterministic_sample_mvnorm, mask_missing
 
 
 class Gaussian(StateBelief):
     """
     Underlying states in most kalman-filters are assumed to be gaussian; this is implemented by this class.
     """
+    supports_steady_state = True
+    supports_parallel_scan = True
+    supports_fused_step = True
+    supports_adjoint = True
 
-    def __init__(self, means: Tensor, covs: Tensor, last_measured: Optional[Tensor] = None):
+    def __init__(self,
+                 means: Tensor,
+                 covs: Tensor,
+                 last_measured: Optional[Tensor] = None,
+                 validate: bool = True):
         self._measured_means = None
         self._system_uncertainty = None
-        super().__init__(means=means, covs=covs, last_measured=last_measured)
-
-    def _update_group(self,
-                      obs: Tensor,
-                      group_idx: Union[slice, Sequence[int]],
-                      which_valid: Union[slice, Sequence[int]]) -> Tuple[Tensor, Tensor]:
-        idx_2d = bmat_idx(group_idx, which_valid)
-        idx_3d = bmat_idx(group_idx, which_valid, which_valid)
-        group_obs = obs[idx_2d]
-        group_means = self.means[group_idx]
-        group_covs = self.covs[group_idx]
-        group_H = self.H[idx_2d]
-        group_R = self.R[idx_3d]
-        group_measured_means = group_H.matmul(group_means.unsqueeze(2)).squeeze(2)
-        group_system_covs = self.system_uncertainty(covs=group_covs, H=group_H, R=group_R)
-        group_K = self.kalman_gain(system_covariance=group_system_covs, covariance=group_covs, H=group_H)
-        means_new = self.mean_update(mean=group_means, K=group_K, residuals=group_obs - group_measured_means)
-        covs_new = self.covariance_update(covariance=group_covs, K=group_K, H=group_H, R=group_R)
-        return means_new, covs_new
+        super().__init__(means=means, covs=covs, last_measured=last_measured, validate=validate)
+
+    def update_predict(self, obs: Tensor, F: Tensor, Q: Tensor, F_blocks: Optional[Blocks] = None) -> 'Gaussian':
+        if F_blocks is None:
+            F_blocks = [(0, F.shape[-1], 'dense')]
+        means, covs, system_chol = gaussian_update_predict(self.means, self.covs, obs, self.H, self.R, F, Q, F_blocks)
+        self.cache_system_chol(system_chol, is_valid=torch.ones_like(obs, dtype=torch.bool))
+        # measured, then predicted one step ahead:
+        return type(self)(means=means, covs=covs, last_measured=torch.ones_like(self.last_measured), validate=False)
+
+    def update(self, obs: Tensor, **kwargs) -> 'Gaussian':
+        if 'time' in kwargs:
+            time = kwargs.pop('time')
+            if time >= obs.shape[1]:
+                return self.copy()
+            return self.update(obs=obs[:, time], **kwargs)
+
+        if torch.isinf(obs).any():
+            raise RuntimeError("Infs not allowed in `obs`")
+
+        # instead of a separate update for each pattern of missing measures, missing measures are masked out so that
+        # all groups are updated at once (groups where all measures are missing get K=0, i.e. no update):
+        obs_masked, H, R, is_valid = mask_missing(obs, self.H, self.R)
+        measured_means = H.matmul(self.means.unsqueeze(2)).squeeze(2)
+        system_chol = torch.cholesky(self.system_uncertainty(covs=self.covs, H=H, R=R))
+        # (this is also what's needed to evaluate the log-prob, so save it)
+        self.cache_system_chol(system_chol, is_valid=is_valid)
+        covs_measured = self.covs.matmul(H.permute(0, 2, 1))
+        K = torch.cholesky_solve(covs_measured.permute(0, 2, 1), system_chol).permute(0, 2, 1)
+        means = self.mean_update(mean=self.means, K=K, residuals=obs_masked - measured_means)
+        covs = self.covariance_update(covariance=self.covs, K=K, H=H, R=R)
+        return type(self)(means=means, covs=covs, last_measured=self._update_last_measured(obs), validate=False)
+
+    @classmethod
+    def steady_state_gain(cls, covs: Tensor, H: Tensor, R: Tensor) -> Tuple[Tensor, Tensor, Tensor]:
+        """
+        Given a one-step-ahead covariance, compute the kalman-gain and the updated covariance without reference to the
+        observations. These can be re-used with `update_with_gain()`: e.g. once the covariance has converged in a
+        time-invariant design, or for groups that share the same covariance. For missing measures, `H` and `R` should
+        be masked first (see `mask_missing()`).
+
+        :return: The kalman-gain, the updated covariance, and the cholesky-factor of the system-covariance.
+        """
+        system_chol = torch.cholesky(cls.system_uncertainty(covs=covs, H=H, R=R))
+        covs_measured = covs.matmul(H.permute(0, 2, 1))
+        K = torch.cholesky_solve(covs_measured.permute(0, 2, 1), system_chol).permute(0, 2, 1)
+        return K, cls.covariance_update(covariance=covs, K=K, H=H, R=R), system_chol
+
+    def update_with_gain(self, obs: Tensor, K: Tensor, covs: Tensor, system_chol: Tensor) -> 'Gaussian':
+        """
+        Update the means using a pre-computed kalman-gain and updated covariance (see `steady_state_gain()`). The gain
+        must have been computed with the same pattern of missing measures as `obs`; `system_chol` is saved with
+        `cache_system_chol()`, as in `update()`.
+        """
+        obs_masked, H, _, is_valid = mask_missing(obs, self.H, self.R)
+        self.cache_system_chol(system_chol, is_valid=is_valid)
+        measured_means = H.matmul(self.means.unsqueeze(2)).squeeze(2)
+        means = self.mean_update(mean=self.means, K=K, residuals=obs_masked - measured_means)
+        return type(self)(means=means, covs=covs, last_measured=self._update_last_measured(obs), validate=False)
+
+    def log_prob(self, obs: Tensor, system_chol: Optional[Tuple[Tensor, Tensor]] = None) -> Tensor:
+        """
+        The log-probability of the observations at this timestep (see `GaussianOverTime.log_prob()`).
+
+        :param obs: A (group, measure) tensor.
+        :param system_chol: Optional. The `system_chol_cache` from the update with these observations, so that the
+        system-covariance doesn't need to be decomposed again.
+        :return: A tensor with one element for each group.
+        """
+        obs, H, R, is_valid = mask_missing(obs, self.H, self.R)
+        resid = obs - H.matmul(self.means.unsqueeze(-1)).squeeze(-1)
+        if system_chol is None:
+            chol = self._compute_system_chol(H=H, R=R)
+        else:
+            chol, _ = system_chol
+        return mvnorm_log_prob(resid=resid, system_chol=chol, is_valid=is_valid)
+
+    def _compute_system_chol(self, H: Tensor, R: Tensor) -> Tensor:
+        return torch.cholesky(self.system_uncertainty(covs=self.covs, H=H, R=R))
 
     @staticmethod
     def system_uncertainty(covs: Tensor, H: Tensor, R: Tensor):
@@ -71,8 +144,11 @@ class Gaussian(StateBelief):
         return K
 
     @classmethod
-    def concatenate_over_time(cls, state_beliefs: Sequence['Gaussian'], design: Design) -> 'GaussianOverTime':
-        return GaussianOverTime(state_beliefs=state_beliefs, design=design)
+    def concatenate_over_time(cls,
+                              state_beliefs: Union[Sequence['Gaussian'], StateBeliefBuffer],
+                              design: Design) -> 'GaussianOverTime':
+        buffer = StateBeliefBuffer.from_state_beliefs(state_beliefs)
+        return GaussianOverTime(**buffer.tensors(), design=design, family=cls)
 
     def sample_transition(self, eps: Optional[Tensor] = None) -> Tensor:
         distribution = MultivariateNormal(loc=self.means, covariance_matrix=self.covs)
@@ -80,22 +156,122 @@ class Gaussian(StateBelief):
 
 
 class GaussianOverTime(StateBeliefOverTime):
-    def __init__(self, state_beliefs: Sequence['StateBelief'], design: Design):
-        super().__init__(state_beliefs=state_beliefs, design=design)
-
     def sample_measurements(self, eps: Optional[Tensor] = None) -> Tensor:
-        distribution = MultivariateNormal(self.predictions, self.prediction_uncertainty)
+        system_chol = self._masked_system_chol(
+            H=self.H, R=self.R, is_valid=torch.ones_like(self.predictions, dtype=torch.bool)
+        )
+        distribution = MultivariateNormal(self.predictions, scale_tril=system_chol, validate_args=False)
         return deterministic_sample_mvnorm(distribution, eps=eps)
 
-    def _log_prob_with_subsetting(self,
-                                  obs: Tensor,
-                                  group_idx: Selector,
-                                  time_idx: Selector,
-                                  measure_idx: Selector,
-                                  **kwargs) -> Tensor:
-        self._check_lp_sub_input(group_idx, time_idx)
-
-        idx_3d = bmat_idx(group_idx, time_idx, measure_idx)
-        idx_4d = bmat_idx(group_idx, time_idx, measure_idx, measure_idx)
-        dist = MultivariateNormal(self.predictions[idx_3d], self.prediction_uncertainty[idx_4d])
-        return dist.log_prob(obs[idx_3d])
+    def log_prob(self, obs: Tensor, **kwargs) -> Tensor:
+        """
+        Compute the log-probability of data (e.g. data that was originally fed into the KalmanFilter). All groups and
+        timesteps are evaluated at once: missing measures are masked out (see `mask_missing`), which marginalizes them
+        out of the multivariate-normal.
+
+        :param obs: A Tensor that could be used in the KalmanFilter.forward pass.
+        :return: A tensor with one element for each group X timestep indicating the log-probability.
+        """
+        num_groups, num_times, num_dist_dims = obs.shape
+        assert self.predictions.shape[2] == num_dist_dims
+
+        obs, H, R, is_valid = mask_missing(obs, self.H[:, :num_times], self.R[:, :num_times])
+        resid = obs - H.matmul(self.means[:, :num_times].unsqueeze(-1)).squeeze(-1)
+        system_chol = self._masked_system_chol(H=H, R=R, is_valid=is_valid)
+        return mvnorm_log_prob(resid=resid, system_chol=system_chol, is_valid=is_valid)
+
+    def smooth(self,
+               obs: Tensor,
+               F: Tensor,
+               means_only: bool = False,
+               progress: Union[tqdm, bool] = False) -> Tuple[Tensor, Optional[Tensor]]:
+        # uses the "modified bryson-frazier" form of the smoother, which only needs the predicted moments (not the
+        # filtered ones) and the system-covariances, whose cholesky-factors are re-used from the forward-pass.
+        progress = progress or identity
+        if progress is True:
+            progress = tqdm
+
+        num_groups, num_times, num_measures = obs.shape
+        if num_times < self.num_timesteps:
+            # timesteps past the end of the observations are forecasts, i.e. all missing:
+            obs = torch.cat([obs, obs.new_full((num_groups, self.num_timesteps - num_times, num_measures), nan)], 1)
+        else:
+            obs = obs[:, :self.num_timesteps]
+        obs, H, R, is_valid = mask_missing(obs, self.H, self.R)
+        system_chol = self._masked_system_chol(H=H, R=R, is_valid=is_valid)
+        Ht = H.transpose(-1, -2)
+
+        # terms that don't depend on the backwards-recursion are computed for all timesteps at once:
+        resid = obs - H.matmul(self.means.unsqueeze(-1)).squeeze(-1)
+        Ht_Sinv_resid = Ht.matmul(torch.cholesky_solve(resid.unsqueeze(-1), system_chol)).squeeze(-1)
+        Kt = torch.cholesky_solve(H.matmul(self.covs), system_chol)
+        Ht_Sinv_H = None if means_only else Ht.matmul(torch.cholesky_solve(H, system_chol))
+        I = torch.eye(self.means.shape[-1], dtype=self.means.dtype, device=self.means.device)
+
+        # backwards-recursion for the adjoint-variables:
+        lambdas = [None] * self.num_timesteps
+        Lambdas = [None] * self.num_timesteps
+        lam = torch.zeros_like(self.means[:, 0])
+        Lam = None if means_only else torch.zeros_like(self.covs[:, 0])
+        for t in progress(reversed(range(self.num_timesteps))):
+            if t < self.num_timesteps - 1:
+                # F/Q at t is transition *from* t *to* t+1
+                Ft = F[:, t].transpose(-1, -2)
+                lam = Ft.matmul(lambdas[t + 1].unsqueeze(-1)).squeeze(-1)
+                if not means_only:
+                    Lam = Ft.matmul(Lambdas[t + 1]).matmul(F[:, t])
+            # (I - K @ H).T @ lam - H.T @ S^-1 @ resid:
+            lambdas[t] = lam - Ht[:, t].matmul(Kt[:, t].matmul(lam.unsqueeze(-1))).squeeze(-1) - Ht_Sinv_resid[:, t]
+            if not means_only:
+                I_KH = I - Kt[:, t].transpose(-1, -2).matmul(H[:, t])
+                Lambdas[t] = Ht_Sinv_H[:, t] + I_KH.transpose(-1, -2).matmul(Lam).matmul(I_KH)
+
+        means = self.means - self.covs.matmul(torch.stack(lambdas, 1).unsqueeze(-1)).squeeze(-1)
+        if means_only:
+            return means, None
+        covs = self.covs - self.covs.matmul(torch.stack(Lambdas, 1)).matmul(self.covs)
+        return means, covs
+
+    def _masked_system_chol(self, H: Tensor, R: Tensor, is_valid: Tensor) -> Tensor:
+        """
+        :param H: The measurement-matrices for the first `is_valid.shape[1]` timesteps, masked with `mask_missing()`.
+        :param R: The measure-covariances for the first `is_valid.shape[1]` timesteps, masked with `mask_missing()`.
+        :param is_valid: A boolean tensor with dims (group, time, measure) indicating which measures are not missing.
+        :return: The cholesky-factor of the (masked) system-covariance. Where the pattern of missing measures matches
+        the one used in the forward-pass, the cholesky-factor that was computed then is re-used.
+        """
+        num_times = is_valid.shape[1]
+        if self.system_chol_cache is None:
+            return self._compute_system_chol(H=H, R=R, idx=(slice(None), slice(num_times)))
+
+        cached_chol, cached_valid = self.system_chol_cache
+        system_chol = cached_chol[:, :num_times]
+        recompute = (cached_valid[:, :num_times] != is_valid).any(-1)
+        if not recompute.any():
+            return system_chol
+        idx = recompute.nonzero(as_tuple=True)
+        system_chol = system_chol.clone()
+        system_chol[idx] = self._compute_system_chol(H=H[idx], R=R[idx], idx=idx)
+        return system_chol
+
+    def _compute_system_chol(self, H: Tensor, R: Tensor, idx: Tuple[Selector, Selector]) -> Tensor:
+        """
+        :param H: The (possibly masked) measurement-matrices.
+        :param R: The (possibly masked) measure-covariances.
+        :param idx: The (group, time) indices that `H` and `R` correspond to.
+        :return: The cholesky-factor of the system-covariance `H @ covs @ H.T + R`.
+        """
+        return torch.cholesky(H.matmul(self.covs[idx]).matmul(H.transpose(-1, -2)) + R)
+
+
+def mvnorm_log_prob(resid: Tensor, system_chol: Tensor, is_valid: Tensor) -> Tensor:
+    """
+    :param resid: The residuals (observations minus predictions), masked with `mask_missing()`.
+    :param system_chol: The cholesky-factor of the (masked) system-covariance.
+    :param is_valid: A boolean tensor indicating which measures were not missing.
+    :return: The multivariate-normal log-prob, with the measure-dimension summed out.
+    """
+    resid_std, _ = torch.triangular_solve(resid.unsqueeze(-1), system_chol, upper=False)
+    half_log_det = torch.log(torch.diagonal(system_chol, dim1=-2, dim2=-1)).sum(-1)
+    # masked measures contribute nothing to the mahalanobis-distance or the determinant, only the constant:
+    return -.5 * (resid_std.squeeze(-1) ** 2).sum(-1) - half_log_det - .5 * log(2 * pi) * is_valid.sum(-1)
@@ -0,0 +1,54 @@
+import torch
+from torch import Tensor
+
+from torch_kalman.state_belief.families.gaussian import Gaussian
+from torch_kalman.state_belief.utils import mask_missing
+
+
+class SequentialGaussian(Gaussian):
+    """
+    A `Gaussian` whose update processes the measures one at a time, so that each update is a rank-1 scalar update
+    with no matrix inversion. The cost of the update is linear in the number of measures, which is helpful for models
+    with many measures. If the measure-covariance is not diagonal, the measurements are first decorrelated using its
+    cholesky-factor.
+    """
+    # the fused step, the steady-state/shared gain, the parallel scan, and the adjoint log-likelihood would all do a
+    # full multivariate update (inverting the system-covariance), which is what this family avoids:
+    supports_steady_state = False
+    supports_parallel_scan = False
+    supports_fused_step = False
+    supports_adjoint = False
+
+    def update(self, obs: Tensor, **kwargs) -> 'SequentialGaussian':
+        if 'time' in kwargs:
+            time = kwargs.pop('time')
+            if time >= obs.shape[1]:
+                return self.copy()
+            return self.update(obs=obs[:, time], **kwargs)
+
+        if torch.isinf(obs).any():
+            raise RuntimeError("Infs not allowed in `obs`")
+
+        # missing measures are masked so that their updates are no-ops (zero H-row, zero residual):
+        obs_masked, H, R, _ = mask_missing(obs, self.H, self.R)
+        R_diag = torch.diagonal(R, dim1=-2, dim2=-1)
+        if (R != torch.diag_embed(R_diag)).any():
+            # decorrelate: with R = C @ C.T, the measurements C^-1 @ obs have identity measure-covariance
+            C = torch.cholesky(R)
+            obs_masked = torch.triangular_solve(obs_masked.unsqueeze(-1), C, upper=False)[0].squeeze(-1)
+            H = torch.triangular_solve(H, C, upper=False)[0]
+            R_diag = torch.ones_like(R_diag)
+
+        means = self.means
+        covs = self.covs
+        for i in range(H.shape[1]):
+            h = H[:, i]
+            covs_h = covs.matmul(h.unsqueeze(-1)).squeeze(-1)
+            system_var = (h * covs_h).sum(-1) + R_diag[:, i]
+            K = covs_h / system_var.unsqueeze(-1)
+            resid = obs_masked[:, i] - (h * means).sum(-1)
+            means = means + K * resid.unsqueeze(-1)
+            covs = covs - K.unsqueeze(-1) * covs_h.unsqueeze(-2)
+            covs = .5 * (covs + covs.transpose(-1, -2))
+
+        return type(self)(means=means, covs=covs, last_measured=self._update_last_measured(obs), validate=False)
@@ -0,0 +1,206 @@
+from typing import Optional, Sequence, Union, Type, Tuple
+
+import torch
+from torch import Tensor
+from torch.distributions import MultivariateNormal
+
+from torch_kalman.design import Design
+from torch_kalman.internals.block_diag import Blocks, block_matmul, transition_means
+from torch_kalman.state_belief.families.gaussian import Gaussian, GaussianOverTime
+from torch_kalman.state_belief.over_time import StateBeliefBuffer, Selector
+from torch_kalman.state_belief.utils import deterministic_sample_mvnorm, mask_missing
+
+
+class SquareRootGaussian(Gaussian):
+    """
+    A `Gaussian` that propagates the (lower) cholesky-factor of the covariance instead of the covariance itself: the
+    predict-step is a QR-decomposition of `[F @ L, Q^.5]`, and the update is a QR-decomposition of the pre-array
+    `[[R^.5, H @ L], [0, L]]`. The covariance is positive semi-definite by construction, which makes the filter
+    numerically stable in float32 without jitter.
+    """
+    supports_steady_state = False
+    supports_parallel_scan = False
+    supports_fused_step = False
+    supports_adjoint = False
+    stacked_attrs = (('means', 'means'), ('cov_chol', 'cov_chols'))
+
+    def __init__(self,
+                 means: Tensor,
+                 covs: Optional[Tensor] = None,
+                 last_measured: Optional[Tensor] = None,
+                 validate: bool = True,
+                 cov_chol: Optional[Tensor] = None):
+        """
+        :param means: The means (2D tensor)
+        :param covs: The covariances (3D tensor). Can be omitted if `cov_chol` is passed.
+        :param last_measured: See `StateBelief`.
+        :param validate: See `StateBelief`.
+        :param cov_chol: The lower cholesky-factor of the covariances (3D tensor). Can be omitted if `covs` is passed.
+        """
+        if covs is None and cov_chol is None:
+            raise TypeError("Must pass `covs` or `cov_chol`.")
+        self._covs = None
+        self._cov_chol = None
+        super().__init__(means=means, covs=covs, last_measured=last_measured, validate=False)
+        if cov_chol is not None:
+            self._cov_chol = cov_chol
+        if validate:
+            self._validate()
+
+    @property
+    def covs(self) -> Tensor:
+        if self._covs is None:
+            self._covs = self._cov_chol.matmul(self._cov_chol.transpose(-1, -2))
+        return self._covs
+
+    @covs.setter
+    def covs(self, covs: Tensor):
+        self._covs = covs
+        self._cov_chol = None
+
+    @property
+    def cov_chol(self) -> Tensor:
+        if self._cov_chol is None:
+            self._cov_chol = psd_cholesky(self._covs)
+        return self._cov_chol
+
+    @cov_chol.setter
+    def cov_chol(self, cov_chol: Tensor):
+        self._cov_chol = cov_chol
+        self._covs = None
+
+    def copy(self) -> 'SquareRootGaussian':
+        sb = super().copy()
+        sb.cov_chol = self.cov_chol.clone()
+        return sb
+
+    def predict(self,
+                F: Tensor,
+                Q: Tensor,
+                covs: Optional[Tensor] = None,
+                F_blocks: Optional[Blocks] = None) -> 'SquareRootGaussian':
+        if covs is not None:
+            return super().predict(F=F, Q=Q, covs=covs, F_blocks=F_blocks)
+        means = transition_means(F, self.means, F_blocks)
+        F_chol = F.matmul(self.cov_chol) if F_blocks is None else block_matmul(F, self.cov_chol, F_blocks)
+        pre_array = torch.cat([F_chol.transpose(-1, -2), psd_cholesky(Q).transpose(-1, -2)], -2)
+        return type(self)(
+            means=means,
+            cov_chol=tril_from_qr(pre_array),
+            last_measured=self.last_measured + 1,
+            validate=False
+        )
+
+    def update(self, obs: Tensor, **kwargs) -> 'SquareRootGaussian':
+        if 'time' in kwargs:
+            time = kwargs.pop('time')
+            if time >= obs.shape[1]:
+                return self.copy()
+            return self.update(obs=obs[:, time], **kwargs)
+
+        if torch.isinf(obs).any():
+            raise RuntimeError("Infs not allowed in `obs`")
+
+        # missing measures are masked out instead of updating groups separately depending on which are missing:
+        obs_masked, H, R, is_valid = mask_missing(obs, self.H, self.R)
+        num_groups, num_measures, state_size = H.shape
+
+        # triangularize the pre-array; the result is [[S^.5, 0], [K_bar, L_new]]:
+        L = self.cov_chol
+        pre_array = torch.cat(
+            [
+                torch.cat([torch.cholesky(R), H.matmul(L)], -1),
+                torch.cat([torch.zeros((num_groups, state_size, num_measures), dtype=L.dtype, device=L.device), L], -1)
+            ],
+            -2
+        )
+        post_array = tril_from_qr(pre_array.transpose(-1, -2))
+        system_chol = post_array[:, :num_measures, :num_measures]
+        self.cache_system_chol(system_chol, is_valid=is_valid)
+        K_bar = post_array[:, num_measures:, :num_measures]
+        cov_chol = post_array[:, num_measures:, num_measures:]
+
+        # kalman-gain is K_bar @ S^-.5:
+        resid = obs_masked - H.matmul(self.means.unsqueeze(-1)).squeeze(-1)
+        resid_std, _ = torch.triangular_solve(resid.unsqueeze(-1), system_chol, upper=False)
+        means = self.means + K_bar.matmul(resid_std).squeeze(-1)
+
+        return type(self)(
+            means=means,
+            cov_chol=cov_chol,
+            last_measured=self._update_last_measured(obs),
+            validate=False
+        )
+
+    def _compute_system_chol(self, H: Tensor, R: Tensor) -> Tensor:
+        # the cholesky-factor of the system-covariance comes from a QR-decomposition of [H @ L, R^.5]:
+        HL = H.matmul(self.cov_chol)
+        return tril_from_qr(torch.cat([HL.transpose(-1, -2), torch.cholesky(R).transpose(-1, -2)], -2))
+
+    @classmethod
+    def concatenate_over_time(cls,
+                              state_beliefs: Union[Sequence['SquareRootGaussian'], StateBeliefBuffer],
+                              design: Design) -> 'SquareRootGaussianOverTime':
+        buffer = StateBeliefBuffer.from_state_beliefs(state_beliefs)
+        return SquareRootGaussianOverTime(**buffer.tensors(), design=design, family=cls)
+
+    def sample_transition(self, eps: Optional[Tensor] = None) -> Tensor:
+        distribution = MultivariateNormal(loc=self.means, scale_tril=self.cov_chol, validate_args=False)
+        return deterministic_sample_mvnorm(distribution, eps=eps)
+
+    def _realize(self, ntry: int, eps: Optional[Tensor] = None) -> None:
+        # no decomposition needed, so no need to retry with an increased diagonal:
+        self.means = self.sample_transition(eps=eps)
+        self.cov_chol = torch.zeros_like(self.cov_chol)
+
+
+class SquareRootGaussianOverTime(GaussianOverTime):
+    def __init__(self,
+                 means: Tensor,
+                 cov_chols: Tensor,
+                 last_measured: Tensor,
+                 design: Design,
+                 family: Type[SquareRootGaussian],
+                 H: Optional[Tensor] = None,
+                 R: Optional[Tensor] = None,
+                 **kwargs):
+        super().__init__(
+            means=means, covs=None, last_measured=last_measured, design=design, family=family, H=H, R=R, **kwargs
+        )
+        self.cov_chols = cov_chols
+
+    @property
+    def covs(self) -> Tensor:
+        if self._covs is None:
+            self._covs = self.cov_chols.matmul(self.cov_chols.transpose(-1, -2))
+        return self._covs
+
+    def _compute_system_chol(self, H: Tensor, R: Tensor, idx: Tuple[Selector, Selector]) -> Tensor:
+        # the cholesky-factor of the system-covariance comes from a QR-decomposition of [H @ L, R^.5]:
+        HL = H.matmul(self.cov_chols[idx])
+        return tril_from_qr(torch.cat([HL.transpose(-1, -2), torch.cholesky(R).transpose(-1, -2)], -2))
+
+
+def tril_from_qr(x: Tensor) -> Tensor:
+    """
+    Given `x` with shape (..., N, M), N >= M, return the lower-triangular `L` (..., M, M), with non-negative diagonal,
+    such that `L @ L.T == x.T @ x`.
+    """
+    _, r = torch.qr(x)
+    L = r.transpose(-1, -2)
+    signs = torch.sign(torch.diagonal(L, dim1=-2, dim2=-1))
+    signs = torch.where(signs == 0, torch.ones_like(signs), signs)
+    return L * signs.unsqueeze(-2)
+
+
+def psd_cholesky(x: Tensor) -> Tensor:
+    """
+    Cholesky-decomposition that allows for rows/columns that are entirely zero (e.g. state-elements without
+    process-variance).
+    """
+    is_zero = (torch.diagonal(x, dim1=-2, dim2=-1) == 0)
+    if not is_zero.any():
+        return torch.cholesky(x)
+    is_zero = is_zero.to(dtype=x.dtype)
+    L = torch.cholesky(x + torch.diag_embed(is_zero))
+    return L * (1. - is_zero).unsqueeze(-1)
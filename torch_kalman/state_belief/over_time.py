@@ -1,9 +1,9 @@
-from collections import defaultdict
-from typing import Sequence, Dict, Tuple, Union, Optional, Iterable
+from typing import Sequence, Dict, Tuple, Union, Optional, Type
 from warnings import warn
 
 import torch
 from lazy_object_proxy.utils import cached_property
+from tqdm import tqdm
 
 from torch import Tensor
 
@@ -22,62 +22,94 @@ Selector = Union[Sequence[int], slice]
 
 class StateBeliefOverTime(NiceRepr):
     """
-    The output of the KalmanFilter forward pass, containing a sequence of StateBeliefs which represent one-step-ahead
-    predictions.
+    The output of the KalmanFilter forward pass, representing one-step-ahead predictions over time. The means,
+    covariances, etc. are stored in tensors whose first two dimensions are (group, time).
 
     Contains methods for evaluating the predictions (log_prob), converting them into dataframes (to_dataframe), and for
     sampling from the underlying distribution (sample_measurements).
     """
     _repr_attrs = ('num_groups', 'num_timesteps')
 
-    def __init__(self, state_beliefs: Sequence['StateBelief'], design: Design):
+    def __init__(self,
+                 means: Tensor,
+                 covs: Optional[Tensor],
+                 last_measured: Tensor,
+                 design: Design,
+                 family: Type[StateBelief],
+                 H: Optional[Tensor] = None,
+                 R: Optional[Tensor] = None,
+                 system_chol: Optional[Tensor] = None,
+                 system_chol_valid: Optional[Tensor] = None):
         """
-        :param state_beliefs: A sequence of StateBelief objects, representing one-step-ahead predictions.
-        :param design: The design of the kalman-filter that produced these StateBeliefs
+        :param means: The means, with dims (group, time, state).
+        :param covs: The covariances, with dims (group, time, state, state).
+        :param last_measured: The number of timesteps since each group was last measured, with dims (group, time).
+        :param design: The design of the kalman-filter that produced these predictions.
+        :param family: The StateBelief class for a single timestep.
+        :param H: The measurement-matrices, with dims (group, time, measure, state).
+        :param R: The measure-covariances, with dims (group, time, measure, measure).
+        :param system_chol: Optional cholesky-factors of the system-covariance that were computed in the forward-pass,
+        with dims (group, time, measure, measure). See `StateBelief.cache_system_chol()`.
+        :param system_chol_valid: If `system_chol` is passed, a boolean tensor with dims (group, time, measure)
+        indicating which measures were not missing when it was computed.
         """
-        self.state_beliefs = state_beliefs
         self.design = design
-        self.family = self.state_beliefs[0].__class__
-        self.num_groups = self.state_beliefs[0].num_groups
-        self.num_timesteps = len(state_beliefs)
-
-        # the last idx where any updates/predicts occurred:
-        self.last_update_idx = torch.zeros(self.num_groups, dtype=torch.int)
-        for t, state_belief in enumerate(state_beliefs):
-            # TODO: any cases where this would be zero?
-            self.last_update_idx[state_belief.last_measured <= 1] = t
-
-        self._means = None
-        self._covs = None
-        self._last_measured = None
-        self._H = None
-        self._R = None
-
-    # Attributes stacked from the contained StateBeliefs ---------:
+        self.family = family
+        self.num_groups, self.num_timesteps = last_measured.shape
+        self.last_measured = last_measured
+
+        # the last idx where any updates/predicts occurred (zero for a group that was never updated):
+        times = torch.arange(self.num_timesteps, device=last_measured.device).expand(self.num_groups, -1)
+        self.last_update_idx = torch.where(last_measured <= 1, times, torch.zeros_like(times)).max(1)[0].to(torch.int)
+
+        self._means = means
+        self._covs = covs
+        self._H = H
+        self._R = R
+        self._system_chol_cache = None if system_chol is None else (system_chol, system_chol_valid)
+        self._state_beliefs = None
+
+    # Stacked attributes ---------:
     @property
     def means(self) -> Tensor:
-        if self._means is None:
-            self._means_covs()
         return self._means
 
     @property
     def covs(self) -> Tensor:
-        if self._covs is None:
-            self._means_covs()
         return self._covs
 
     @property
     def H(self) -> Tensor:
         if self._H is None:
-            self._H = torch.stack([sb.H for sb in self.state_beliefs], 1)
+            raise UnmeasuredError("These state-beliefs were not measured (`compute_measurement` was not called).")
         return self._H
 
     @property
     def R(self) -> Tensor:
         if self._R is None:
-            self._R = torch.stack([sb.R for sb in self.state_beliefs], 1)
+            raise UnmeasuredError("These state-beliefs were not measured (`compute_measurement` was not called).")
         return self._R
 
+    @property
+    def system_chol_cache(self) -> Optional[Tuple[Tensor, Tensor]]:
+        """
+        :return: The `system_chol` and `system_chol_valid` tensors passed to `__init__()`, or None if they weren't.
+        """
+        return self._system_chol_cache
+
+    @property
+    def state_beliefs(self) -> Sequence[StateBelief]:
+        """
+        A StateBelief for each timestep. These are created (on first access) from the stacked tensors, so using the
+        tensors directly is preferred.
+        """
+        if self._state_beliefs is None:
+            self._state_beliefs = [
+                self._restore_sb((torch.arange(self.num_groups), torch.full((self.num_groups,), t, dtype=torch.long)))
+                for t in range(self.num_timesteps)
+            ]
+        return self._state_beliefs
+
     # Information for Prediction ---------:
     @cached_property
     def predictions(self) -> Tensor:
@@ -113,7 +145,7 @@ class StateBeliefOverTime(NiceRepr):
         """
         if len(time_idx) != self.num_groups:
             raise ValueError("Expected len(time_idx) to == num_groups.")
-        return self._restore_sb(enumerate(time_idx))
+        return self._restore_sb((torch.arange(self.num_groups), torch.as_tensor(time_idx, dtype=torch.long)))
 
     def last_update(self) -> StateBelief:
         """
@@ -121,7 +153,7 @@ class StateBeliefOverTime(NiceRepr):
         measurement.
         :return: A StateBelief.
         """
-        return self._restore_sb(enumerate(self.last_update_idx.tolist()))
+        return self._restore_sb((torch.arange(self.num_groups), self.last_update_idx.to(torch.long)))
 
     # Distribution-Methods -----------:
     def log_prob(self, obs: Tensor, **kwargs) -> Tensor:
@@ -133,78 +165,7 @@ class StateBeliefOverTime(NiceRepr):
           upper and lower bounds).
         :return: A tensor with one element for each group X timestep indicating the log-probability.
         """
-        if obs.grad_fn is not None:
-            warn("`obs` has a grad_fn, nans may propagate to gradient")
-
-        num_groups, num_times, num_dist_dims = obs.shape
-        assert self.predictions.shape[2] == num_dist_dims
-
-        """
-        group into chunks for log-prob evaluation. the way indexing works makes this tricky, and slow if we just create 
-        a separate group X measure index for each separate time-slice. two shortcuts are used to mitigate this:
-        (1) the first N time-slices that are nan-free will all be evaluated as a chunk
-        (2) subsequent nan-free slices use `slice` notation instead of having to iterate through each group, checking
-            which measures were nan
-        For all other time-points, we need a separate (group-indices, time-index, measure-indices) tuple.
-        """
-
-        times_without_nan = list()
-        last_nonan_t = -1
-        lp_groups = defaultdict(list)
-        for t in range(num_times):
-            if torch.isnan(obs[:, t]).all():
-                # no log-prob needed
-                continue
-
-            if not torch.isnan(obs[:, t]).any():
-                # will be updated as block:
-                if last_nonan_t == (t - 1):
-                    last_nonan_t += 1
-                else:
-                    times_without_nan.append(t)
-                continue
-
-            for g in range(num_groups):
-                is_nan = torch.isnan(obs[g, t])
-                if is_nan.all():
-                    # no log-prob needed
-                    continue
-                measure_idx = self._which_valid_key(is_nan)
-                lp_groups[(t, measure_idx)].append(g)
-
-        lp_groups = [(gidx, t, midx) for (t, midx), gidx in lp_groups.items()]
-
-        # shortcuts:
-        if last_nonan_t >= 0:
-            gtm = slice(None), slice(last_nonan_t + 1), slice(None)
-            lp_groups.append(gtm)
-        if len(times_without_nan):
-            gtm = slice(None), times_without_nan, slice(None)
-            lp_groups.append(gtm)
-
-        # compute log-probs by dims available:
-        out = torch.zeros((num_groups, num_times))
-        for group_idx, time_idx, measure_idx in lp_groups:
-            if isinstance(time_idx, int):
-                # assignment is dimensionless in time; needed b/c group isn't a slice
-                out[group_idx, time_idx] = self._log_prob_with_subsetting(
-                    obs=obs,
-                    group_idx=group_idx,
-                    time_idx=(time_idx,),
-                    measure_idx=measure_idx,
-                    **kwargs
-                ).squeeze(-1)
-            else:
-                # time has dimension, but group is a slice so it's OK
-                out[group_idx, time_idx] = self._log_prob_with_subsetting(
-                    obs=obs,
-                    group_idx=group_idx,
-                    time_idx=time_idx,
-                    measure_idx=measure_idx,
-                    **kwargs
-                )
-
-        return out
+        raise NotImplementedError
 
     def sample_measurements(self, eps: Optional[Union[Tensor, float]] = None) -> Tensor:
         """
@@ -216,6 +177,24 @@ class StateBeliefOverTime(NiceRepr):
         """
         raise NotImplementedError
 
+    def smooth(self,
+               obs: Tensor,
+               F: Tensor,
+               means_only: bool = False,
+               progress: Union[tqdm, bool] = False) -> Tuple[Tensor, Optional[Tensor]]:
+        """
+        Fixed-interval smoothing: given one-step-ahead predictions (i.e. the output of `KalmanFilter.forward()` with
+        `n_step=1`), compute the mean and covariance of the state at each timestep given *all* of the observations.
+
+        :param obs: The observations that were used to generate these predictions.
+        :param F: The transition-matrices, with dims (group, time, state, state); element `[:, t]` is the transition
+        from t to t+1, so at least `num_timesteps - 1` timesteps are needed.
+        :param means_only: If True, the (more expensive) smoothed covariances are not computed.
+        :param progress: Should a progress-bar be displayed?
+        :return: A tuple with the smoothed means and covariances (None if `means_only`).
+        """
+        raise NotImplementedError
+
     # Exporting to other Formats ---------:
     def to_dataframe(self,
                      dataset: Union[TimeSeriesDataset, dict],
@@ -326,19 +305,13 @@ class StateBeliefOverTime(NiceRepr):
         return concat(out, sort=True)
 
     def _components(self) -> Dict[Tuple[str, str, str], Tuple[Tensor, Tensor]]:
-        states_per_measure = defaultdict(list)
-        for state_belief in self.state_beliefs:
-            for m, measure in enumerate(self.design.measures):
-                H = state_belief.H[:, m, :].data
-                m = H * state_belief.means.data
-                std = H * torch.diagonal(state_belief.covs.data, dim1=-2, dim2=-1).sqrt()
-                states_per_measure[measure].append((m, std))
-
+        all_means = self.means.data
+        all_stds = torch.diagonal(self.covs.data, dim1=-2, dim2=-1).sqrt()
         out = {}
-        for measure, means_and_stds in states_per_measure.items():
-            means, stds = zip(*means_and_stds)
-            means = torch.stack(means).permute(1, 0, 2)
-            stds = torch.stack(stds).permute(1, 0, 2)
+        for m, measure in enumerate(self.design.measures):
+            H = self.H[:, :, m, :].data
+            means = H * all_means
+            stds = H * all_stds
             for s, (process_name, state_element) in enumerate(self.design.state_elements):
                 if ~torch.isclose(means[:, :, s].abs().max(), torch.zeros(1)):
                     out[(measure, process_name, state_element)] = (means[:, :, s], stds[:, :, s])
@@ -434,46 +407,188 @@ class StateBeliefOverTime(NiceRepr):
         return plot + theme_bw() + theme(**kwargs)
 
     # Private utils ---------:
-    def _restore_sb(self, indices: Iterable[Tuple[int, int]]) -> StateBelief:
-        means, covs, H, R = [], [], [], []
-        for g, t in indices:
-            means.append(self.means[g, t])
-            covs.append(self.covs[g, t])
-            H.append(self.H[g, t])
-            R.append(self.R[g, t])
-        sb = self.family(torch.stack(means), torch.stack(covs))
+    def _restore_sb(self, indices: Tuple[Tensor, Tensor]) -> StateBelief:
+        """
+        :param indices: A tuple of two 1D tensors, with the group-indices and the time-indices.
+        :return: A StateBelief with the (group, time) elements of each tensor.
+        """
+        group_idx, time_idx = indices
+        kwargs = {sb_attr: getattr(self, attr)[group_idx, time_idx] for sb_attr, attr in self.family.stacked_attrs}
+        sb = self.family(**kwargs, last_measured=self.last_measured[group_idx, time_idx])
+        if self._H is not None:
+            sb.compute_measurement(H=self._H[group_idx, time_idx], R=self._R[group_idx, time_idx])
+        return sb
+
+
+class StateBeliefBuffer:
+    """
+    Collects StateBeliefs (e.g. as they are generated in the forward-pass) into tensors with dims (group, time, ...).
+    When gradients aren't being tracked and the number of timesteps is known in advance, these tensors are preallocated
+    and written into directly, so there is only one copy of the outputs. Otherwise the tensors are stacked at the end,
+    since repeatedly writing in-place into a tensor that's part of the graph makes the backward-pass slow. In that case
+    this saves no memory: the per-timestep tensors are kept by the graph anyway, and stacking them makes a second copy.
+    When training, use `KalmanFilter.loglik()` instead, which doesn't keep the outputs.
+
+    Along with each StateBelief, the cholesky-factor of the system-covariance from its update can be stored, so that it
+    can be re-used in `log_prob()` (see `StateBelief.cache_system_chol`).
+    """
+
+    def __init__(self, num_timesteps: Optional[int] = None):
+        """
+        :param num_timesteps: The number of timesteps that will be added, if known.
+        """
+        self.num_timesteps = num_timesteps
+        self.family = None
+        self.num_appended = 0
+        self._preallocated = None
+        self._tensors = None
+
+    @classmethod
+    def from_state_beliefs(cls,
+                           state_beliefs: Union['StateBeliefBuffer', Sequence[StateBelief]]) -> 'StateBeliefBuffer':
+        if isinstance(state_beliefs, cls):
+            return state_beliefs
+        buffer = cls(num_timesteps=len(state_beliefs))
+        for state_belief in state_beliefs:
+            buffer.append(state_belief, system_chol=state_belief.system_chol_cache)
+        return buffer
+
+    def __len__(self) -> int:
+        return self.num_appended
+
+    def append(self, state_belief: StateBelief, system_chol: Optional[Tuple[Tensor, Tensor]] = None):
+        """
+        :param state_belief: A StateBelief.
+        :param system_chol: Optional. The output of `state_belief.system_chol_cache`, once it has been updated. If
+        not passed, a placeholder is stored, and `log_prob()` will compute the cholesky-factor for this timestep.
+        """
+        values = {attr: getattr(state_belief, attr) for attr, _ in type(state_belief).stacked_attrs}
+        values['last_measured'] = state_belief.last_measured
         try:
-            sb.compute_measurement(H=torch.stack(H), R=torch.stack(R))
+            values['H'], values['R'] = state_belief.H, state_belief.R
         except UnmeasuredError:
             pass
-        return sb
+        else:
+            if system_chol is None:
+                values.update(self._no_system_chol(values['H']))
+            else:
+                values['system_chol'], values['system_chol_valid'] = system_chol
+        self._add(type(state_belief), values, num_timesteps=None)
 
-    @staticmethod
-    def _which_valid_key(is_nan: Tensor) -> Tuple[int]:
-        num_multi_dims = sum(x > 1 for x in is_nan.shape)
-        if num_multi_dims > 1:
-            raise ValueError("Expected `tensor` to be 1D (or have only one non-singleton dimension.")
-        is_valid = ~is_nan
-        return tuple(is_valid.nonzero().squeeze(-1).tolist())
-
-    def _means_covs(self) -> None:
-        means, covs = zip(*[(state_belief.means, state_belief.covs) for state_belief in self.state_beliefs])
-        self._means = torch.stack(means, 1)
-        self._covs = torch.stack(covs, 1)
-
-    def _log_prob_with_subsetting(self,
-                                  obs: Tensor,
-                                  group_idx: Selector,
-                                  time_idx: Selector,
-                                  measure_idx: Selector,
-                                  **kwargs) -> Tensor:
-        raise NotImplementedError
+    def extend_stacked(self, family: Type[StateBelief], **values):
+        """
+        Add multiple timesteps at once.
+
+        :param family: The StateBelief class.
+        :param values: Tensors with dims (group, time, ...), for each of `family.stacked_attrs`, for `last_measured`,
+        and (optionally) for `H` and `R`.
+        """
+        if 'H' in values and 'system_chol' not in values:
+            values.update(self._no_system_chol(values['H']))
+        self._add(family, values, num_timesteps=values['last_measured'].shape[1])
+
+    def tensors(self) -> Dict[str, Tensor]:
+        """
+        :return: A dictionary of stacked tensors, with the keyword-arguments for a `StateBeliefOverTime`.
+        """
+        if self._tensors is None:
+            raise RuntimeError("Buffer is empty.")
+        names = dict(self.family.stacked_attrs)
+        out = {}
+        for attr, value in self._tensors.items():
+            if self._preallocated:
+                value = value[:, :self.num_appended]
+            else:
+                value = torch.cat(value, 1)
+            out[names.get(attr, attr)] = value
+        return out
 
     @staticmethod
-    def _check_lp_sub_input(group_idx: Selector, time_idx: Selector):
-        if isinstance(group_idx, Sequence) and isinstance(time_idx, Sequence):
-            if len(group_idx) > 1 and len(time_idx) > 1:
-                warn(
-                    "Both `group_idx` and `time_idx` are indices (i.e. neither is an int or a slice). This is rarely "
-                    "the expected input."
-                )
+    def _no_system_chol(H: Tensor) -> Dict[str, Tensor]:
+        # placeholder for timesteps without a cached cholesky-factor. this is the correct value when every measure is
+        # missing, and otherwise will not match the pattern of missing measures, so it won't be used.
+        shape = H.shape[:-1]
+        return {
+            'system_chol': torch.eye(shape[-1], dtype=H.dtype, device=H.device).expand(*shape, -1),
+            'system_chol_valid': torch.zeros(shape, dtype=torch.bool, device=H.device)
+        }
+
+    def _add(self, family: Type[StateBelief], values: Dict[str, Tensor], num_timesteps: Optional[int]):
+        if self._tensors is None:
+            self.family = family
+            self._preallocated = self.num_timesteps is not None and not torch.is_grad_enabled()
+            if self._preallocated:
+                self._tensors = {}
+                for attr, value in values.items():
+                    trailing_shape = value.shape[1:] if num_timesteps is None else value.shape[2:]
+                    self._tensors[attr] = value.new_empty((value.shape[0], self.num_timesteps) + trailing_shape)
+            else:
+                self._tensors = {attr: [] for attr in values}
+        elif set(values) != set(self._tensors):
+            raise ValueError(f"Expected {set(self._tensors)}, got {set(values)}.")
+
+        for attr, value in values.items():
+            if self._preallocated:
+                if num_timesteps is None:
+                    self._tensors[attr][:, self.num_appended] = value
+                else:
+                    self._tensors[attr][:, self.num_appended:(self.num_appended + num_timesteps)] = value
+            else:
+                self._tensors[attr].append(value.unsqueeze(1) if num_timesteps is None else value)
+        self.num_appended += 1 if num_timesteps is None else num_timesteps
+
+
+class LogProbAccumulator(StateBeliefBuffer):
+    """
+    Used in place of a StateBeliefBuffer when only the log-probability of the observations is needed: as timesteps
+    are added, their log-prob is evaluated and added to a running total for each group, and the predictions themselves
+    are discarded.
+    """
+
+    def __init__(self, *args, design: Design):
+        """
+        :param args: The arguments to `StateBeliefOverTime.log_prob()` (e.g. the observations), with dims
+        (group, time, ...).
+        :param design: The design of the kalman-filter that produced the predictions.
+        """
+        super().__init__(num_timesteps=None)
+        self.args = args
+        self.design = design
+        self._total = None
+
+    def log_prob(self) -> Tensor:
+        """
+        :return: The log-prob of the observations, summed over timesteps; a tensor with one element for each group.
+        """
+        if self._total is None:
+            raise RuntimeError("No timesteps were added.")
+        return self._total
+
+    def tensors(self) -> Dict[str, Tensor]:
+        raise RuntimeError(f"{type(self).__name__} does not keep the predictions.")
+
+    def append(self, state_belief: StateBelief, system_chol: Optional[Tuple[Tensor, Tensor]] = None):
+        # evaluated directly from the state-belief (re-using the cholesky-factor from its update):
+        time = self.num_appended
+        self.num_appended += 1
+        if time >= self.args[0].shape[1]:
+            # past the end of the observations
+            return
+        args = (arg[:, time] if arg is not None else None for arg in self.args)
+        self._accumulate(state_belief.log_prob(*args, system_chol=system_chol))
+
+    def _add(self, family: Type[StateBelief], values: Dict[str, Tensor], num_timesteps: Optional[int]):
+        # multiple timesteps at once (see `extend_stacked()`):
+        start = self.num_appended
+        self.num_appended += num_timesteps
+        end = min(self.num_appended, self.args[0].shape[1])
+        if start >= end:
+            return
+        buffer = StateBeliefBuffer()
+        buffer._add(family, values, num_timesteps=num_timesteps)
+        over_time = family.concatenate_over_time(state_beliefs=buffer, design=self.design)
+        args = (arg[:, start:end] if arg is not None else None for arg in self.args)
+        self._accumulate(over_time.log_prob(*args).sum(1))
+
+    def _accumulate(self, log_prob: Tensor):
+        self._total = log_prob if self._total is None else self._total + log_prob
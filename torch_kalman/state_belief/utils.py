@@ -1,5 +1,6 @@
 from typing import Tuple, Optional
 
+import torch
 from torch import Tensor
 from torch.distributions import MultivariateNormal
 
@@ -42,3 +43,23 @@ def deterministic_sample_mvnorm(distribution: MultivariateNormal, eps: Optional[
             eps = 1.0
         eps *= _standard_normal(shape, dtype=distribution.loc.dtype, device=distribution.loc.device)
     return distribution.loc + _batch_mv(distribution._unbroadcasted_scale_tril, eps)
+
+
+def mask_missing(obs: Tensor, H: Tensor, R: Tensor) -> Tuple[Tensor, Tensor, Tensor, Tensor]:
+    """
+    Neutralize missing (nan) measurements so that a single batched update can be used no matter which measures are
+    missing: the rows of H for missing measures are zeroed, the corresponding rows/columns of R are replaced by the
+    identity, and the missing observations are zero-filled. Since the missing measures are then uncorrelated with the
+    state and with the other measures, they have no effect on the update.
+
+    :param obs: A tensor of observations, with the measure-dimension last.
+    :param H: The measurement-matrix, with shape `obs.shape + (state_size,)`.
+    :param R: The measure-covariance, with shape `obs.shape + (num_measures,)`.
+    :return: The masked obs, H, and R; and a boolean tensor indicating which elements of `obs` were not missing.
+    """
+    is_valid = ~torch.isnan(obs)
+    valid = is_valid.to(dtype=H.dtype)
+    obs = torch.where(is_valid, obs, torch.zeros_like(obs))
+    H = H * valid.unsqueeze(-1)
+    R = R * valid.unsqueeze(-1) * valid.unsqueeze(-2) + torch.diag_embed(1. - valid)
+    return obs, H, R, is_valid
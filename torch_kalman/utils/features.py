@@ -38,19 +38,14 @@ def fourier_model_mat(datetimes: np.ndarray,
     if output_dataframe:
         output_fmt = 'float64'
 
-    # fourier matrix:
-    out_shape = tuple(datetimes.shape) + (K * 2,)
-    out = np.empty(out_shape, dtype=output_fmt)
-    columns = []
-    for idx in range(K):
-        k = idx + 1
-        for is_cos in range(2):
-            val = 2. * np.pi * k * time / period_int
-            out[..., idx * 2 + is_cos] = np.sin(val) if is_cos == 0 else np.cos(val)
-            columns.append(f"{name}_K{k}_{'cos' if is_cos else 'sin'}")
+    # fourier matrix, with sin/cos for each k interleaved in the last dimension:
+    k = np.arange(1, K + 1)
+    val = 2. * np.pi * k * time[..., None] / period_int
+    out = np.stack([np.sin(val), np.cos(val)], axis=-1).reshape(tuple(datetimes.shape) + (K * 2,)).astype(output_fmt)
+    columns = [f"{name}_K{k}_{sincos}" for k in range(1, K + 1) for sincos in ('sin', 'cos')]
 
     if output_dataframe:
-        if len(out_shape) > 2:
+        if out.ndim > 2:
             raise ValueError("Cannot output dataframe when input is 2+D array.")
         from pandas import DataFrame
         out = DataFrame(out, columns=columns)
@@ -3,9 +3,13 @@ from typing import Union
 import torch
 import numpy as np
 from torch.nn import Linear
+from torch_kalman.internals.batch import BatchCache
 from torch_kalman.utils.datetime import DateTimeHelper
 from torch_kalman.utils.features import fourier_model_mat
 
+# the inputs are shared across modules (e.g. process- and measure-variance) with the same period, K, and datetimes:
+_model_mat_cache = BatchCache(maxsize=8)
+
 
 class FourierSeasonNN(Linear):
     def __init__(self,
@@ -23,12 +27,15 @@ class FourierSeasonNN(Linear):
         return super().forward(self._datetimes_to_tensor(datetimes))
 
     def _datetimes_to_tensor(self, datetimes: np.ndarray) -> torch.Tensor:
-        return torch.from_numpy(fourier_model_mat(
-            datetimes=datetimes,
-            K=self.K,
-            period=self.period,
-            output_fmt='float32'
-        ))
+        return _model_mat_cache.get(
+            key=_model_mat_cache.make_key(self.K, str(self.period), datetimes),
+            fun=lambda: torch.from_numpy(fourier_model_mat(
+                datetimes=datetimes,
+                K=self.K,
+                period=self.period,
+                output_fmt='float32'
+            ))
+        )
 
     def reset_parameters(self):
         super().reset_parameters()